@@ -1,12 +1,11 @@
 import logging
 import os
 import time
-from random import randint
-from time import sleep
 
 from django.apps import apps
 
 from celery import Celery
+from core.metrics import increment, timing
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings.base")
@@ -26,31 +25,130 @@ logger = logging.getLogger(__name__)
 
 
 @app.task(bind=True)
-def render_tex_task(self, model, pk, fields):
-    from training.tex import tex_to_svg
-
-    re_rendered_fields = {}
-    for target, source in fields.items():
-        re_rendered_fields[target] = tex_to_svg(source)
-
-    # for some reason, sometimes the object to be updated isn't immediately
-    # found using `filter` with its pk (!), so `update` is called and its return
-    # value gets checked - if it's 1, the object was correctly updated, otherwise
-    # celery should retry to fetch it. it *is* in the database, as this is called
-    # post_save and explicitly passed the object's pk; it's just that sometimes the
-    # first query returns an empty queryset (no clue why), so retrying shortly after
-    # is necessary
-    attempts = 0
-    while attempts < 5:
-        # ! if you have problems again, try testing
-        # ! `apps.get_model(...).filter(...)count()` against 0 instead of
-        # ! the return value of `update`
-        if (
-            apps.get_model(app_label="training", model_name=model)
-            .objects.filter(pk=pk)
-            .update(**re_rendered_fields)
-        ) == 1:  # object was correctly updated
-            break
-        # retry in a bit
-        sleep(randint(1, 5))
-        attempts += 1
+def render_tex_task(self, model, pk):
+    """
+    Renders the TeX fields of an item, along with those of its choices if it's a
+    question, writing only the ones whose rendering changed
+    """
+    from django.conf import settings
+    from django.core.cache import cache
+    from django.utils import timezone
+    from training.cache import touch_item
+    from training.node.process import NodeUnavailableError
+    from training.tex import tex_to_svg_many
+
+    # saves made from now on need a new task, as this one might read their values
+    # before they're committed
+    cache.delete(f"tex_render_scheduled:{model}:{pk}")
+
+    model_class = apps.get_model(app_label="training", model_name=model)
+
+    # tasks are dispatched once the item is committed, but it might still not be
+    # visible yet, e.g. on a lagging replica: rather than holding the worker, retry
+    # with an exponential backoff
+    item = model_class.objects.filter(pk=pk).first()
+    if item is None:
+        if self.request.retries >= settings.TEX_RENDER_MAX_RETRIES:
+            # deleted in the meantime
+            increment("tex.render.missing")
+            logger.warning(f"{model} {pk} not found, not rendering it")
+            return
+
+        increment("tex.render.retries")
+        raise self.retry(
+            countdown=2**self.request.retries,
+            max_retries=settings.TEX_RENDER_MAX_RETRIES,
+        )
+
+    objects = [item]
+    if model == "Question":
+        objects += list(item.choices.all())
+
+    # the formulas of the item and its choices are all rendered in one go
+    fields = [
+        (obj, source, target)
+        for obj in objects
+        for (source, target) in obj.renderable_tex_fields
+    ]
+    start = time.monotonic()
+    try:
+        rendered = tex_to_svg_many([getattr(obj, source) for obj, source, _ in fields])
+    except NodeUnavailableError as exc:
+        # node is failing: try again once the circuit breaker lets calls through
+        increment("tex.render.retries")
+        raise self.retry(exc=exc, countdown=settings.NODE_CIRCUIT_BREAKER_RESET_TIMEOUT)
+    timing("tex.render", (time.monotonic() - start) * 1000)
+
+    changed = {}
+    for (obj, _, target), value in zip(fields, rendered):
+        if getattr(obj, target) != value:
+            setattr(obj, target, value)
+            changed.setdefault(obj, []).append(target)
+
+    if not changed:
+        return
+
+    # renderings are written with `update`, which doesn't go through `save` and its
+    # signals, bumping `updated` so cached representations of the item are dropped
+    for obj, targets in changed.items():
+        update_fields = {target: getattr(obj, target) for target in targets}
+        if obj is item:
+            update_fields["updated"] = timezone.now()
+        type(obj).objects.filter(pk=obj.pk).update(**update_fields)
+    if item not in changed:
+        touch_item(model_class, pk)
+
+
+def fail_submission(model, pk):
+    logger.error(f"Submission {pk} couldn't be graded")
+    model.objects.filter(pk=pk).update(
+        status=model.DONE,
+        error="The submission couldn't be graded, please submit it again",
+    )
+
+
+# the task is only acknowledged once it's done, and delivered again if its worker dies
+# while grading: the redelivered task resumes the submission that was left running
+@app.task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def grade_submission_task(self, submission_id):
+    from django.conf import settings
+    from training.node.process import NodeProcessError, NodeUnavailableError
+
+    ExerciseSubmission = apps.get_model(
+        app_label="training", model_name="ExerciseSubmission"
+    )
+    # tasks don't grade the submission they were enqueued for, but whichever is next
+    # in line: there's one task per submission, so all of them get graded
+    submission = ExerciseSubmission.objects.claim_next(task_id=self.request.id or "")
+    if submission is None:  # all pending submissions have been claimed already
+        return
+
+    # submissions that crash node or run out of time are graded as killed by
+    # `grade`: the errors caught here are failures of node itself
+    try:
+        submission.grade()
+    except (NodeUnavailableError, NodeProcessError) as exc:
+        if self.request.retries < settings.GRADING_MAX_RETRIES:
+            # put the submission back in line and try again once the circuit
+            # breaker lets calls through
+            ExerciseSubmission.objects.filter(pk=submission.pk).update(
+                status=ExerciseSubmission.PENDING
+            )
+            raise self.retry(
+                exc=exc,
+                countdown=settings.NODE_CIRCUIT_BREAKER_RESET_TIMEOUT,
+                max_retries=settings.GRADING_MAX_RETRIES,
+            )
+        fail_submission(ExerciseSubmission, submission.pk)
+        raise
+    except Exception:
+        # the submission mustn't be left running forever
+        fail_submission(ExerciseSubmission, submission.pk)
+        raise
+
+
+@app.task(bind=True)
+def regrade_submissions_task(self, exercise_ids):
+    from django.core.management import call_command
+
+    call_command("regrade", exercise_ids=exercise_ids)
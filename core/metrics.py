@@ -0,0 +1,48 @@
+import logging
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# counters are kept in the default cache, which deployments share between processes,
+# and served by the `metrics` view; they're meant for dashboards and alerts, not for
+# exact accounting
+METRICS_TIMEOUT = None  # never expire
+
+# counters served by the `metrics` view
+METRICS = [
+    "node.kills",
+    "node.timeouts",
+    "node.crashes",
+    "node.vm.rejected",
+    "node.tex.rejected",
+    "tex.render.count",
+    "tex.render.total_ms",
+    "tex.render.retries",
+    "tex.render.missing",
+]
+
+
+def get_metric_key(name):
+    return f"metrics:{name}"
+
+
+def increment(name, amount=1):
+    key = get_metric_key(name)
+    try:
+        return cache.incr(key, amount)
+    except ValueError:  # the counter doesn't exist yet
+        if cache.add(key, amount, METRICS_TIMEOUT):
+            return amount
+        return cache.incr(key, amount)
+
+
+def timing(name, milliseconds):
+    # durations are kept as a count and a total, enough for averages over time
+    increment(f"{name}.count")
+    increment(f"{name}.total_ms", round(milliseconds))
+
+
+def get_counters(names):
+    values = cache.get_many([get_metric_key(name) for name in names])
+    return {name: values.get(get_metric_key(name), 0) for name in names}
@@ -0,0 +1,31 @@
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+
+from core.renderers import FastJSONRenderer, fast_json_enabled, orjson
+
+
+class FastJSONParser(JSONParser):
+    """
+    Parses JSON-serialized data using orjson if it's installed, falling back to DRF's
+    parser otherwise
+    """
+
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+
+        # orjson only accepts utf-8, and always rejects NaN and infinity
+        if (
+            not fast_json_enabled()
+            or not self.strict
+            or encoding.lower() not in ("utf-8", "utf8")
+        ):
+            return super().parse(stream, media_type, parser_context)
+
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError("JSON parse error - %s" % str(exc))
@@ -0,0 +1,86 @@
+import datetime
+import math
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import ISO_8601, api_settings
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def fast_json_enabled():
+    return orjson is not None and getattr(settings, "USE_FAST_JSON", True)
+
+
+def _default(obj):
+    """
+    Called by orjson for the types it can't natively serialize: datetimes are
+    formatted using DRF's `DATETIME_FORMAT` so they look the same as those going
+    through serializer fields, everything else is handed over to DRF's encoder
+    """
+    if isinstance(obj, datetime.datetime):
+        if settings.USE_TZ and timezone.is_aware(obj):
+            # same conversion DRF's `DateTimeField` applies before formatting
+            obj = timezone.localtime(obj)
+        output_format = api_settings.DATETIME_FORMAT
+        if output_format is None or output_format.lower() == ISO_8601:
+            return obj.isoformat()
+        return obj.strftime(output_format)
+
+    return encoders.JSONEncoder().default(obj)
+
+
+def _has_non_finite_floats(data):
+    # walks the containers orjson serializes natively, looking for NaN or infinity
+    stack = [data]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, float):
+            if not math.isfinite(obj):
+                return True
+        elif isinstance(obj, dict):
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+    return False
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    Renderer which serializes to JSON using orjson if it's installed. Falls back to
+    DRF's renderer if it isn't, or if the output needs to be indented (e.g. for the
+    browsable API)
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not fast_json_enabled() or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # datetimes are serialized through `_default` rather than natively, so they
+        # follow `DATETIME_FORMAT`; `ReturnDict` and `ReturnList` are dict and list
+        # subclasses, which orjson serializes natively
+        ret = orjson.dumps(
+            data,
+            default=_default,
+            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS,
+        )
+
+        # orjson writes NaN and infinity as null: leave them to DRF's renderer, which
+        # refuses them in strict mode. The data only needs checking if there's a null
+        # in the output
+        if b"null" in ret and _has_non_finite_floats(data):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # keep the output a strict javascript subset like DRF's renderer does
+        return ret.replace("\u2028".encode(), b"\\u2028").replace(
+            "\u2029".encode(), b"\\u2029"
+        )
@@ -148,6 +148,29 @@ MEDIA_ROOT = os.environ.get("MEDIA_ROOT", os.path.join(PROJECT_DIR, "media"))
 MEDIA_URL = os.environ.get("MEDIA_URL", "/media/")
 
 
+# Caches
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# the default cache holds state that must be the same for all processes, like rate
+# limits and invalidated entries: deployments need a shared backend (see prod.py),
+# the local memory one only works for a single process
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # outcomes of graded submissions, keyed by the hash of their code and testcases:
+    # least recently used entries are evicted once MAX_ENTRIES is reached
+    "grading": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "grading",
+        "TIMEOUT": 60 * 60 * 24,
+        "OPTIONS": {
+            "MAX_ENTRIES": 5000,
+        },
+    },
+}
+
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -167,14 +190,34 @@ REST_FRAMEWORK = {
     "TEST_REQUEST_DEFAULT_FORMAT": "json",
     "DEFAULT_PERMISSION_CLASSES": ("rest_framework.permissions.IsAuthenticated",),
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework.authentication.TokenAuthentication",
+        # wraps the classes in `CACHED_AUTHENTICATION_CLASSES`
+        "users.authentication.CachedTokenAuthentication",
         "rest_framework.authentication.SessionAuthentication",  # for browsable api
-        "oauth2_provider.contrib.rest_framework.OAuth2Authentication",  # django-oauth-toolkit >= 1.0.0
         "rest_framework_social_oauth2.authentication.SocialAuthentication",
     ),
+    "DEFAULT_RENDERER_CLASSES": (
+        "core.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ),
+    "DEFAULT_PARSER_CLASSES": (
+        "core.parsers.FastJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ),
     "DATETIME_FORMAT": "%Y-%m-%d %H:%M:%S",
 }
 
+# authentication classes whose results are cached by `CachedTokenAuthentication`
+CACHED_AUTHENTICATION_CLASSES = [
+    "rest_framework.authentication.TokenAuthentication",
+    "oauth2_provider.contrib.rest_framework.OAuth2Authentication",  # django-oauth-toolkit >= 1.0.0
+]
+# seconds for which tokens are mapped to their user without hitting the database
+AUTH_TOKEN_CACHE_TIMEOUT = int(os.environ.get("AUTH_TOKEN_CACHE_TIMEOUT", 60))
+
+# use orjson to render and parse API payloads when it's installed
+USE_FAST_JSON = os.environ.get("USE_FAST_JSON", "true").lower() == "true"
+
 # only allow access to uni emails
 SOCIAL_AUTH_GOOGLE_OAUTH2_WHITELISTED_DOMAINS = [
     "studenti.unipi.it",
@@ -219,3 +262,62 @@ MANAGERS = [("Samuele", "s.bonini7@studenti.unipi.it")]
 # Celery settings
 CELERY_RESULT_BACKEND = "django-db"
 CELERY_BROKER_URL = os.environ.get("REDIS_URL", "redis://localhost:6379")
+
+# Node workers used to grade programming exercises: set the pool size to 0 to
+# spawn a new node process for each submission instead
+NODE_VM_POOL_SIZE = int(os.environ.get("NODE_VM_POOL_SIZE", 2))
+NODE_VM_WORKER_MAX_JOBS = int(os.environ.get("NODE_VM_WORKER_MAX_JOBS", 200))
+NODE_VM_WORKER_HEALTH_CHECK_INTERVAL = 30  # seconds
+# submissions graded by each node process spawned by `run_many_in_vm`
+NODE_VM_BATCH_SIZE = int(os.environ.get("NODE_VM_BATCH_SIZE", 50))
+
+# hard limits for every node process: wall-clock seconds a submission may run for,
+# or a TeX formula may take to render, before node is killed, and memory it may use
+NODE_VM_TIMEOUT = int(os.environ.get("NODE_VM_TIMEOUT", 10))
+NODE_TEX_TIMEOUT = int(os.environ.get("NODE_TEX_TIMEOUT", 10))
+NODE_MEMORY_LIMIT_MB = int(os.environ.get("NODE_MEMORY_LIMIT_MB", 512))
+# render TeX with a long-lived MathJax process rather than one node process per formula
+NODE_TEX_SERVER = os.environ.get("NODE_TEX_SERVER", "true").lower() == "true"
+# rendered formulas kept in the database, least recently used ones are trimmed first
+TEX_FORMULA_CACHE_MAX_ENTRIES = int(
+    os.environ.get("TEX_FORMULA_CACHE_MAX_ENTRIES", 20000)
+)
+# reference formulas in texts as content-hashed svg images under `MEDIA_ROOT`, rather
+# than embedding them: images are cached by browsers across texts, but they're always
+# drawn in black instead of the color of the surrounding text
+TEX_FORMULA_ASSETS = os.environ.get("TEX_FORMULA_ASSETS", "false").lower() == "true"
+# seconds to wait for more changes to an item before rendering its TeX
+TEX_RENDER_DEBOUNCE = int(os.environ.get("TEX_RENDER_DEBOUNCE", 5))
+# retries, with exponential backoff, for items that aren't found when rendered
+TEX_RENDER_MAX_RETRIES = 5
+# seconds for which the relation of a user to a course, e.g. being enrolled, and the
+# courses a teacher can see are cached: entries are dropped when memberships change,
+# which reaches every process only with a shared cache, and otherwise this bounds how
+# long they can be outdated
+COURSE_ACCESS_CACHE_TIMEOUT = 60
+# consecutive node failures after which calls are rejected for a while
+NODE_CIRCUIT_BREAKER_THRESHOLD = 5
+NODE_CIRCUIT_BREAKER_RESET_TIMEOUT = 30  # seconds
+
+# grade submissions on the `grading` celery queue rather than inside the request
+GRADE_SUBMISSIONS_ASYNC = (
+    os.environ.get("GRADE_SUBMISSIONS_ASYNC", "true").lower() == "true"
+)
+# default limits on programming exercise submissions, which courses can override
+SUBMISSION_RATE = int(os.environ.get("SUBMISSION_RATE", 6))  # per minute
+SUBMISSION_BURST = int(os.environ.get("SUBMISSION_BURST", 3))
+SUBMISSION_CONCURRENCY = int(os.environ.get("SUBMISSION_CONCURRENCY", 2))
+# times the grading of a submission is retried while node is failing, before the
+# submission is marked as done with an error
+GRADING_MAX_RETRIES = int(os.environ.get("GRADING_MAX_RETRIES", 10))
+# seconds after which a submission that's still being graded is deemed abandoned by a
+# worker that died: it stops counting toward its user's concurrent submissions, and is
+# put back in line to be graded
+GRADING_STALE_AFTER = 10 * 60
+# submissions that can wait to be graded before new ones are refused
+GRADING_QUEUE_MAX_SIZE = int(os.environ.get("GRADING_QUEUE_MAX_SIZE", 500))
+GRADING_RETRY_AFTER = 5  # seconds
+CELERY_TASK_ROUTES = {
+    "core.celery.grade_submission_task": {"queue": "grading"},
+    "core.celery.regrade_submissions_task": {"queue": "grading"},
+}
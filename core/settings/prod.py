@@ -12,6 +12,15 @@ DATABASES = {
     )
 }
 
+# rate limits, cache invalidations and the like must be seen by all the processes
+CACHES = {
+    **CACHES,
+    "default": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": os.environ.get("REDIS_CACHE_URL", CELERY_BROKER_URL),
+    },
+}
+
 MIDDLEWARE = ["whitenoise.middleware.WhiteNoiseMiddleware"] + MIDDLEWARE
 # STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 WHITENOISE_MAX_AGE = 604800 * 2  # 2 weeks
@@ -0,0 +1,86 @@
+import datetime
+from io import BytesIO
+from unittest import skipIf
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+
+from core.parsers import FastJSONParser
+from core.renderers import FastJSONRenderer, orjson
+
+
+class FastJSONTestCase(SimpleTestCase):
+    def render(self, data):
+        return FastJSONRenderer().render(data, "application/json")
+
+    def parse(self, content):
+        return FastJSONParser().parse(BytesIO(content), "application/json")
+
+    def test_output_matches_drf_renderer(self):
+        data = {"text": "a b", "items": [1, 2.5, None, True], "nested": {"a": "é"}}
+        self.assertEquals(
+            self.render(data), JSONRenderer().render(data, "application/json")
+        )
+
+    @skipIf(orjson is None, "orjson is not installed")
+    def test_datetimes_follow_datetime_format(self):
+        timestamp = datetime.datetime(2021, 9, 1, 10, 30, tzinfo=datetime.timezone.utc)
+        # times are converted to the current time zone, Europe/Rome
+        self.assertEquals(
+            self.render({"timestamp": timestamp}),
+            b'{"timestamp":"2021-09-01 12:30:00"}',
+        )
+        with override_settings(
+            REST_FRAMEWORK={"DATETIME_FORMAT": "iso-8601"}, USE_TZ=False
+        ):
+            self.assertEquals(
+                self.render({"timestamp": timezone.make_naive(timestamp)}),
+                b'{"timestamp":"2021-09-01T12:30:00"}',
+            )
+
+    def test_non_finite_floats_are_rejected(self):
+        for value in (float("nan"), float("inf")):
+            with self.assertRaises(ValueError):
+                self.render({"items": [{"value": value}]})
+
+    def test_parse(self):
+        self.assertEquals(
+            self.parse('{"a": [1, "é", null]}'.encode()), {"a": [1, "é", None]}
+        )
+        for content in (b'{"a": ', b'{"a": NaN}', b'{"a": Infinity}'):
+            with self.assertRaises(ParseError):
+                self.parse(content)
+
+    @override_settings(USE_FAST_JSON=False)
+    def test_fallback(self):
+        self.assertEquals(self.render({"a": 1}), b'{"a":1}')
+        self.assertEquals(self.parse(b'{"a": 1}'), {"a": 1})
+
+
+class MetricsTestCase(TestCase):
+    def test_metrics_are_served_to_staff(self):
+        from django.core.cache import cache
+        from rest_framework.test import APIClient
+        from users.models import User
+
+        from core.metrics import increment, timing
+
+        cache.clear()
+        increment("node.kills")
+        increment("node.kills")
+        timing("tex.render", 12.4)
+
+        client = APIClient()
+        user = User.objects.create(username="user", email="user@unipi.it")
+        client.force_authenticate(user=user)
+        self.assertEquals(client.get("/metrics/").status_code, 403)
+
+        user.is_staff = True
+        user.save()
+        response = client.get("/metrics/")
+        self.assertEquals(response.data["node.kills"], 2)
+        self.assertEquals(response.data["tex.render.count"], 1)
+        self.assertEquals(response.data["tex.render.total_ms"], 12)
+        self.assertEquals(response.data["node.crashes"], 0)
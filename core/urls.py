@@ -4,6 +4,8 @@ from django.conf.urls import url
 from django.contrib import admin
 from django.urls import include, path
 
+from core.views import metrics
+
 urlpatterns = [
     path(os.environ.get("ADMIN_URL", "admin/"), admin.site.urls),
     path("", include("training.urls")),
@@ -11,4 +13,5 @@ urlpatterns = [
     path("", include("djoser.urls")),
     path("tickets/", include("tickets.urls")),
     url(r"^auth/", include("rest_framework_social_oauth2.urls")),
+    path("metrics/", metrics, name="metrics"),
 ]
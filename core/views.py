@@ -0,0 +1,15 @@
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+
+from core.metrics import METRICS, get_counters
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def metrics(request):
+    """
+    Returns the current value of the counters in `METRICS`, added up across all the
+    processes that share the default cache
+    """
+    return Response(get_counters(METRICS))
@@ -0,0 +1,127 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.shortcuts import get_object_or_404
+from django.utils.functional import cached_property
+
+ENROLLED = "enrolled"
+ALLOWED_TEACHER = "allowed_teacher"
+
+
+def get_course_access_cache_key(course_id, user_id, relation):
+    return f"course_access:{course_id}:{user_id}:{relation}"
+
+
+def invalidate_course_access(course_user_pairs):
+    cache.delete_many(
+        [
+            get_course_access_cache_key(course_id, user_id, relation)
+            for course_id, user_id in course_user_pairs
+            for relation in (ENROLLED, ALLOWED_TEACHER)
+        ]
+    )
+
+
+def get_visible_courses_cache_key(user_id):
+    return f"visible_courses:{user_id}"
+
+
+def invalidate_visible_courses(user_ids):
+    cache.delete_many([get_visible_courses_cache_key(user_id) for user_id in user_ids])
+
+
+def get_visible_course_ids(user):
+    """
+    Returns the set of ids of the courses a teacher created or is an allowed teacher of
+    """
+    from training.models import Course
+
+    cache_key = get_visible_courses_cache_key(user.pk)
+    course_ids = cache.get(cache_key)
+    if course_ids is None:
+        course_ids = set(
+            Course.objects.filter(creator_id=user.pk).values_list("pk", flat=True)
+        ) | set(
+            Course.allowed_teachers.through.objects.filter(user_id=user.pk).values_list(
+                "course_id", flat=True
+            )
+        )
+        cache.set(cache_key, course_ids, settings.COURSE_ACCESS_CACHE_TIMEOUT)
+
+    return course_ids
+
+
+class CourseAccess:
+    """
+    Resolves the course a request is about, from the `course_pk` or `topic_pk` url
+    kwargs, and the relation of the requesting user to it. Each is looked up at most
+    once per request, and relations are also cached for a short while
+    """
+
+    def __init__(self, user, url_kwargs):
+        self.user = user
+        self.url_kwargs = url_kwargs
+        self.relations = {}
+
+    @cached_property
+    def course_id(self):
+        from training.models import Topic
+
+        try:
+            return self.url_kwargs["course_pk"]
+        except KeyError:
+            return (
+                Topic.objects.filter(pk=self.url_kwargs["topic_pk"])
+                .values_list("course_id", flat=True)
+                .first()
+            )
+
+    @cached_property
+    def course(self):
+        from training.models import Course
+
+        return get_object_or_404(Course, pk=self.course_id)
+
+    def get_relation(self, relation, queryset):
+        if self.course_id is None:  # the topic doesn't exist
+            return False
+
+        if relation not in self.relations:
+            cache_key = get_course_access_cache_key(
+                self.course_id, self.user.pk, relation
+            )
+            value = cache.get(cache_key)
+            if value is None:
+                value = queryset.exists()
+                cache.set(cache_key, value, settings.COURSE_ACCESS_CACHE_TIMEOUT)
+            self.relations[relation] = value
+
+        return self.relations[relation]
+
+    def is_enrolled(self):
+        from training.models import Enrollment
+
+        return self.get_relation(
+            ENROLLED,
+            Enrollment.objects.filter(course_id=self.course_id, user_id=self.user.pk),
+        )
+
+    def is_allowed_teacher(self):
+        from training.models import Course
+
+        return self.get_relation(
+            ALLOWED_TEACHER,
+            Course.objects.filter(
+                Q(creator_id=self.user.pk) | Q(allowed_teachers=self.user.pk),
+                pk=self.course_id,
+            ),
+        )
+
+
+def get_course_access(request, view):
+    # permissions and the view share the same request object
+    try:
+        return request._course_access
+    except AttributeError:
+        request._course_access = CourseAccess(request.user, view.kwargs)
+        return request._course_access
@@ -32,7 +32,18 @@ class ExerciseTestCaseAdmin(admin.ModelAdmin):
 
 @admin.register(ProgrammingExercise)
 class ProgrammingExerciseAdmin(admin.ModelAdmin):
-    pass
+    actions = ["regrade_submissions"]
+
+    @admin.action(description="Regrade submissions")
+    def regrade_submissions(self, request, queryset):
+        from core.celery import regrade_submissions_task
+
+        regrade_submissions_task.delay(
+            exercise_ids=list(queryset.values_list("pk", flat=True))
+        )
+        self.message_user(
+            request, "Submissions will be regraded in the background."
+        )
 
 
 class SubmissionTestCaseOutcomeInline(admin.TabularInline):
@@ -80,3 +91,8 @@ class TrainingSessionQuestionInline(admin.TabularInline):
 @admin.register(TrainingSession)
 class TrainingSessionAdmin(admin.ModelAdmin):
     inlines = [TrainingSessionQuestionInline]
+
+
+@admin.register(Checkpoint)
+class CheckpointAdmin(admin.ModelAdmin):
+    readonly_fields = ("updated",)
@@ -0,0 +1,137 @@
+import hashlib
+import json
+
+from django.core.cache import cache, caches
+from django.utils import timezone
+
+# serialized representations of items are immutable for a given value of `updated`,
+# so they can be kept around for a long time: a change to the item produces a new key
+SERIALIZED_ITEM_CACHE_TIMEOUT = 60 * 60 * 24
+
+TEACHER_ROLE = "teacher"
+STUDENT_ROLE = "student"
+
+
+def get_role(user):
+    return TEACHER_ROLE if user.is_teacher else STUDENT_ROLE
+
+
+def get_serialized_item_cache_key(instance, role):
+    return "serialized:{}:{}:{}:{}".format(
+        instance._meta.label_lower,
+        instance.pk,
+        instance.updated.timestamp(),
+        role,
+    )
+
+
+def get_cached_representation(instance, role):
+    return cache.get(get_serialized_item_cache_key(instance, role))
+
+
+def set_cached_representation(instance, role, representation):
+    cache.set(
+        get_serialized_item_cache_key(instance, role),
+        representation,
+        SERIALIZED_ITEM_CACHE_TIMEOUT,
+    )
+
+
+def invalidate_serialized_item(instance):
+    """
+    Drops the cached representations of the given item, for all roles
+    """
+    if instance.pk is None or instance.updated is None:
+        return
+
+    cache.delete_many(
+        [
+            get_serialized_item_cache_key(instance, role)
+            for role in (TEACHER_ROLE, STUDENT_ROLE)
+        ]
+    )
+
+
+def touch_item(model, pk):
+    """
+    Bumps the `updated` timestamp of an item without going through `save`: used when a
+    child of the item (a choice or a testcase) changes, so that any representation
+    cached for the parent item stops being used
+    """
+    model.objects.filter(pk=pk).update(updated=timezone.now())
+
+
+# the templates a student can choose from, per course: they're dropped from the cache
+# when the student starts a session and when the templates of the course change
+TRAINING_TEMPLATES_CACHE_TIMEOUT = 60 * 60
+
+
+def get_course_templates_version(course_id):
+    # kept in the database, so that a change reaches every process right away
+    from training.models import Course
+
+    updated = (
+        Course.objects.filter(pk=course_id)
+        .values_list("templates_updated", flat=True)
+        .first()
+    )
+    return updated.timestamp() if updated is not None else 0
+
+
+def get_training_templates_cache_key(course_id, user_id):
+    return "training_templates:{}:{}:{}".format(
+        course_id, get_course_templates_version(course_id), user_id
+    )
+
+
+def invalidate_course_templates(course_id):
+    from training.models import Course
+
+    Course.objects.filter(pk=course_id).update(templates_updated=timezone.now())
+
+
+def invalidate_user_templates(course_id, user_id):
+    cache.delete(get_training_templates_cache_key(course_id, user_id))
+
+
+def normalize_code(code):
+    # only normalize what can't change the outcome of the program: line terminators
+    # (which JS normalizes inside template literals too) and trailing whitespace
+    return code.replace("\r\n", "\n").replace("\r", "\n").rstrip()
+
+
+def get_grading_cache_key(code, testcases_json):
+    """
+    Content-addressed key for the outcome of running `code` against the given testcases:
+    editing, adding or removing any testcase of the exercise produces a different key,
+    so entries for stale testcases are never hit again
+    """
+    digest = hashlib.sha256(
+        json.dumps(
+            [
+                normalize_code(code),
+                [(testcase["id"], testcase["assertion"]) for testcase in testcases_json],
+            ]
+        ).encode()
+    ).hexdigest()
+    return f"grading:{digest}"
+
+
+def get_cached_grading_results(code, testcases_json):
+    return caches["grading"].get(get_grading_cache_key(code, testcases_json))
+
+
+def set_cached_grading_results(code, testcases_json, run_results):
+    # timings belong to the run that produced them: submissions served from the
+    # cache didn't cost any execution time
+    run_results = {
+        key: value
+        for key, value in run_results.items()
+        if key not in ("time_ms", "peak_rss_kb")
+    }
+    if "tests" in run_results:
+        run_results["tests"] = [
+            {key: value for key, value in test.items() if key != "time_ms"}
+            for test in run_results["tests"]
+        ]
+    caches["grading"].set(get_grading_cache_key(code, testcases_json), run_results)
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+# backends whose entries are only seen by the process that wrote them
+LOCAL_CACHE_BACKENDS = [
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+]
+
+
+@register(deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    # rate limits, round-robin grading and cache invalidations only work if all the
+    # processes share the default cache
+    if settings.CACHES["default"]["BACKEND"] in LOCAL_CACHE_BACKENDS:
+        return [
+            Error(
+                "The default cache isn't shared between processes.",
+                hint="Use a backend like redis or memcached.",
+                id="training.E001",
+            )
+        ]
+    return []
@@ -1,7 +1,6 @@
-from django.db.models import Q
 from rest_framework import filters
 
-from training.models import Course
+from training.access import get_visible_course_ids
 
 
 class StudentOrAllowedCoursesOnly(filters.BaseFilterBackend):
@@ -9,9 +8,7 @@ class StudentOrAllowedCoursesOnly(filters.BaseFilterBackend):
         if not request.user.is_teacher:
             return queryset
 
-        return queryset.filter(
-            Q(creator=request.user) | Q(allowed_teachers__in=[request.user])
-        ).distinct()  # ! keep an eye on this
+        return queryset.filter(pk__in=get_visible_course_ids(request.user))
 
 
 class OwnedOnlyTrainingTemplates(filters.BaseFilterBackend):
@@ -1,4 +1,5 @@
 import math as m
+from itertools import islice
 
 
 def get_items(model, topic, amounts, difficulty_profile, exclude_queryset):
@@ -91,3 +92,44 @@ def get_concrete_difficulty_profile_amounts(difficulty_profile, total_amount):
                     break
 
     return ret
+
+
+def get_percentile(values, percentile):
+    # nearest-rank percentile of an already sorted list
+    if not values:
+        return None
+    rank = m.ceil(percentile / 100 * len(values))
+    return values[max(rank, 1) - 1]
+
+
+def get_grading_stats(runs):
+    """
+    Takes in a list of (execution_time_ms, timed_out, killed) tuples, one per graded
+    submission, and returns runtime percentiles and timeout rates. Runs without an
+    execution time, i.e. submissions whose results were reused, count towards the
+    rates but not the percentiles
+    """
+    times = sorted(time for time, _, _ in runs if time is not None)
+    total = len(runs)
+
+    return {
+        "graded": total,
+        "executed": len(times),
+        "p50_ms": get_percentile(times, 50),
+        "p95_ms": get_percentile(times, 95),
+        "max_ms": times[-1] if times else None,
+        "timeout_rate": (
+            sum(1 for _, timed_out, _ in runs if timed_out) / total if total else 0
+        ),
+        "kill_rate": sum(1 for _, _, killed in runs if killed) / total if total else 0,
+    }
+
+
+def batches(iterable, size):
+    # splits an iterable into lists of `size` elements, the last one possibly shorter
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
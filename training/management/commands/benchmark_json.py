@@ -0,0 +1,116 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.serializer_helpers import ReturnDict, ReturnList
+
+from core.renderers import FastJSONRenderer, fast_json_enabled
+
+# roughly the size of the svg that `tex_to_svg` outputs for a short inline formula
+SAMPLE_SVG = (
+    '<svg class="inline" xmlns="http://www.w3.org/2000/svg" width="5.1ex" '
+    'height="2.3ex" viewBox="0 -750 2254 1000"><defs>'
+    + "".join(
+        f'<path id="MJX-{i}-TEX-I-1D465" d="M52 289Q59 331 106 386T222 442Q257 442 '
+        f'286 424T329 379Q371 442 430 442Q467 442 494 420T522 361Q522 332 508 314T481 '
+        f'292T458 288Q439 288 427 299T415 328Q415 374 465 391Z"></path>'
+        for i in range(8)
+    )
+    + "</defs></svg>"
+)
+
+
+def get_session_payload(questions_count, choices_count):
+    return ReturnDict(
+        id=1,
+        begin_timestamp=timezone.now(),
+        questions=ReturnList(
+            [
+                {
+                    "id": i,
+                    "text": f"Compute {SAMPLE_SVG} given {SAMPLE_SVG}",
+                    "imported_from_exam": False,
+                    "topic": 1,
+                    "is_open_ended": False,
+                    "choices": [
+                        {"id": i * choices_count + j, "text": SAMPLE_SVG}
+                        for j in range(choices_count)
+                    ],
+                }
+                for i in range(questions_count)
+            ],
+            serializer=None,
+        ),
+        serializer=None,
+    )
+
+
+def get_export_payload(questions_count, choices_count):
+    return ReturnList(
+        [
+            {
+                "text": f"Compute $\\frac{{{i}}}{{2}}$",
+                "private_tags": ["facile"],
+                "public_tags": ["logarithms"],
+                "solution": "",
+                "exercise_type": 0,
+                "choices": [
+                    {"text": f"$\\log {j}$", "score": "0.00"}
+                    for j in range(choices_count)
+                ],
+            }
+            for i in range(questions_count)
+        ],
+        serializer=None,
+    )
+
+
+class Command(BaseCommand):
+    help = "Compares the JSON renderers on representative session and export payloads"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--questions", type=int, default=40)
+        parser.add_argument("--choices", type=int, default=4)
+        parser.add_argument("--export-questions", type=int, default=2000)
+        parser.add_argument("--runs", type=int, default=50)
+
+    def handle(self, *args, **options):
+        if not fast_json_enabled():
+            self.stdout.write(
+                self.style.WARNING(
+                    "orjson is not available or disabled: FastJSONRenderer "
+                    "will fall back to the stdlib renderer"
+                )
+            )
+
+        payloads = {
+            "session": get_session_payload(options["questions"], options["choices"]),
+            "export": get_export_payload(
+                options["export_questions"], options["choices"]
+            ),
+        }
+
+        for name, payload in payloads.items():
+            size = len(JSONRenderer().render(payload))
+            timings = {}
+            for renderer in (JSONRenderer(), FastJSONRenderer()):
+                timings[renderer.__class__.__name__] = (
+                    min(
+                        timeit.repeat(
+                            lambda: renderer.render(payload),
+                            number=options["runs"],
+                            repeat=3,
+                        )
+                    )
+                    / options["runs"]
+                )
+
+            self.stdout.write(
+                f"{name} ({size / 1024:.1f} KiB): "
+                + ", ".join(
+                    f"{renderer_name} {timing * 1000:.3f} ms"
+                    for renderer_name, timing in timings.items()
+                )
+                + f" (x{timings['JSONRenderer'] / timings['FastJSONRenderer']:.1f})"
+            )
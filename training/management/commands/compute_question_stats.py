@@ -0,0 +1,86 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from training.models import (
+    Choice,
+    Course,
+    QuestionStats,
+    QuestionTrainingSessionThroughModel,
+)
+from training.psychometrics import get_question_stats, np
+
+
+class Command(BaseCommand):
+    help = (
+        "Computes the p-value, discrimination and choice pick rates of the "
+        "multiple-choice questions of each course from the answers given in turned "
+        "in sessions, replacing the stats computed by previous runs"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--course", type=int, nargs="+", dest="course_ids")
+        parser.add_argument("--chunk-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if np is None:
+            raise CommandError("NumPy is required to compute question stats")
+
+        courses = Course.objects.order_by("pk")
+        if options["course_ids"]:
+            courses = courses.filter(pk__in=options["course_ids"])
+
+        for course_id in courses.values_list("pk", flat=True):
+            count = self.compute_course_stats(course_id, options["chunk_size"])
+            self.stdout.write(
+                f"Computed stats of {count} questions of course {course_id}"
+            )
+
+    def compute_course_stats(self, course_id, chunk_size):
+        responses = (
+            QuestionTrainingSessionThroughModel.objects.filter(
+                training_session__course_id=course_id,
+                training_session__in_progress=False,
+                question__is_open_ended=False,
+            )
+            .order_by()
+            .values_list(
+                "question_id",
+                "training_session_id",
+                "selected_choice_id",
+                "selected_choice__correct",
+            )
+            .iterator(chunk_size=chunk_size)
+        )
+        stats = get_question_stats(responses)
+
+        # choices that were never picked are listed too
+        choice_ids = defaultdict(list)
+        for question_id, choice_id in Choice.objects.filter(
+            question_id__in=stats.keys()
+        ).values_list("question_id", "pk"):
+            choice_ids[question_id].append(choice_id)
+
+        with transaction.atomic():
+            QuestionStats.objects.filter(question__course_id=course_id).delete()
+            QuestionStats.objects.bulk_create(
+                [
+                    QuestionStats(
+                        question_id=question_id,
+                        attempts=question_stats["attempts"],
+                        p_value=question_stats["p_value"],
+                        discrimination=question_stats["discrimination"],
+                        choice_pick_rates={
+                            str(choice_id): question_stats["choice_pick_rates"].get(
+                                choice_id, 0
+                            )
+                            for choice_id in choice_ids[question_id]
+                        },
+                    )
+                    for question_id, question_stats in stats.items()
+                ],
+                batch_size=500,
+            )
+
+        return len(stats)
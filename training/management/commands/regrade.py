@@ -0,0 +1,176 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from training.logic import batches
+from training.models import (
+    Checkpoint,
+    ExerciseSubmission,
+    ProgrammingExercise,
+    TestCaseOutcomeThroughModel,
+)
+from training.node.pool import NodeWorkerPool
+from training.node.utils import run_many_in_vm
+
+
+class Command(BaseCommand):
+    help = (
+        "Regrades the submissions to the given exercises, or to all the exercises "
+        "of a course, replacing their outcomes. Progress is checkpointed after each "
+        "batch, so an interrupted run resumes where it stopped"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--exercise", type=int, nargs="+", dest="exercise_ids")
+        parser.add_argument("--course", type=int, dest="course_id")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Number of node workers grading submissions in parallel",
+        )
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument(
+            "--batch-vm",
+            action="store_true",
+            help=(
+                "Grade each batch with `vm.js --batch` processes, one per worker, "
+                "instead of the pool of long-lived node workers"
+            ),
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore the checkpoint left by a previous run",
+        )
+
+    def handle(self, *args, **options):
+        exercises = ProgrammingExercise.objects.prefetch_related("testcases")
+        if options["exercise_ids"]:
+            exercises = exercises.filter(pk__in=options["exercise_ids"])
+            checkpoint_name = "regrade:exercises:" + ",".join(
+                str(pk) for pk in sorted(options["exercise_ids"])
+            )
+        elif options["course_id"] is not None:
+            exercises = exercises.filter(course_id=options["course_id"])
+            checkpoint_name = f"regrade:course:{options['course_id']}"
+        else:
+            raise CommandError("Specify either --exercise or --course")
+
+        # testcases are loaded once per exercise rather than once per submission
+        testcases_by_exercise = {
+            exercise.pk: exercise.get_testcases_json() for exercise in exercises
+        }
+
+        # submissions that are still waiting for the grading queue are left to it
+        submissions = (
+            ExerciseSubmission.objects.filter(
+                exercise_id__in=testcases_by_exercise.keys(),
+                status=ExerciseSubmission.DONE,
+            )
+            .only("pk", "exercise_id", "code", *ExerciseSubmission.GRADING_FIELDS)
+            .order_by("pk")
+        )
+
+        last_processed_id = (
+            None
+            if options["restart"]
+            else Checkpoint.get_last_processed_id(checkpoint_name)
+        )
+        if last_processed_id is not None:
+            self.stdout.write(f"Resuming after submission {last_processed_id}")
+            submissions = submissions.filter(pk__gt=last_processed_id)
+
+        total = submissions.count()
+        self.stdout.write(f"Regrading {total} submissions")
+
+        pool = NodeWorkerPool(
+            node_vm_path=os.environ.get("NODE_VM_PATH", "training/node/vm.js"),
+            size=options["workers"],
+            max_jobs=settings.NODE_VM_WORKER_MAX_JOBS,
+            health_check_interval=settings.NODE_VM_WORKER_HEALTH_CHECK_INTERVAL,
+        )
+
+        def grade(submission):
+            return submission.run(
+                testcases_by_exercise[submission.exercise_id], runner=pool.run
+            )
+
+        def grade_batch(executor, batch):
+            if not options["batch_vm"]:
+                return list(executor.map(grade, batch))
+
+            # split the batch among the workers, each grading its share in a single
+            # node process
+            chunk_size = -(-len(batch) // options["workers"])
+            run_results = {}
+            for chunk_results in executor.map(
+                lambda chunk: dict(run_many_in_vm(chunk, chunk_size=chunk_size)),
+                batches(
+                    (
+                        (
+                            submission.pk,
+                            submission.code,
+                            testcases_by_exercise[submission.exercise_id],
+                        )
+                        for submission in batch
+                    ),
+                    chunk_size,
+                ),
+            ):
+                run_results.update(chunk_results)
+
+            def get_runner(submission):
+                return lambda code, testcases_json: run_results[submission.pk]
+
+            return [
+                submission.run(
+                    testcases_by_exercise[submission.exercise_id],
+                    runner=get_runner(submission),
+                )
+                for submission in batch
+            ]
+
+        processed = 0
+        start = time.monotonic()
+        try:
+            # at most `workers` submissions are being graded at any time, and at most
+            # one batch of them is held in memory
+            with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+                for batch in batches(
+                    submissions.iterator(chunk_size=options["batch_size"]),
+                    options["batch_size"],
+                ):
+                    outcomes = grade_batch(executor, batch)
+                    self.save_batch(batch, outcomes)
+                    Checkpoint.save_progress(checkpoint_name, batch[-1].pk)
+
+                    processed += len(batch)
+                    elapsed = time.monotonic() - start
+                    self.stdout.write(
+                        f"{processed}/{total} submissions regraded "
+                        f"({processed / elapsed:.1f}/s)"
+                    )
+        finally:
+            pool.shutdown()
+
+        Checkpoint.clear(checkpoint_name)
+        self.stdout.write(self.style.SUCCESS(f"Regraded {processed} submissions"))
+
+    @transaction.atomic
+    def save_batch(self, submissions, outcomes):
+        TestCaseOutcomeThroughModel.objects.filter(submission__in=submissions).delete()
+        ExerciseSubmission.objects.bulk_update(
+            submissions, ExerciseSubmission.GRADING_FIELDS
+        )
+        TestCaseOutcomeThroughModel.objects.bulk_create(
+            [
+                row
+                for submission, submission_outcomes in zip(submissions, outcomes)
+                for row in submission.get_outcome_rows(submission_outcomes)
+            ]
+        )
@@ -0,0 +1,176 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+# only lightweight modules are imported at the top: pool processes import this
+# module before django is set up
+from training.logic import batches
+
+MODELS = ["Question", "Choice", "ProgrammingExercise"]
+
+
+def setup_worker():
+    # pool processes are spawned rather than forked, so they don't share the
+    # parent's database connections: each sets up django and opens its own
+    import django
+
+    django.setup()
+
+
+def render_chunk(texts_per_item):
+    from training.tex import tex_to_svg_many
+
+    # one round trip for the formulas of all the items in the chunk
+    flat_renderings = iter(
+        tex_to_svg_many([text for texts in texts_per_item for text in texts])
+    )
+    return [[next(flat_renderings) for _ in texts] for texts in texts_per_item]
+
+
+class Command(BaseCommand):
+    help = (
+        "Renders the TeX fields of questions, choices and programming exercises, "
+        "writing the renderings that changed. Items are processed in id order and "
+        "progress is checkpointed after each batch, so an interrupted run resumes "
+        "where it stopped"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", choices=MODELS, nargs="+", default=MODELS)
+        parser.add_argument("--course", type=int, dest="course_id")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Number of processes rendering in parallel, 0 to render in this one",
+        )
+        parser.add_argument("--batch-size", type=int, default=200)
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore the checkpoints left by a previous run",
+        )
+
+    def handle(self, *args, **options):
+        if options["workers"] == 0:
+            for model_name in options["model"]:
+                self.render_model(map, model_name, options)
+            return
+
+        with ProcessPoolExecutor(
+            max_workers=options["workers"],
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=setup_worker,
+        ) as executor:
+            for model_name in options["model"]:
+                self.render_model(executor.map, model_name, options)
+
+    def get_queryset(self, model_name, course_id):
+        from django.apps import apps
+
+        model = apps.get_model(app_label="training", model_name=model_name)
+        queryset = model.objects.order_by("pk")
+        if course_id is not None:
+            course_lookup = (
+                "question__course_id" if model_name == "Choice" else "course_id"
+            )
+            queryset = queryset.filter(**{course_lookup: course_id})
+
+        fields = [field for pair in model.renderable_tex_fields for field in pair]
+        if model_name == "Choice":
+            fields.append("question_id")
+        return queryset.only("pk", *fields)
+
+    def render_model(self, map_chunks, model_name, options):
+        from training.models import Checkpoint
+
+        checkpoint_name = f"render_tex:{model_name}" + (
+            f":course:{options['course_id']}"
+            if options["course_id"] is not None
+            else ""
+        )
+        queryset = self.get_queryset(model_name, options["course_id"])
+
+        last_processed_id = (
+            None
+            if options["restart"]
+            else Checkpoint.get_last_processed_id(checkpoint_name)
+        )
+        if last_processed_id is not None:
+            self.stdout.write(f"Resuming {model_name} after id {last_processed_id}")
+            queryset = queryset.filter(pk__gt=last_processed_id)
+
+        total = queryset.count()
+        self.stdout.write(f"Rendering {total} {model_name} items")
+
+        processed = 0
+        start = time.monotonic()
+        for batch in batches(
+            queryset.iterator(chunk_size=options["batch_size"]),
+            options["batch_size"],
+        ):
+            self.render_batch(map_chunks, batch, max(options["workers"], 1))
+            Checkpoint.save_progress(checkpoint_name, batch[-1].pk)
+
+            processed += len(batch)
+            elapsed = time.monotonic() - start
+            self.stdout.write(
+                f"{processed}/{total} {model_name} items rendered "
+                f"({processed / elapsed:.1f}/s)"
+            )
+
+        Checkpoint.clear(checkpoint_name)
+        self.stdout.write(
+            self.style.SUCCESS(f"Rendered {processed} {model_name} items")
+        )
+
+    def render_batch(self, map_chunks, batch, workers):
+        from training.models import AbstractItem, Question
+
+        model = type(batch[0])
+        texts_per_item = [
+            [getattr(item, source) for (source, _) in model.renderable_tex_fields]
+            for item in batch
+        ]
+
+        # the batch is split evenly among the worker processes
+        chunk_size = -(-len(batch) // workers)
+        renderings_per_item = [
+            renderings
+            for chunk_renderings in map_chunks(
+                render_chunk, batches(texts_per_item, chunk_size)
+            )
+            for renderings in chunk_renderings
+        ]
+
+        changed = []
+        for item, renderings in zip(batch, renderings_per_item):
+            item_changed = False
+            for (_, target), rendering in zip(model.renderable_tex_fields, renderings):
+                if getattr(item, target) != rendering:
+                    setattr(item, target, rendering)
+                    item_changed = True
+            if item_changed:
+                changed.append(item)
+
+        if not changed:
+            return
+
+        # `updated` is bumped so that cached representations of the items, or of the
+        # questions the choices belong to, stop being served
+        now = timezone.now()
+        fields = [target for (_, target) in model.renderable_tex_fields]
+        with transaction.atomic():
+            if issubclass(model, AbstractItem):
+                for item in changed:
+                    item.updated = now
+                fields.append("updated")
+            else:
+                Question.objects.filter(
+                    pk__in={item.question_id for item in changed}
+                ).update(updated=now)
+            model.objects.bulk_update(changed, fields)
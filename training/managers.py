@@ -1,8 +1,13 @@
 import math as m
+import time
+from datetime import timedelta
 
 from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
 from django.db import models
-from django.db.models import Count, Exists, OuterRef, Q
+from django.db.models import Count, Exists, F, Min, OuterRef, Q
+from django.utils import timezone
 
 from training.logic import get_concrete_difficulty_profile_amounts
 
@@ -35,23 +40,23 @@ class TrainingSessionManager(models.Manager):
 
 
 class TrainingTemplateRuleManager(models.Manager):
-    def create(self, amount, *args, **kwargs):
-        from training.models import TrainingTemplateRule
-
-        rule = super().create(*args, **kwargs)
+    def build(self, amount, *args, **kwargs):
+        """
+        Returns an unsaved rule whose amount fields are computed in memory from its
+        difficulty profile and the total `amount` of items
+        """
+        rule = self.model(*args, **kwargs)
         concrete_amounts = get_concrete_difficulty_profile_amounts(
             rule.difficulty_profile, amount
         )
-        for (
-            field,
-            value,
-        ) in concrete_amounts.items():  # TODO find out why `update` isn't working
+        for field, value in concrete_amounts.items():
             setattr(rule, field, value)
 
-        rule.save()
-
-        # TrainingTemplateRule.objects.filter(pk=rule.pk).update(**concrete_amounts)
+        return rule
 
+    def create(self, amount, *args, **kwargs):
+        rule = self.build(amount, *args, **kwargs)
+        rule.save(force_insert=True, using=self.db)
         return rule
 
 
@@ -77,13 +82,10 @@ class TrainingTemplatesQuerySet(models.QuerySet):
             .order_by("-begin_timestamp")[:4]
             .values_list("training_template_id")
         )  # get the templates of the three most recent training sessions from this user
-        return (
-            apps.get_model("training.TrainingTemplate")
-            .objects.filter(
-                Q(custom=False) | Q(pk__in=recent_training_sessions_templates)
-            )
-            .filter(course_id=course_id)
-            .distinct()
+        # no joins are involved, so templates can't be repeated
+        return self.filter(
+            Q(custom=False) | Q(pk__in=recent_training_sessions_templates),
+            course_id=course_id,
         )
 
 
@@ -95,9 +97,93 @@ class TrainingTemplateManager(models.Manager):
         return self.get_queryset().recently_used_by(user, course_id)
 
 
+class TopicProgressManager(models.Manager):
+    def add_answers(self, user_id, answered_per_topic):
+        """
+        Adds the (answered, correct) counts in `answered_per_topic`, keyed by topic id,
+        to the counters of the given user, creating the ones that don't exist yet
+        """
+        self.bulk_create(
+            [
+                self.model(user_id=user_id, topic_id=topic_id)
+                for topic_id in answered_per_topic
+            ],
+            ignore_conflicts=True,
+        )
+        for topic_id, (answered, correct) in answered_per_topic.items():
+            self.filter(user_id=user_id, topic_id=topic_id).update(
+                answered=F("answered") + answered, correct=F("correct") + correct
+            )
+
+
 class ProgrammingExerciseManager(models.Manager):
     def get_queryset(self):
         return ProgrammingExerciseQuerySet(self.model, using=self._db)
 
     def seen_by(self, user):
         return self.get_queryset().seen_by(user)
+
+
+class ExerciseSubmissionManager(models.Manager):
+    def _abandoned(self):
+        """
+        Q object matching the submissions that have been running for longer than
+        `GRADING_STALE_AFTER` seconds, or since before their start was recorded: they
+        were left behind by a grading worker that died
+        """
+        stale_start = timezone.now() - timedelta(seconds=settings.GRADING_STALE_AFTER)
+        return Q(
+            Q(grading_started__lt=stale_start) | Q(grading_started__isnull=True),
+            status=self.model.RUNNING,
+        )
+
+    def not_graded(self):
+        """
+        Submissions waiting to be graded or being graded. Abandoned submissions
+        aren't counted
+        """
+        return self.exclude(status=self.model.DONE).exclude(self._abandoned())
+
+    def claim_next(self, task_id=""):
+        """
+        Marks as running and returns the pending submission that's next in line, or
+        None if there's none left. Users are served round-robin: the oldest pending
+        submission of the user who was served least recently goes first, so students
+        submitting in bulk don't hold back the others
+
+        A task that's delivered again after its worker died resumes the submission it
+        had claimed, and abandoned submissions are put back in line
+        """
+        RUNNING = self.model.RUNNING
+
+        if task_id:
+            resumed = self.filter(status=RUNNING, grading_task_id=task_id)
+            if resumed.update(grading_started=timezone.now()):
+                return resumed.first()
+
+        claimable = Q(status=self.model.PENDING) | self._abandoned()
+        heads = list(
+            self.filter(claimable)
+            .values("user_id")
+            .annotate(head_pk=Min("pk"))
+            .values_list("user_id", "head_pk")
+        )
+        last_served = cache.get_many(
+            [f"grading_turn:{user_id}" for user_id, _ in heads]
+        )
+        heads.sort(
+            key=lambda head: (last_served.get(f"grading_turn:{head[0]}", 0), head[1])
+        )
+
+        for user_id, pk in heads:
+            # another worker might have claimed the submission in the meantime
+            if self.filter(claimable, pk=pk).update(
+                status=RUNNING,
+                grading_started=timezone.now(),
+                grading_task_id=task_id,
+            ):
+                cache.set(f"grading_turn:{user_id}", time.time(), 60 * 60)
+                return self.get(pk=pk)
+
+        # all heads were taken by other workers, but more might be pending
+        return self.claim_next(task_id) if heads else None
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.25 on 2026-10-19 01:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('training', '0026_questiontrainingsessionthroughmodel_same_session_unique_question'),
+    ]
+
+    operations = [
+        # existing submissions were graded synchronously, so they're all done
+        migrations.AddField(
+            model_name='exercisesubmission',
+            name='status',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Pending'), (1, 'Running'), (2, 'Done')], default=2),
+        ),
+        migrations.AlterField(
+            model_name='exercisesubmission',
+            name='status',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Pending'), (1, 'Running'), (2, 'Done')], default=0),
+        ),
+    ]
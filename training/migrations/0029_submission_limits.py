@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-19 01:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('training', '0028_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='max_concurrent_submissions',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Submissions waiting to be graded at once', null=True),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='submission_burst',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Submissions that can be sent in a row before the rate kicks in', null=True),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='submission_rate',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Submissions per minute', null=True),
+        ),
+        migrations.AlterField(
+            model_name='exercisesubmission',
+            name='status',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Pending'), (1, 'Running'), (2, 'Done')], db_index=True, default=0),
+        ),
+    ]
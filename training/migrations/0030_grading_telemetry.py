@@ -0,0 +1,38 @@
+# Generated by Django 3.2.25 on 2026-10-19 02:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('training', '0029_submission_limits'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exercisesubmission',
+            name='execution_time_ms',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='exercisesubmission',
+            name='killed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='exercisesubmission',
+            name='peak_memory_kb',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='exercisesubmission',
+            name='timed_out',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='testcaseoutcomethroughmodel',
+            name='execution_time_ms',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
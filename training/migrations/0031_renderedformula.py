@@ -0,0 +1,24 @@
+# Generated by Django 3.2.25 on 2026-10-19 02:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('training', '0030_grading_telemetry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RenderedFormula',
+            fields=[
+                ('digest', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('source', models.TextField()),
+                ('display', models.BooleanField()),
+                ('svg', models.TextField()),
+                ('last_used', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
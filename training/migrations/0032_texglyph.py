@@ -0,0 +1,26 @@
+# Generated by Django 3.2.25 on 2026-10-19 02:13
+
+from django.db import migrations, models
+
+
+def clear_rendered_formulas(apps, schema_editor):
+    # formulas cached so far embed their glyphs: have them rendered again
+    apps.get_model('training', 'RenderedFormula').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('training', '0031_renderedformula'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TexGlyph',
+            fields=[
+                ('name', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('path', models.TextField()),
+            ],
+        ),
+        migrations.RunPython(clear_rendered_formulas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-19 02:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('training', '0032_texglyph'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='enrollment',
+            index=models.Index(fields=['course', 'user'], name='training_en_course__0b4b45_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.25 on 2026-10-19 02:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('training', '0033_enrollment_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuestionStats',
+            fields=[
+                ('question', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='training.question')),
+                ('attempts', models.PositiveIntegerField()),
+                ('p_value', models.FloatField()),
+                ('discrimination', models.FloatField(blank=True, null=True)),
+                ('choice_pick_rates', models.JSONField(default=dict)),
+                ('computed', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 3.2.25 on 2026-10-19 02:27
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q
+import django.db.models.deletion
+
+
+def count_past_answers(apps, schema_editor):
+    # counters start from the answers given in the sessions turned in so far
+    QuestionTrainingSessionThroughModel = apps.get_model(
+        'training', 'QuestionTrainingSessionThroughModel'
+    )
+    TopicProgress = apps.get_model('training', 'TopicProgress')
+
+    rows = (
+        QuestionTrainingSessionThroughModel.objects.filter(
+            training_session__in_progress=False,
+            training_session__trainee__isnull=False,
+            selected_choice__isnull=False,
+        )
+        .order_by()
+        .values('training_session__trainee_id', 'question__topic_id')
+        .annotate(
+            answered=Count('pk'),
+            correct=Count('pk', filter=Q(selected_choice__correct=True)),
+        )
+    )
+    TopicProgress.objects.bulk_create(
+        [
+            TopicProgress(
+                user_id=row['training_session__trainee_id'],
+                topic_id=row['question__topic_id'],
+                answered=row['answered'],
+                correct=row['correct'],
+            )
+            for row in rows.iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('training', '0034_questionstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TopicProgress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('answered', models.PositiveIntegerField(default=0)),
+                ('correct', models.PositiveIntegerField(default=0)),
+                ('topic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='student_progress', to='training.topic')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='topic_progress', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='topicprogress',
+            constraint=models.UniqueConstraint(fields=('user', 'topic'), name='same_user_topic_unique_progress'),
+        ),
+        migrations.RunPython(count_past_answers, migrations.RunPython.noop),
+    ]
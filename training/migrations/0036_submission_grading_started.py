@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 02:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('training', '0035_topicprogress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exercisesubmission',
+            name='grading_started',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
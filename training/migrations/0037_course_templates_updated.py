@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 02:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('training', '0036_submission_grading_started'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='templates_updated',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 03:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('training', '0037_course_templates_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exercisesubmission',
+            name='grading_task_id',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
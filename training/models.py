@@ -1,13 +1,25 @@
 import json
 import logging
+from collections import defaultdict
 
+from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 from users.models import User
 
 import training.signals
-from training.managers import ProgrammingExerciseManager, TrainingTemplateManager
+from training.cache import (
+    get_cached_grading_results,
+    invalidate_serialized_item,
+    set_cached_grading_results,
+)
+from training.managers import (
+    ExerciseSubmissionManager,
+    ProgrammingExerciseManager,
+    TopicProgressManager,
+    TrainingTemplateManager,
+)
 from training.node.utils import run_code_in_vm
 
 from .managers import TrainingSessionManager, TrainingTemplateRuleManager
@@ -35,9 +47,26 @@ class Course(models.Model):
     )
     created = models.DateTimeField(auto_now_add=True)
     description = models.TextField(blank=True)
+    # bumped whenever the templates of the course or their topics change: the lists of
+    # templates cached for the course are keyed by it
+    templates_updated = models.DateTimeField(null=True, blank=True, editable=False)
 
     uses_programming_exercises = models.BooleanField(default=False)
 
+    # limits on the programming exercise submissions of each student; when left
+    # empty, the defaults from the settings apply
+    submission_rate = models.PositiveSmallIntegerField(
+        null=True, blank=True, help_text="Submissions per minute"
+    )
+    submission_burst = models.PositiveSmallIntegerField(
+        null=True,
+        blank=True,
+        help_text="Submissions that can be sent in a row before the rate kicks in",
+    )
+    max_concurrent_submissions = models.PositiveSmallIntegerField(
+        null=True, blank=True, help_text="Submissions waiting to be graded at once"
+    )
+
     class Meta:
         ordering = ["pk"]
 
@@ -88,6 +117,10 @@ class Enrollment(models.Model):
         choices=ENROLLMENT_MODE_CHOICES,
     )
 
+    class Meta:
+        # membership is checked on most requests
+        indexes = [models.Index(fields=["course", "user"])]
+
 
 class Topic(models.Model):
     PROGRAMMING_EXERCISES = "e"
@@ -283,6 +316,9 @@ class AbstractItem(models.Model):
 
     def save(self, *args, **kwargs):
         self.full_clean()
+        # the cached representations are keyed by the current value of `updated`,
+        # which is about to change: drop them right away instead of letting them expire
+        invalidate_serialized_item(self)
         return super(AbstractItem, self).save(*args, **kwargs)
 
     @classmethod
@@ -378,6 +414,16 @@ class ProgrammingExercise(TrackRenderableFieldsMixin, AbstractItem):
         #     )
         # ]
 
+    def get_testcases_json(self):
+        # payload describing the testcases, as expected by `run_code_in_vm`
+        return [
+            {
+                "id": t.id,
+                "assertion": t.code,
+            }
+            for t in self.testcases.all()
+        ]
+
 
 class ExerciseTestCase(models.Model):
     exercise = models.ForeignKey(
@@ -397,6 +443,16 @@ class ExerciseTestCase(models.Model):
 
 
 class ExerciseSubmission(models.Model):
+    PENDING = 0
+    RUNNING = 1
+    DONE = 2
+
+    STATUS_CHOICES = (
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+    )
+
     user = models.ForeignKey(
         User,
         related_name="submissions",
@@ -413,6 +469,34 @@ class ExerciseSubmission(models.Model):
     )
     error = models.TextField(blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
+    status = models.PositiveSmallIntegerField(
+        choices=STATUS_CHOICES,
+        default=PENDING,
+        db_index=True,
+    )
+    grading_started = models.DateTimeField(null=True, blank=True)
+    # celery task grading the submission, which resumes it if it's delivered again
+    grading_task_id = models.CharField(max_length=255, blank=True)
+
+    # grading telemetry, reported by node; time and memory are left empty for
+    # submissions whose results were reused from an identical one, and memory also
+    # when node couldn't tell it apart from that of the submissions it ran before
+    execution_time_ms = models.PositiveIntegerField(null=True, blank=True)
+    peak_memory_kb = models.PositiveIntegerField(null=True, blank=True)
+    timed_out = models.BooleanField(default=False)
+    killed = models.BooleanField(default=False)
+
+    # fields set by `run`
+    GRADING_FIELDS = [
+        "status",
+        "error",
+        "execution_time_ms",
+        "peak_memory_kb",
+        "timed_out",
+        "killed",
+    ]
+
+    objects = ExerciseSubmissionManager()
 
     class Meta:
         ordering = ["pk"]
@@ -422,30 +506,104 @@ class ExerciseSubmission(models.Model):
 
     def save(self, *args, **kwargs):
         creating = self.pk is None
+        if creating and not settings.GRADE_SUBMISSIONS_ASYNC:
+            # grade before inserting the submission, so it's written once, already
+            # in its final state
+            outcomes = self.run()
+            # nobody sees a graded submission without its outcomes
+            with transaction.atomic(savepoint=False):
+                super().save(*args, **kwargs)
+                self.save_outcomes(outcomes)
+            return
+
         super().save(*args, **kwargs)
         if creating:
-            testcases_json = [
-                {
-                    "id": t.id,
-                    "assertion": t.code,
-                }
-                for t in self.exercise.testcases.all()
-            ]
-            run_results = run_code_in_vm(self.code, testcases_json)
-
-            if "error" in run_results:
-                self.error = run_results["error"]
-                self.save()
-            else:
-                outcomes = run_results["tests"]
-                for testcase_outcome in outcomes:
-                    self.outcomes.add(
-                        ExerciseTestCase.objects.get(pk=testcase_outcome["id"]),
-                        through_defaults={
-                            "passed": testcase_outcome["passed"],
-                            "details": testcase_outcome.get("error", ""),
-                        },
-                    )
+            # the worker needs to be able to see the submission, so the task
+            # is only enqueued once the transaction creating it is committed
+            transaction.on_commit(self.enqueue_grading)
+
+    def enqueue_grading(self):
+        from core.celery import fail_submission, grade_submission_task
+
+        try:
+            grade_submission_task.delay(submission_id=self.pk)
+        except Exception:
+            # e.g. the broker is down: nothing would ever grade the submission
+            logger.exception(f"Couldn't enqueue the grading of submission {self.pk}")
+            fail_submission(ExerciseSubmission, self.pk)
+
+    def run(self, testcases_json=None, runner=None):
+        """
+        Runs the submitted code against the exercise's testcases, sets the final
+        status and error of the submission and returns the outcomes of the testcases,
+        without writing anything to the database
+
+        Callers grading many submissions of the same exercise can pass in the
+        testcases and a `runner` with the same signature as `run_code_in_vm`
+        """
+        if testcases_json is None:
+            testcases_json = self.exercise.get_testcases_json()
+
+        # identical code graded against the same testcases gives the same results
+        run_results = get_cached_grading_results(self.code, testcases_json)
+        if run_results is None:
+            run_results = (runner or run_code_in_vm)(self.code, testcases_json)
+            if not run_results.get("killed") and not run_results.get("timed_out"):
+                # a run that was killed or timed out might have been a victim of load
+                # rather than of its code
+                set_cached_grading_results(self.code, testcases_json, run_results)
+
+        self.status = ExerciseSubmission.DONE
+        self.error = run_results.get("error", "")
+        self.execution_time_ms = (
+            round(run_results["time_ms"]) if "time_ms" in run_results else None
+        )
+        self.peak_memory_kb = run_results.get("peak_rss_kb")
+        self.timed_out = run_results.get("timed_out", False)
+        self.killed = run_results.get("killed", False)
+        if "error" in run_results:
+            return []
+
+        # only keep outcomes for testcases that were actually sent to the vm
+        testcase_ids = set(t["id"] for t in testcases_json)
+        return [
+            testcase_outcome
+            for testcase_outcome in run_results["tests"]
+            if testcase_outcome["id"] in testcase_ids
+        ]
+
+    def get_outcome_rows(self, outcomes):
+        # unsaved rows for the outcomes returned by `run`
+        return [
+            TestCaseOutcomeThroughModel(
+                submission=self,
+                testcase_id=testcase_outcome["id"],
+                passed=testcase_outcome["passed"],
+                details=testcase_outcome.get("error", ""),
+                execution_time_ms=testcase_outcome.get("time_ms"),
+            )
+            for testcase_outcome in outcomes
+        ]
+
+    def save_outcomes(self, outcomes):
+        TestCaseOutcomeThroughModel.objects.bulk_create(
+            self.get_outcome_rows(outcomes)
+        )
+
+    def grade(self):
+        """
+        Grades a submission that has already been saved, e.g. from a celery worker
+        """
+        if self.status != ExerciseSubmission.RUNNING:  # not claimed yet
+            self.status = ExerciseSubmission.RUNNING
+            self.grading_started = timezone.now()
+            super().save(update_fields=["status", "grading_started"])
+
+        outcomes = self.run()
+        # the submission is only seen as done once its outcomes are there
+        with transaction.atomic():
+            super().save(update_fields=ExerciseSubmission.GRADING_FIELDS)
+            self.save_outcomes(outcomes)
 
 
 class TestCaseOutcomeThroughModel(models.Model):
@@ -453,6 +611,7 @@ class TestCaseOutcomeThroughModel(models.Model):
     submission = models.ForeignKey(ExerciseSubmission, on_delete=models.CASCADE)
     passed = models.BooleanField()
     details = models.JSONField(blank=True)
+    execution_time_ms = models.FloatField(null=True, blank=True)
 
     class Meta:
         ordering = ["pk"]
@@ -511,22 +670,27 @@ class TrainingSession(models.Model):
 
     @property
     def relevant_help_texts(self):
-        # returns the `help_text` property of the topics for which more than 50%
-        # of the questions in this session have been given a wrong answer
+        # returns the `help_text` property of the topics in this session on which the
+        # trainee's share of wrong answers, across all of their sessions, is at least
+        # the topic's `error_percentage_for_help_text`, or 50% if it isn't set
+        topics = Topic.objects.filter(pk__in=self.questions.values("topic_id")).exclude(
+            help_text=""
+        )
+        progress = {
+            p.topic_id: p
+            for p in TopicProgress.objects.filter(
+                user_id=self.trainee_id, topic__in=topics
+            )
+        }
+
         ret = {}
-        for topic in [question.topic for question in self.questions.all()]:
-            if len(topic.help_text) > 0 and (
-                self.questiontrainingsessionthroughmodel_set.filter(
-                    question__topic=topic,
-                    selected_choice__isnull=False,
-                    selected_choice__correct=True,
-                ).count()
-                <= (
-                    self.questiontrainingsessionthroughmodel_set.filter(
-                        question__topic=topic
-                    ).count()
-                    / 2
-                )
+        for topic in topics:
+            error_percentage = (
+                progress[topic.pk].error_percentage if topic.pk in progress else None
+            )
+            threshold = topic.error_percentage_for_help_text
+            if error_percentage is None or error_percentage >= (
+                50 if threshold is None else threshold
             ):
                 ret[topic.name] = topic.help_text
 
@@ -537,14 +701,35 @@ class TrainingSession(models.Model):
             logger.warning(f"Session is over {self.pk}")
             raise ValidationError("Session is over.")
 
+        now = timezone.localtime(timezone.now())
+        # the session is claimed before writing any answer, so that concurrent
+        # requests can't overwrite the answers that are counted, and all of it is
+        # rolled back if any answer is invalid
+        with transaction.atomic():
+            if not TrainingSession.objects.filter(pk=self.pk, in_progress=True).update(
+                end_timestamp=now, in_progress=False
+            ):
+                raise ValidationError("Session is over.")
+            TopicProgress.objects.add_answers(
+                self.trainee_id, self._save_answers(answers)
+            )
+
+        self.end_timestamp = now
+        self.in_progress = False
+
+    def _save_answers(self, answers):
         # loops through the assigned questions to the session and saves the selected choice for each
         # question - the variable `answer` will be the id of a Choice for multiple-choice questions,
         # or the user-written text of the answer for open-ended questions
+        # topic id -> number of multiple-choice questions answered, and answered correctly
+        answered_per_topic = defaultdict(lambda: [0, 0])
         for question_id, answer in answers.items():
             # get question
             try:
-                through_row = QuestionTrainingSessionThroughModel.objects.get(
-                    training_session=self, question_id=question_id
+                through_row = (
+                    QuestionTrainingSessionThroughModel.objects.select_related(
+                        "question"
+                    ).get(training_session=self, question_id=question_id)
                 )
             except QuestionTrainingSessionThroughModel.DoesNotExist:
                 logger.warning(f"Question {question_id} not in session {self.pk}")
@@ -564,10 +749,11 @@ class TrainingSession(models.Model):
                         logger.warning(f"Choice {answer} doesn't exist ({pk})")
                         raise ValidationError(f"Choice {answer} doesn't exist")
 
-        now = timezone.localtime(timezone.now())
-        self.end_timestamp = now
-        self.in_progress = False
-        self.save()
+                    counters = answered_per_topic[through_row.question.topic_id]
+                    counters[0] += 1
+                    counters[1] += through_row.selected_choice.correct
+
+        return answered_per_topic
 
 
 class QuestionTrainingSessionThroughModel(models.Model):
@@ -617,3 +803,121 @@ class QuestionTrainingSessionThroughModel(models.Model):
     def save(self, *args, **kwargs):
         self.full_clean()
         return super().save(*args, **kwargs)
+
+
+class TopicProgress(models.Model):
+    # running count of the multiple-choice questions of a topic a student has answered,
+    # and answered correctly, across their turned in sessions
+    user = models.ForeignKey(
+        User,
+        related_name="topic_progress",
+        on_delete=models.CASCADE,
+    )
+    topic = models.ForeignKey(
+        Topic,
+        related_name="student_progress",
+        on_delete=models.CASCADE,
+    )
+    answered = models.PositiveIntegerField(default=0)
+    correct = models.PositiveIntegerField(default=0)
+
+    objects = TopicProgressManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "topic"], name="same_user_topic_unique_progress"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.user} - {self.topic} - {self.correct}/{self.answered}"
+
+    @property
+    def error_percentage(self):
+        if self.answered == 0:
+            return None
+        return round(100 * (self.answered - self.correct) / self.answered, 2)
+
+
+class Checkpoint(models.Model):
+    # progress of a resumable management command, e.g. `regrade`
+    name = models.CharField(max_length=255, unique=True)
+    last_processed_id = models.BigIntegerField()
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} - {self.last_processed_id}"
+
+    @classmethod
+    def get_last_processed_id(cls, name):
+        return (
+            cls.objects.filter(name=name)
+            .values_list("last_processed_id", flat=True)
+            .first()
+        )
+
+    @classmethod
+    def save_progress(cls, name, last_processed_id):
+        cls.objects.update_or_create(
+            name=name, defaults={"last_processed_id": last_processed_id}
+        )
+
+    @classmethod
+    def clear(cls, name):
+        cls.objects.filter(name=name).delete()
+
+
+class RenderedFormula(models.Model):
+    # svg of a TeX formula, keyed by the hash of its normalized source and display mode,
+    # so formulas shared by many items are only rendered once
+    digest = models.CharField(max_length=64, primary_key=True)
+    source = models.TextField()
+    display = models.BooleanField()
+    svg = models.TextField()
+    last_used = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return self.source
+
+    @classmethod
+    def trim(cls, max_entries):
+        """
+        Deletes the least recently used formulas beyond the most recent `max_entries`
+        """
+        cutoff = (
+            cls.objects.order_by("-last_used")
+            .values_list("last_used", flat=True)[max_entries : max_entries + 1]
+            .first()
+        )
+        if cutoff is not None:
+            cls.objects.filter(last_used__lte=cutoff).delete()
+
+
+class TexGlyph(models.Model):
+    # outline of a font glyph used by rendered formulas: formulas reference glyphs by
+    # id instead of embedding them, and glyphs are served once in a shared sprite
+    name = models.CharField(max_length=64, primary_key=True)
+    path = models.TextField()
+
+    def __str__(self):
+        return self.name
+
+
+class QuestionStats(models.Model):
+    # item analysis of a multiple-choice question, computed in batch by the
+    # `compute_question_stats` command from the answers given in turned in sessions
+    question = models.OneToOneField(
+        Question,
+        primary_key=True,
+        related_name="stats",
+        on_delete=models.CASCADE,
+    )
+    attempts = models.PositiveIntegerField()
+    p_value = models.FloatField()
+    discrimination = models.FloatField(null=True, blank=True)
+    choice_pick_rates = models.JSONField(default=dict)  # choice id -> pick rate
+    computed = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return str(self.question)
@@ -0,0 +1,135 @@
+import json
+import logging
+import os
+import subprocess
+import threading
+
+from django.conf import settings
+
+from .process import (
+    LineReader,
+    NodeProcessError,
+    NodeTimeoutError,
+    get_breaker,
+    kill_process_group,
+    popen_node,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class MathJaxServer:
+    """
+    A long-lived `tex2svg-server` process, which loads MathJax once and then renders
+    batches of TeX formulas sent over its stdin, one JSON object per line. The process
+    is started on first use and started again if it crashes or gets stuck
+    """
+
+    def __init__(self, server_path, timeout):
+        self.server_path = server_path
+        self.timeout = timeout
+        self.breaker = get_breaker("tex")
+        self.process = None
+        self.reader = None
+        self.requests_sent = 0
+        self.lock = threading.Lock()
+
+    def _start(self):
+        self.process = popen_node(
+            ["-r", "esm", self.server_path],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            bufsize=0,
+        )
+        self.reader = LineReader(self.process.stdout)
+
+    def _stop(self):
+        kill_process_group(self.process)
+        self.process.stdin.close()
+        self.process.stdout.close()
+        self.process = None
+
+    def _send(self, formulas):
+        if self.process is None or self.process.poll() is not None:
+            self._start()
+
+        request_id = self.requests_sent
+        self.requests_sent += 1
+        try:
+            self.process.stdin.write(
+                (json.dumps({"id": request_id, "formulas": formulas}) + "\n").encode()
+            )
+            line = self.reader.readline(self.timeout)
+        except (BrokenPipeError, OSError) as e:
+            self._stop()
+            raise NodeProcessError("MathJax server crashed") from e
+        except NodeTimeoutError:
+            self._stop()
+            raise
+
+        try:
+            response = json.loads(line)
+        except ValueError as e:  # empty line: the process exited
+            self._stop()
+            raise NodeProcessError("MathJax server crashed") from e
+
+        if response.get("id") != request_id:
+            self._stop()
+            raise NodeProcessError("MathJax server is out of sync")
+
+        for index, error in response.get("errors", {}).items():
+            logger.warning(f"Couldn't render {formulas[int(index)]!r}: {error}")
+        return response["svgs"]
+
+    def _render(self, formulas):
+        try:
+            svgs = self._send(formulas)
+        except NodeProcessError:
+            self.breaker.record_failure()
+            raise
+
+        self.breaker.record_success()
+        return svgs
+
+    def render(self, formulas):
+        """
+        Returns the svgs for the given list of formulas, with None in place of the
+        ones that couldn't be rendered
+        """
+        if not formulas:
+            return []
+
+        self.breaker.check()
+        with self.lock:
+            try:
+                return self._render(formulas)
+            except NodeProcessError:
+                logger.warning("MathJax server crashed, restarting it")
+
+            # the process might have died before the request reached it: give the
+            # request a second chance on a fresh one before giving up
+            return self._render(formulas)
+
+    def shutdown(self):
+        with self.lock:
+            if self.process is not None:
+                self._stop()
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def get_mathjax_server():
+    global _server
+
+    with _server_lock:
+        if _server is None:
+            _server = MathJaxServer(
+                server_path=os.environ.get(
+                    "NODE_TEX2SVG_SERVER_URL",
+                    "training/tex-render/component/tex2svg-server",
+                ),
+                timeout=settings.NODE_TEX_TIMEOUT,
+            )
+        return _server
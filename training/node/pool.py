@@ -0,0 +1,224 @@
+import json
+import logging
+import os
+import queue
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .process import (
+    READY_LINE,
+    LineReader,
+    NodeCrashError,
+    NodeProcessError,
+    NodeTimeoutError,
+    get_breaker,
+    kill_process_group,
+    popen_node,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class NodeWorkerError(NodeProcessError):
+    pass
+
+
+class NodeWorker:
+    """
+    A long-lived `node vm.js --worker` process: jobs are written to its stdin and
+    their outcomes are read from its stdout, one JSON object per line
+    """
+
+    def __init__(self, node_vm_path, timeout):
+        self.process = popen_node(
+            [node_vm_path, "--worker"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            bufsize=0,
+        )
+        self.reader = LineReader(self.process.stdout)
+        self.timeout = timeout
+        self.jobs_done = 0
+        self.last_used = time.monotonic()
+        self.broken = False
+        self.ready = False
+
+    def is_alive(self):
+        return not self.broken and self.process.poll() is None
+
+    def wait_ready(self):
+        if self.ready:
+            return
+        try:
+            line = self.reader.readline(self.timeout)
+        except NodeTimeoutError:
+            line = b""
+        if line != READY_LINE:
+            self.broken = True
+            kill_process_group(self.process)
+            raise NodeWorkerError(f"Node worker {self.process.pid} didn't start")
+        self.ready = True
+
+    def send(self, payload):
+        try:
+            self.process.stdin.write((json.dumps(payload) + "\n").encode())
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            # the worker died before the job reached it
+            self.broken = True
+            raise NodeWorkerError(f"Node worker {self.process.pid} crashed") from e
+
+        self.wait_ready()
+        try:
+            line = self.reader.readline(self.timeout)
+        except NodeTimeoutError:
+            # the job is stuck, e.g. on an endless asynchronous loop that the
+            # vm's timeout can't catch: the worker can't be reused
+            self.broken = True
+            kill_process_group(self.process)
+            raise
+
+        self.last_used = time.monotonic()
+        if not line:  # the process exited while running the job
+            self.broken = True
+            raise NodeCrashError(f"Node worker {self.process.pid} crashed")
+
+        try:
+            return json.loads(line)
+        except ValueError as e:
+            self.broken = True
+            raise NodeWorkerError(f"Node worker {self.process.pid} is broken") from e
+
+    def ping(self):
+        try:
+            return self.send({"ping": True}).get("pong", False)
+        except (NodeWorkerError, NodeTimeoutError, NodeCrashError):
+            return False
+
+    def run(self, code, testcases_json):
+        outcome = self.send(
+            {"id": self.jobs_done, "code": code, "assertions": testcases_json}
+        )
+        self.jobs_done += 1
+        outcome.pop("id", None)
+        return outcome
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        self.process.stdin.close()
+        self.process.stdout.close()
+
+
+class NodeWorkerPool:
+    """
+    Keeps up to `size` node workers around and hands them out one job at a time.
+    Workers are spawned lazily, recycled after `max_jobs` jobs or as soon as they
+    crash or exceed `timeout` seconds on a job, and health-checked before being
+    reused if they've been idle for more than `health_check_interval` seconds
+    """
+
+    def __init__(
+        self, node_vm_path, size, max_jobs, health_check_interval, timeout=None
+    ):
+        self.node_vm_path = node_vm_path
+        self.size = size
+        self.max_jobs = max_jobs
+        self.health_check_interval = health_check_interval
+        self.timeout = timeout or settings.NODE_VM_TIMEOUT
+        self.breaker = get_breaker("vm")
+        self.idle_workers = queue.LifoQueue()
+        # one token per worker that's allowed to exist
+        self.slots = threading.BoundedSemaphore(size)
+
+    def _get_worker(self):
+        while True:
+            try:
+                worker = self.idle_workers.get_nowait()
+            except queue.Empty:
+                return NodeWorker(self.node_vm_path, self.timeout)
+
+            idle_time = time.monotonic() - worker.last_used
+            if worker.is_alive() and (
+                idle_time < self.health_check_interval or worker.ping()
+            ):
+                return worker
+
+            logger.warning(f"Discarding unhealthy node worker {worker.process.pid}")
+            worker.stop()
+
+    def _release_worker(self, worker):
+        # workers can be reused as vm.js keeps the jobs it runs from affecting one
+        # another: host objects are frozen, and each job is answered only once the
+        # code it left running is done
+        if worker.is_alive() and worker.jobs_done < self.max_jobs:
+            self.idle_workers.put(worker)
+        else:
+            worker.stop()
+
+    @contextmanager
+    def checkout(self):
+        self.slots.acquire()
+        worker = None
+        try:
+            worker = self._get_worker()
+            yield worker
+        finally:
+            if worker is not None:
+                self._release_worker(worker)
+            self.slots.release()
+
+    def _run(self, code, testcases_json):
+        # timeouts and crashes are caused by the submitted code rather than by node,
+        # so they're left out of the breaker's count
+        try:
+            with self.checkout() as worker:
+                outputs = worker.run(code, testcases_json)
+        except NodeProcessError:
+            self.breaker.record_failure()
+            raise
+
+        self.breaker.record_success()
+        return outputs
+
+    def run(self, code, testcases_json):
+        self.breaker.check()
+        try:
+            return self._run(code, testcases_json)
+        except NodeWorkerError:
+            logger.warning("Node worker failed, retrying job on a fresh one")
+
+        # the worker broke before running the job, e.g. it died while idle: give the
+        # job a second chance on a new worker before giving up. Jobs that were
+        # running when their worker died or got stuck aren't run again
+        return self._run(code, testcases_json)
+
+    def shutdown(self):
+        while True:
+            try:
+                self.idle_workers.get_nowait().stop()
+            except queue.Empty:
+                return
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = NodeWorkerPool(
+                node_vm_path=os.environ.get("NODE_VM_PATH", "training/node/vm.js"),
+                size=settings.NODE_VM_POOL_SIZE,
+                max_jobs=settings.NODE_VM_WORKER_MAX_JOBS,
+                health_check_interval=settings.NODE_VM_WORKER_HEALTH_CHECK_INTERVAL,
+            )
+        return _pool
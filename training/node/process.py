@@ -0,0 +1,198 @@
+import logging
+import os
+import select
+import signal
+import subprocess
+import threading
+import time
+
+from core.metrics import increment
+from django.conf import settings
+
+try:
+    from resource import RLIMIT_DATA, prlimit
+except ImportError:  # only available on linux
+    prlimit = None
+
+logger = logging.getLogger(__name__)
+
+# printed by vm.js once it's set up, before it runs any submitted code: node dying
+# after that is the doing of the code it was running rather than a failure of node
+READY_LINE = b'{"ready":true}\n'
+
+
+class NodeProcessError(Exception):
+    """
+    Node crashed, couldn't be started or returned garbage
+    """
+
+
+class NodeTimeoutError(Exception):
+    """
+    Node didn't answer within its wall-clock limit and was killed
+    """
+
+
+class NodeCrashError(Exception):
+    """
+    Node died while running submitted code, e.g. because the code used up all the
+    memory it was allowed
+    """
+
+
+class NodeUnavailableError(Exception):
+    """
+    Node has been failing consistently and isn't being called for a while
+    """
+
+
+def popen_node(args, **kwargs):
+    """
+    Starts node in its own process group, so it can be killed along with anything
+    it spawned, and with its memory capped
+    """
+    limit_mb = settings.NODE_MEMORY_LIMIT_MB
+    try:
+        process = subprocess.Popen(
+            ["node", f"--max-old-space-size={limit_mb}", *args],
+            start_new_session=True,
+            **kwargs,
+        )
+    except OSError as e:
+        raise NodeProcessError("Couldn't start node") from e
+
+    # the V8 heap is capped by the flag above, everything else by RLIMIT_DATA
+    # (rather than RLIMIT_AS, as V8 reserves gigabytes of address space at startup).
+    # The rlimit is set from here rather than in `preexec_fn`, which can deadlock the
+    # child when called from threads like the ones grading submissions
+    if prlimit is not None:
+        limit = limit_mb * 1024 * 1024
+        try:
+            prlimit(process.pid, RLIMIT_DATA, (limit, limit))
+        except ProcessLookupError:  # node already exited
+            pass
+    return process
+
+
+def kill_process_group(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:  # already gone
+        pass
+    process.wait()
+    increment("node.kills")
+
+
+def run_node(args, timeout, breaker, expect_ready=False):
+    """
+    Like `subprocess.check_output`, but kills node if it runs for longer than
+    `timeout` seconds and goes through the given circuit breaker. With
+    `expect_ready`, node is expected to print `READY_LINE` first, which is left out
+    of the output, and dying after that raises `NodeCrashError`
+    """
+    breaker.check()
+
+    process = popen_node(args, stdout=subprocess.PIPE)
+    try:
+        output, _ = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        kill_process_group(process)
+        increment("node.timeouts")
+        raise NodeTimeoutError(f"Node was killed after {timeout} seconds")
+
+    ready = expect_ready and output.startswith(READY_LINE)
+    if ready:
+        output = output[len(READY_LINE) :]
+
+    if process.returncode != 0:
+        if ready:  # the code that was running is to blame, not node
+            increment("node.crashes")
+            raise NodeCrashError(f"Node exited with status {process.returncode}")
+
+        breaker.record_failure()
+        raise NodeProcessError(f"Node exited with status {process.returncode}")
+
+    breaker.record_success()
+    return output
+
+
+class LineReader:
+    """
+    Reads lines from a pipe, giving up if a line doesn't arrive in time
+    """
+
+    def __init__(self, pipe):
+        self.fd = pipe.fileno()
+        self.buffer = b""
+
+    def readline(self, timeout):
+        deadline = time.monotonic() + timeout
+        while b"\n" not in self.buffer:
+            remaining = deadline - time.monotonic()
+            ready, _, _ = select.select([self.fd], [], [], max(remaining, 0))
+            if not ready:
+                increment("node.timeouts")
+                raise NodeTimeoutError(f"Node didn't answer within {timeout} seconds")
+
+            chunk = os.read(self.fd, 65536)
+            if not chunk:  # end of file: the process exited
+                line, self.buffer = self.buffer, b""
+                return line
+            self.buffer += chunk
+
+        line, self.buffer = self.buffer.split(b"\n", 1)
+        return line + b"\n"
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures: while open, calls are rejected
+    right away instead of spawning node processes that are bound to fail. After
+    `reset_timeout` seconds the next call is let through, and closes the breaker
+    again if it succeeds
+    """
+
+    def __init__(self, name, threshold, reset_timeout):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def check(self):
+        with self.lock:
+            if (
+                self.opened_at is not None
+                and time.monotonic() - self.opened_at < self.reset_timeout
+            ):
+                increment(f"node.{self.name}.rejected")
+                raise NodeUnavailableError(f"Node ({self.name}) is failing")
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logger.error(f"Opening circuit breaker for node ({self.name})")
+                self.opened_at = time.monotonic()
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(
+                name,
+                threshold=settings.NODE_CIRCUIT_BREAKER_THRESHOLD,
+                reset_timeout=settings.NODE_CIRCUIT_BREAKER_RESET_TIMEOUT,
+            )
+        return _breakers[name]
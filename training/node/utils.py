@@ -1,6 +1,41 @@
 import json
 import os
 import subprocess
+import threading
+from itertools import islice
+
+from django.conf import settings
+
+from .process import (
+    READY_LINE,
+    LineReader,
+    NodeCrashError,
+    NodeProcessError,
+    NodeTimeoutError,
+    get_breaker,
+    kill_process_group,
+    popen_node,
+    run_node,
+)
+
+
+def get_killed_outputs(timeout):
+    # outputs reported for a submission whose node process had to be killed
+    return {
+        "error": f"Execution was stopped after {timeout} seconds",
+        "killed": True,
+        "timed_out": True,
+        "time_ms": timeout * 1000,
+    }
+
+
+def get_crashed_outputs():
+    # outputs reported for a submission that made its node process die, e.g. by
+    # using up all the memory it was allowed
+    return {
+        "error": "Execution was stopped: the program crashed or ran out of memory",
+        "killed": True,
+    }
 
 
 def run_code_in_vm(code, testcases_json):
@@ -9,16 +44,138 @@ def run_code_in_vm(code, testcases_json):
     virtual machine and returns the outputs given by the code in JSON format
     """
 
-    node_vm_path = os.environ.get("NODE_VM_PATH", "training/node/vm.js")
+    try:
+        if settings.NODE_VM_POOL_SIZE > 0:
+            from .pool import get_pool
 
-    # call node subprocess and run user code against test cases
-    res = subprocess.check_output(
-        [
-            "node",
-            node_vm_path,
-            code,
-            json.dumps(testcases_json),
-        ]
-    )
+            # check out one of the long-lived node workers instead of forking
+            return get_pool().run(code, testcases_json)
+
+        node_vm_path = os.environ.get("NODE_VM_PATH", "training/node/vm.js")
+
+        # call node subprocess and run user code against test cases
+        res = run_node(
+            [
+                node_vm_path,
+                code,
+                json.dumps(testcases_json),
+            ],
+            timeout=settings.NODE_VM_TIMEOUT,
+            breaker=get_breaker("vm"),
+            expect_ready=True,
+        )
+    except NodeTimeoutError:
+        return get_killed_outputs(settings.NODE_VM_TIMEOUT)
+    except NodeCrashError:
+        return get_crashed_outputs()
 
     return json.loads(res)
+
+
+def run_many_in_vm(jobs, chunk_size=None):
+    """
+    Takes in an iterable of (submission_id, code, testcases_json) tuples and runs each
+    submission in its own JS virtual machine, spawning a single node process for every
+    `chunk_size` submissions; yields (submission_id, outputs) pairs as they're streamed
+    back by node, where outputs are in the same format returned by `run_code_in_vm`.
+    Submissions that get stuck or make node die are reported as killed, and the rest
+    of their chunk is run in a new process
+    """
+
+    node_vm_path = os.environ.get("NODE_VM_PATH", "training/node/vm.js")
+    chunk_size = chunk_size or settings.NODE_VM_BATCH_SIZE
+    breaker = get_breaker("vm")
+
+    jobs = iter(jobs)
+    while True:
+        chunk = list(islice(jobs, chunk_size))
+        if not chunk:
+            return
+
+        breaker.check()
+        process = popen_node(
+            [node_vm_path, "--batch"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+
+        # jobs are written from another thread: node starts streaming outcomes
+        # before it has read all of them, and would block on a full stdout pipe
+        def write_jobs(chunk=chunk):
+            try:
+                for submission_id, code, testcases_json in chunk:
+                    process.stdin.write(
+                        (
+                            json.dumps(
+                                {
+                                    "submission_id": submission_id,
+                                    "code": code,
+                                    "assertions": testcases_json,
+                                }
+                            )
+                            + "\n"
+                        ).encode()
+                    )
+            except (BrokenPipeError, ValueError):  # node exited or was killed
+                pass
+            finally:
+                try:
+                    process.stdin.close()
+                except BrokenPipeError:
+                    pass
+
+        writer = threading.Thread(target=write_jobs)
+        writer.start()
+
+        # node answers jobs in the order it receives them
+        pending_jobs = list(chunk)
+        reader = LineReader(process.stdout)
+        try:
+            ready = reader.readline(settings.NODE_VM_TIMEOUT) == READY_LINE
+        except NodeTimeoutError:
+            ready = False
+        if not ready:
+            kill_process_group(process)
+            writer.join()
+            process.stdout.close()
+            breaker.record_failure()
+            raise NodeProcessError("Node didn't start")
+
+        timed_out = False
+        while pending_jobs:
+            try:
+                line = reader.readline(settings.NODE_VM_TIMEOUT)
+            except NodeTimeoutError:
+                kill_process_group(process)
+                timed_out = True
+                break
+
+            if not line:  # node exited before answering all jobs
+                break
+
+            outputs = json.loads(line)
+            submission_id = outputs.pop("submission_id")
+            pending_jobs = [job for job in pending_jobs if job[0] != submission_id]
+            yield submission_id, outputs
+
+        writer.join()
+        if not timed_out:
+            try:
+                # code left running after its job was answered keeps node alive
+                process.wait(timeout=settings.NODE_VM_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                kill_process_group(process)
+        process.stdout.close()
+
+        if pending_jobs:
+            # the first unanswered job got stuck or made node die, as vm.js only
+            # answers a job once the code it left running is done: report it as
+            # killed, and run the ones after it in a new process
+            yield pending_jobs[0][0], (
+                get_killed_outputs(settings.NODE_VM_TIMEOUT)
+                if timed_out
+                else get_crashed_outputs()
+            )
+            yield from run_many_in_vm(pending_jobs[1:], chunk_size)
+        else:
+            breaker.record_success()
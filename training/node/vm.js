@@ -1,11 +1,27 @@
 /*
 usage: 
 node vm.js programCode assertions
+node vm.js --worker
+node vm.js --batch
 
 arguments:
 programCode is a STRING containing a js program
 assertions is an ARRAY of strings representing assertions made using node assertions
 
+with --worker, the process stays alive and reads jobs from stdin, one JSON object per line:
+{ id: Any, code: String, assertions: Array } runs a submission, { ping: true } is a health check;
+each job is answered with a JSON line on stdout: the outcome described below with the job id
+added to it, or { pong: true } for health checks
+
+with --batch, jobs are read from stdin in the same format, identified by a submission_id
+rather than an id, until stdin is closed; each job gets its own VM and its outcome is
+streamed back as a JSON line carrying the job's submission_id
+
+in both modes, jobs are run one at a time, and each job is only answered once the code it
+left running, e.g. promise callbacks, is done
+
+in every mode, the first line printed is { ready: true }, once the modules are loaded and
+before any submitted code is run
 
 output: 
 an array printed to the console (and collected by Django via subprocess.check_output()) where each entry 
@@ -16,36 +32,36 @@ corresponds to an assertion and is an object:
     public: Boolean,
     passed: Boolean,
     error: String,
+    time_ms: Number,
 } 
 where id is the id of the assertion (as in the Django database),
 assertion is the string containing the assertion verbatim,
 public indicates whether the assertion is to be shown to the user or it's secret,
 passed represents the outcome of running the assertion on the program,
-and error is only present if the assertion failed
+error is only present if the assertion failed,
+and time_ms is the time it took to run the assertion
+
+the outcome also carries the total time spent running the program (time_ms), the peak
+resident set size of the node process in kilobytes (peak_rss_kb) and, if the program
+didn't finish in time, timed_out: true. Node only reports the peak of the whole process,
+so peak_rss_kb is null when it can't be ascribed to the program: a process that already
+ran other jobs, and didn't reach a new peak during this one
 */
 
 // The VM2 module allows to execute arbitrary code safely using a sandboxed, secure virtual machine
 const { VM } = require('vm2')
 const assert = require('assert')
 const AssertionError = require('assert').AssertionError
+const { performance } = require('perf_hooks')
 const timeout = 1000
 
-// instantiation of the vm that'll run the user-submitted program
-const safevm = new VM({
-  timeout, // set timeout to prevent endless loops from running forever
-  sandbox: {
-    prettyPrintError,
-    prettyPrintAssertionError,
-    assert,
-    AssertionError
-  }
-})
+const isTimeoutError = e => /execution timed out/.test(e.stack)
 
 function prettyPrintError (e) {
   const tokens = e.stack.split(/(.*)at (new Script(.*))?vm.js:([0-9]+)(.*)/)
   const rawStr = tokens[0] // error message
 
-  if (rawStr.match(/execution timed out/)) {
+  if (isTimeoutError(e)) {
     // time out: no other information available
     return `Execution timed out after ${timeout} ms`
   }
@@ -73,24 +89,38 @@ function prettyPrintAssertionError (e) {
   )
 }
 
-const escapeBackTicks = t => t.replace(/`/g, '\\`')
+// number of submissions this process has run
+let jobsRun = 0
 
-const userCode = process.argv[2]
+const escapeBackTicks = t => t.replace(/`/g, '\\`')
 
-const assertions = JSON.parse(process.argv[3])
+function runSubmission (userCode, assertions) {
+  // a fresh vm is instantiated for each submission so no state can leak between them
+  const safevm = new VM({
+    timeout // set timeout to prevent endless loops from running forever
+  })
+  // the same host objects are handed to the vms of all the submissions a process runs:
+  // they're frozen, so that a submission can't tamper with them, e.g. to make the
+  // assertions of the ones run after it pass
+  safevm.freeze(() => performance.now(), 'now_fjeiowqjfeiow')
+  safevm.freeze(prettyPrintError, 'prettyPrintError')
+  safevm.freeze(prettyPrintAssertionError, 'prettyPrintAssertionError')
+  safevm.freeze(assert, 'assert')
+  safevm.freeze(AssertionError, 'AssertionError')
 
-// turn array of strings representing assertions to a series of try-catch blocks
-//  where those assertions are evaluated and the result is pushed to an array
-// the resulting string will be inlined into the program that the vm will run
-const assertionString = assertions
-  .map(
-    (
-      a // put assertion into a try-catch block
-    ) =>
-      `
+  // turn array of strings representing assertions to a series of try-catch blocks
+  //  where those assertions are evaluated and the result is pushed to an array
+  // the resulting string will be inlined into the program that the vm will run
+  const assertionString = assertions
+    .map(
+      (
+        a // put assertion into a try-catch block
+      ) =>
+        `
         ran = {id: ${a.id}, assertion: \`${escapeBackTicks(
         a.assertion
       )}\`, is_public: ${a.is_public}}
+        ran.time_ms = now_fjeiowqjfeiow()
         try {
             ${a.assertion} // run the assertion
             ran.passed = true // if no exception is thrown, the test case passed
@@ -102,15 +132,17 @@ const assertionString = assertions
                 ran.error = prettyPrintError(e)
             }
         }
+        ran.time_ms = now_fjeiowqjfeiow() - ran.time_ms
         output_wquewoajfjoiwqi.push(ran)
-    `
-  )
-  .reduce((a, b) => a + b, '') // reduce array of strings to a string
-// support for executing the user-submitted program
-// contains a utility function to stringify errors, the user code, and a series of try-catch's
-// where assertions are ran against the user code; the program evaluates to an array of outcomes
-// resulting from those assertions
-const runnableProgram = `const output_wquewoajfjoiwqi = []; const arr_jiodferwqjefio = Array; const push_djiowqufewio = Array.prototype.push; const shift_dfehwioioefn = Array.prototype.shift
+      `
+    )
+    .reduce((a, b) => a + b, '') // reduce array of strings to a string
+
+  // support for executing the user-submitted program
+  // contains a utility function to stringify errors, the user code, and a series of try-catch's
+  // where assertions are ran against the user code; the program evaluates to an array of outcomes
+  // resulting from those assertions
+  const runnableProgram = `const output_wquewoajfjoiwqi = []; const arr_jiodferwqjefio = Array; const push_djiowqufewio = Array.prototype.push; const shift_dfehwioioefn = Array.prototype.shift
 ${userCode}
 // USER CODE ENDS HERE
 
@@ -135,9 +167,97 @@ ${assertionString}
 // output outcome object to console
 output_wquewoajfjoiwqi`
 
-try {
-  const outcome = safevm.run(runnableProgram) // run program
-  console.log(JSON.stringify({ tests: outcome })) // output outcome so Django can collect it
-} catch (e) {
-  console.log(JSON.stringify({ error: prettyPrintError(e) }))
+  const peakBefore = process.resourceUsage().maxRSS
+  const start = performance.now()
+  let outcome
+  try {
+    outcome = { tests: safevm.run(runnableProgram) } // run program
+  } catch (e) {
+    outcome = { error: prettyPrintError(e) }
+    if (isTimeoutError(e)) {
+      outcome.timed_out = true
+    }
+  }
+  outcome.time_ms = performance.now() - start
+  const peak = process.resourceUsage().maxRSS
+  outcome.peak_rss_kb = jobsRun === 0 || peak > peakBefore ? peak : null
+  jobsRun++
+  return outcome
+}
+
+// runs a job read from stdin in worker or batch mode, echoing its identifiers in the outcome
+function runJob (job) {
+  const outcome = runSubmission(job.code, job.assertions)
+  if (job.submission_id !== undefined) {
+    return { submission_id: job.submission_id, ...outcome }
+  }
+  return { id: job.id, ...outcome }
+}
+
+// writes an outcome once the tasks the submitted code left behind, e.g. promise
+// callbacks, have run: code that's still running then holds up the job that started it
+// rather than the next one
+function writeOutcome (outcome, callback) {
+  setImmediate(() => {
+    console.log(JSON.stringify(outcome))
+    if (callback) {
+      callback()
+    }
+  })
+}
+
+// promises the submitted code rejects without handling them aren't part of its outcome
+process.on('unhandledRejection', () => {})
+
+function readJobs (onJob, onEnd) {
+  const readline = require('readline')
+  const rl = readline.createInterface({ input: process.stdin, terminal: false })
+
+  // jobs are run one at a time, each one once the previous one has been answered
+  let answered = Promise.resolve()
+  rl.on('line', line => {
+    if (!line.trim()) {
+      return
+    }
+    let job
+    try {
+      job = JSON.parse(line)
+    } catch (e) {
+      job = null
+    }
+    answered = answered.then(
+      () =>
+        new Promise(resolve =>
+          writeOutcome(job === null ? { error: 'Malformed job' } : onJob(job), resolve)
+        )
+    )
+  })
+  rl.on('close', () => answered.then(onEnd))
+}
+
+function runWorker () {
+  readJobs(
+    job => (job.ping ? { pong: true } : runJob(job)),
+    () => process.exit(0)
+  )
+}
+
+function runBatch () {
+  // outcomes are streamed as soon as each job is done; the process exits once
+  // stdin is closed and all jobs have been answered
+  readJobs(runJob, () => process.exit(0))
+}
+
+// modules are loaded: from now on, the process dying is the doing of the code it runs
+console.log(JSON.stringify({ ready: true }))
+
+if (process.argv.length === 3 && process.argv[2] === '--worker') {
+  runWorker()
+} else if (process.argv.length === 3 && process.argv[2] === '--batch') {
+  runBatch()
+} else {
+  const userCode = process.argv[2]
+  const assertions = JSON.parse(process.argv[3])
+  // output outcome so Django can collect it
+  writeOutcome(runSubmission(userCode, assertions))
 }
@@ -1,6 +1,6 @@
 from rest_framework.permissions import SAFE_METHODS, BasePermission
 
-from training.models import Course, Topic
+from training.access import get_course_access
 
 
 class TeacherOrReadOnly(BasePermission):
@@ -13,30 +13,16 @@ class TeacherOrReadOnly(BasePermission):
 
 class EnrolledOnly(BasePermission):
     def has_permission(self, request, view):
-        try:
-            course = Course.objects.get(pk=view.kwargs["course_pk"])
-        except KeyError:
-            topic = Topic.objects.get(pk=view.kwargs["topic_pk"])
-            course = Course.objects.get(pk=topic.course.pk)
-
-        return request.user in course.enrolled_students.all()
+        return get_course_access(request, view).is_enrolled()
 
 
 class AllowedTeacherOrEnrolledOnly(BasePermission):
     def has_permission(self, request, view):
-        try:
-            course = Course.objects.get(pk=view.kwargs["course_pk"])
-        except KeyError:
-            topic = Topic.objects.get(pk=view.kwargs["topic_pk"])
-            course = Course.objects.get(pk=topic.course.pk)
-
+        access = get_course_access(request, view)
         if request.user.is_teacher:
-            return (
-                request.user == course.creator
-                or request.user in course.allowed_teachers.all()
-            )
+            return access.is_allowed_teacher()
 
-        return request.user in course.enrolled_students.all()
+        return access.is_enrolled()
 
 
 # TODO these two should be in users app
@@ -0,0 +1,109 @@
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+
+def get_question_stats(responses):
+    """
+    Takes in an iterable of (question_id, session_id, choice_id, correct) tuples, one
+    per multiple-choice question of a turned in session, with None as the choice of
+    unanswered questions, and returns a dict that maps each question id to:
+        - the number of attempts
+        - its p-value, i.e. the fraction of correct answers
+        - its point-biserial discrimination, i.e. the correlation between the score
+        on the question and the score on the rest of the session, or None where it's
+        undefined
+        - the fraction of attempts each choice was picked in
+    Responses are streamed into compact arrays, then all the questions are computed
+    at once. Requires NumPy
+    """
+    question_ids, session_ids, choice_ids, correct = (
+        array("q"),
+        array("q"),
+        array("q"),
+        array("b"),
+    )
+    for question_id, session_id, choice_id, is_correct in responses:
+        question_ids.append(question_id)
+        session_ids.append(session_id)
+        choice_ids.append(choice_id or 0)
+        correct.append(bool(is_correct))
+
+    if not question_ids:
+        return {}
+
+    questions, question_index = np.unique(
+        np.frombuffer(question_ids, dtype=np.int64), return_inverse=True
+    )
+    _, session_index = np.unique(
+        np.frombuffer(session_ids, dtype=np.int64), return_inverse=True
+    )
+    choices = np.frombuffer(choice_ids, dtype=np.int64)
+    score = np.frombuffer(correct, dtype=np.int8).astype(np.float64)
+
+    attempts = np.bincount(question_index)
+    p_values = np.bincount(question_index, weights=score) / attempts
+
+    # score of the session on its other questions, for sessions that have any
+    others = np.bincount(session_index)[session_index] - 1
+    has_others = others > 0
+    rest_score = np.divide(
+        np.bincount(session_index, weights=score)[session_index] - score,
+        others,
+        out=np.zeros_like(score),
+        where=has_others,
+    )
+
+    def sum_per_question(values):
+        # bincount returns integers when no session has other questions
+        return np.bincount(
+            question_index[has_others],
+            weights=values[has_others],
+            minlength=len(questions),
+        ).astype(np.float64)
+
+    # pearson correlation from the sums over each question's attempts, where the sum
+    # of the squared scores is the sum of the scores, as they're either 0 or 1
+    n = sum_per_question(np.ones_like(score))
+    sum_score = sum_per_question(score)
+    sum_rest = sum_per_question(rest_score)
+    covariance = n * sum_per_question(score * rest_score) - sum_score * sum_rest
+    variance = (n * sum_score - sum_score**2) * (
+        n * sum_per_question(rest_score**2) - sum_rest**2
+    )
+    # a question everybody got right (or wrong) doesn't discriminate at all
+    defined = variance > 1e-12
+    discrimination = np.divide(
+        covariance,
+        np.sqrt(variance, where=defined, out=np.ones_like(variance, dtype=np.float64)),
+        out=np.full_like(variance, np.nan),
+        where=defined,
+    )
+
+    # number of picks of each (question, choice) pair
+    answered = choices != 0
+    pairs, picks = np.unique(
+        np.stack([question_index[answered], choices[answered]]),
+        axis=1,
+        return_counts=True,
+    )
+    pick_rates = [{} for _ in questions]
+    for index, choice_id, count in zip(pairs[0], pairs[1], picks):
+        pick_rates[index][int(choice_id)] = count / attempts[index]
+
+    return {
+        int(question_id): {
+            "attempts": int(attempts[index]),
+            "p_value": float(p_values[index]),
+            "discrimination": (
+                float(discrimination[index]) if defined[index] else None
+            ),
+            "choice_pick_rates": {
+                choice_id: float(rate) for choice_id, rate in pick_rates[index].items()
+            },
+        }
+        for index, question_id in enumerate(questions)
+    }
@@ -1,9 +1,18 @@
+from collections import OrderedDict
+
+from django.urls import reverse
 from rest_framework import serializers
 
+from training.cache import (
+    get_cached_representation,
+    get_role,
+    set_cached_representation,
+)
 from training.models import (
     QuestionTrainingSessionThroughModel,
     TestCaseOutcomeThroughModel,
 )
+from training.tex import get_glyph_sprite
 
 from .models import (
     AbstractItem,
@@ -13,7 +22,9 @@ from .models import (
     ExerciseTestCase,
     ProgrammingExercise,
     Question,
+    QuestionStats,
     Topic,
+    TopicProgress,
     TrainingSession,
     TrainingTemplate,
     TrainingTemplateRule,
@@ -96,9 +107,62 @@ class TeachersOnlyFieldsModelSerializer(serializers.ModelSerializer):
                 self.fields.pop(field)
 
 
+class CachedRepresentationModelSerializer(serializers.ModelSerializer):
+    # Serves the representation of items from the cache in `training.cache`, where it's
+    # stored per role of the requesting user. Fields listed in `uncached_fields` depend
+    # on the requesting user rather than on their role, so they're left out of the cached
+    # fragment and computed again on every call
+    uncached_fields = []
+
+    def to_representation(self, instance):
+        if not isinstance(instance, AbstractItem) or instance.pk is None:
+            return super().to_representation(instance)
+
+        role = get_role(self.context["request"].user)
+        cached_representation = get_cached_representation(instance, role)
+
+        if cached_representation is None:
+            representation = super().to_representation(instance)
+            set_cached_representation(
+                instance,
+                role,
+                {
+                    field: value
+                    for field, value in representation.items()
+                    if field not in self.uncached_fields
+                },
+            )
+            return representation
+
+        representation = OrderedDict(cached_representation)
+        for field_name in self.uncached_fields:
+            field = self.fields.get(field_name)
+            if field is not None:
+                representation[field_name] = field.to_representation(
+                    field.get_attribute(instance)
+                )
+        return representation
+
+
+class TexGlyphsUrlField(serializers.Field):
+    # url of the sprite with the glyphs referenced by the rendered formulas in the
+    # representation, which clients add to the page to display them
+    def __init__(self, **kwargs):
+        kwargs["source"] = "*"
+        kwargs["read_only"] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        version, _ = get_glyph_sprite()
+        return self.context["request"].build_absolute_uri(
+            reverse("tex-glyphs", kwargs={"version": version})
+        )
+
+
 class CourseSerializer(TeachersOnlyFieldsModelSerializer):
     creator = serializers.CharField(source="creator.full_name", required=False)
     creator_id = serializers.IntegerField(source="creator.pk", required=False)
+    tex_glyphs = TexGlyphsUrlField()
 
     class Meta:
         model = Course
@@ -109,8 +173,15 @@ class CourseSerializer(TeachersOnlyFieldsModelSerializer):
             "creator",
             "number_enrolled",
             "uses_programming_exercises",
+            "tex_glyphs",
+        ]
+        teachers_only_fields = [
+            "allowed_teachers",
+            "creator_id",
+            "submission_rate",
+            "submission_burst",
+            "max_concurrent_submissions",
         ]
-        teachers_only_fields = ["allowed_teachers", "creator_id"]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -120,7 +191,7 @@ class CourseSerializer(TeachersOnlyFieldsModelSerializer):
             self.fields["in_progress_session"] = serializers.SerializerMethodField()
 
     def get_enrolled(self, obj):
-        return self.context["request"].user in obj.enrolled_students.all()
+        return obj.enrolled_students.filter(pk=self.context["request"].user.pk).exists()
 
     def get_in_progress_session(self, obj):
         return TrainingSession.objects.filter(
@@ -211,7 +282,9 @@ class TrainingSessionOutcomeSerializer(ReadOnlyModelSerializer):
         )
 
 class QuestionSerializer(
-    TeachersOnlyFieldsModelSerializer, NestedCreateUpdateSerializer
+    CachedRepresentationModelSerializer,
+    TeachersOnlyFieldsModelSerializer,
+    NestedCreateUpdateSerializer,
 ):
     # send difficulty as string rather than number for easier manipulation in frontend
     difficulty = serializers.CharField()
@@ -238,6 +311,27 @@ class QuestionSerializer(
             self.fields["text"] = serializers.CharField(source="rendered_text")
 
 
+class QuestionStatsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = QuestionStats
+        fields = [
+            "question",
+            "attempts",
+            "p_value",
+            "discrimination",
+            "choice_pick_rates",
+            "computed",
+        ]
+
+
+class TopicProgressSerializer(serializers.ModelSerializer):
+    error_percentage = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = TopicProgress
+        fields = ["user", "topic", "answered", "correct", "error_percentage"]
+
+
 class TestCaseOutcomeSerializer(serializers.ModelSerializer):
     class Meta:
         model = TestCaseOutcomeThroughModel
@@ -256,7 +350,7 @@ class SubmissionSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = ExerciseSubmission
-        fields = ["id", "code", "outcomes", "error", "timestamp"]
+        fields = ["id", "code", "outcomes", "error", "timestamp", "status"]
 
 
 class ExerciseTestCaseSerializer(serializers.ModelSerializer):
@@ -266,7 +360,9 @@ class ExerciseTestCaseSerializer(serializers.ModelSerializer):
 
 
 class ProgrammingExerciseSerializer(
-    TeachersOnlyFieldsModelSerializer, NestedCreateUpdateSerializer
+    CachedRepresentationModelSerializer,
+    TeachersOnlyFieldsModelSerializer,
+    NestedCreateUpdateSerializer,
 ):
     # send difficulty as string rather than number for easier manipulation in frontend
     difficulty = serializers.CharField()
@@ -274,6 +370,9 @@ class ProgrammingExerciseSerializer(
     child_model = ExerciseTestCase
     child_serializer = ExerciseTestCaseSerializer
 
+    # submissions are specific to the requesting student
+    uncached_fields = ["submissions"]
+
     class Meta:
         model = ProgrammingExercise
         fields = [
@@ -308,9 +407,11 @@ class ProgrammingExerciseSerializer(
 
 
 class TrainingSessionSerializer(ReadOnlyModelSerializer):
+    tex_glyphs = TexGlyphsUrlField()
+
     class Meta:
         model = TrainingSession
-        fields = ["id", "questions", "begin_timestamp"]
+        fields = ["id", "questions", "begin_timestamp", "tex_glyphs"]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -319,9 +420,12 @@ class TrainingSessionSerializer(ReadOnlyModelSerializer):
 
 
 class TrainingTemplateRuleSerializer(serializers.ModelSerializer):
-    difficulty_profile = serializers.CharField(source="difficulty_profile_code")
+    difficulty_profile = serializers.ChoiceField(
+        source="difficulty_profile_code",
+        choices=TrainingTemplateRule.DIFFICULTY_PROFILE_CHOICES,
+    )
     topic = serializers.CharField(source="topic.name")
-    amount = serializers.IntegerField()
+    amount = serializers.IntegerField(min_value=0)
 
     class Meta:
         model = TrainingTemplateRule
@@ -331,22 +435,57 @@ class TrainingTemplateRuleSerializer(serializers.ModelSerializer):
 class TrainingTemplateSerializer(serializers.ModelSerializer):
     rules = TrainingTemplateRuleSerializer(source="trainingtemplaterule_set", many=True)
 
+    AMOUNT_FIELDS = [
+        "amount_very_easy",
+        "amount_easy",
+        "amount_medium",
+        "amount_hard",
+        "amount_very_hard",
+    ]
+
     class Meta:
         model = TrainingTemplate
         fields = ["id", "rules", "name", "description", "custom"]
 
+    def validate_rules(self, value):
+        # rules are written in bulk, without `full_clean`: catch the duplicates here
+        # rather than as an IntegrityError
+        topic_names = [rule_data["topic"]["name"] for rule_data in value]
+        if len(set(topic_names)) != len(topic_names):
+            raise serializers.ValidationError("Each topic can only have one rule.")
+        return value
+
+    def build_rules(self, template, rules_data):
+        # fetch all the topics referenced by the rules with a single query
+        topic_names = set(rule_data["topic"]["name"] for rule_data in rules_data)
+        topics = {
+            topic.name: topic
+            for topic in Topic.objects.filter(
+                course=template.course, name__in=topic_names
+            )
+        }
+        if len(topics) != len(topic_names):
+            raise serializers.ValidationError(
+                {"rules": "Chosen topic does not belong to template's course."}
+            )
+
+        # rules are built in memory: their topics are guaranteed to belong to
+        # the template's course, so they can skip `full_clean`
+        return [
+            TrainingTemplateRule.objects.build(
+                training_template=template,
+                topic=topics[rule_data["topic"]["name"]],
+                amount=rule_data["amount"],
+                difficulty_profile_code=rule_data["difficulty_profile_code"],
+            )
+            for rule_data in rules_data
+        ]
+
     def create(self, validated_data):
         rules_data = validated_data.pop("trainingtemplaterule_set")
 
         template = TrainingTemplate.objects.create(**validated_data)
-
-        # create objects for each rule
-        for rule in rules_data:
-            topic_data = rule.pop("topic")
-            topic = Topic.objects.get(course=template.course, name=topic_data["name"])
-            TrainingTemplateRule.objects.create(
-                training_template=template, topic=topic, **rule
-            )
+        TrainingTemplateRule.objects.bulk_create(self.build_rules(template, rules_data))
 
         return template
 
@@ -355,15 +494,40 @@ class TrainingTemplateSerializer(serializers.ModelSerializer):
 
         instance = super().update(instance, validated_data)
 
-        instance.rules.clear()
-
-        for rule_data in rules_data:
-            topic_data = rule_data.pop("topic")
-            topic = Topic.objects.get(name=topic_data["name"], course=instance.course)
-            rule = TrainingTemplateRule.objects.create(
-                training_template=instance, topic=topic, **rule_data
+        existing_rules = {
+            rule.topic_id: rule for rule in instance.trainingtemplaterule_set.all()
+        }
+
+        rules_to_create = []
+        rules_to_update = []
+        for rule in self.build_rules(instance, rules_data):
+            existing_rule = existing_rules.pop(rule.topic_id, None)
+            if existing_rule is None:
+                rules_to_create.append(rule)
+                continue
+
+            changed_fields = [
+                field
+                for field in ["difficulty_profile_code"] + self.AMOUNT_FIELDS
+                if getattr(existing_rule, field) != getattr(rule, field)
+            ]
+            if changed_fields:  # rules that didn't change aren't rewritten
+                for field in changed_fields:
+                    setattr(existing_rule, field, getattr(rule, field))
+                rules_to_update.append(existing_rule)
+
+        # rules that are still in `existing_rules` at this point were
+        # deleted in the frontend because no data was sent for them
+        if existing_rules:
+            TrainingTemplateRule.objects.filter(
+                pk__in=[rule.pk for rule in existing_rules.values()]
+            ).delete()
+        if rules_to_update:
+            TrainingTemplateRule.objects.bulk_update(
+                rules_to_update, ["difficulty_profile_code"] + self.AMOUNT_FIELDS
             )
-            instance.rules.add()
+        if rules_to_create:
+            TrainingTemplateRule.objects.bulk_create(rules_to_create)
 
         return instance
 
@@ -1,22 +1,148 @@
+from functools import partial
+
 from core.celery import render_tex_task
-from django.db.models.signals import post_save
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
 from django.dispatch import receiver
 
+from training.access import invalidate_course_access, invalidate_visible_courses
+from training.cache import (
+    invalidate_course_templates,
+    invalidate_user_templates,
+    touch_item,
+)
+
+
+def get_render_parent(instance):
+    # TeX is rendered per item: a question along with its choices
+    if type(instance).__name__ == "Choice":
+        return ("Question", instance.question_id)
+    return (type(instance).__name__, instance.pk)
+
+
+def schedule_render(model, pk):
+    # all the saves to an item and its children in a burst, e.g. a transaction
+    # updating a question and its choices or a bulk import, end up in one task: the
+    # first one schedules it and the others find it already scheduled, which is
+    # fine as the task reads the latest values when it runs
+    if cache.add(
+        f"tex_render_scheduled:{model}:{pk}", True, settings.TEX_RENDER_DEBOUNCE
+    ):
+        render_tex_task.apply_async(
+            kwargs={"model": model, "pk": pk},
+            countdown=settings.TEX_RENDER_DEBOUNCE,
+        )
+
 
 @receiver(post_save)
-def render_tex_fields(sender, instance, created, **kwargs):
-    pass
-    # if not hasattr(sender, "renderable_tex_fields"):
-    #     return
-
-    # re_render_fields = {}
-    # for (source, target) in sender.renderable_tex_fields:
-    #     value_changed = created or (
-    #         getattr(instance, source) != getattr(instance, f"_old_{source}", "")
-    #     )
-    #     if value_changed:
-    #         re_render_fields[target] = getattr(instance, source)
-
-    # render_tex_task.delay(
-    #     model=sender.__name__, pk=instance.pk, fields=re_render_fields
-    # )
+def render_tex_fields(sender, instance, created, raw=False, **kwargs):
+    if not hasattr(sender, "renderable_tex_fields") or raw:
+        return
+
+    value_changed = False
+    for source, _ in sender.renderable_tex_fields:
+        value = getattr(instance, source)
+        if created or value != getattr(instance, f"_old_{source}", None):
+            value_changed = True
+        setattr(instance, f"_old_{source}", value)
+
+    if not value_changed:
+        return
+
+    # nothing is scheduled for transactions that are rolled back
+    transaction.on_commit(partial(schedule_render, *get_render_parent(instance)))
+
+
+@receiver(post_save, sender="training.Choice")
+@receiver(post_delete, sender="training.Choice")
+def invalidate_question_representation(sender, instance, **kwargs):
+    from training.models import Question
+
+    touch_item(Question, instance.question_id)
+
+
+@receiver(post_save, sender="training.ExerciseTestCase")
+@receiver(post_delete, sender="training.ExerciseTestCase")
+def invalidate_exercise_representation(sender, instance, **kwargs):
+    from training.models import ProgrammingExercise
+
+    touch_item(ProgrammingExercise, instance.exercise_id)
+
+
+@receiver(post_save, sender="training.Enrollment")
+@receiver(post_delete, sender="training.Enrollment")
+def invalidate_enrollment_access(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate_course_access([(instance.course_id, instance.user_id)])
+
+
+def get_changed_memberships(sender, instance, action, reverse, pk_set):
+    # returns the (course id, user id) pairs affected by a change to the members of
+    # a course, as both through models link a course to a user
+    if action == "pre_clear":
+        # the members that are going to be removed aren't passed in
+        return list(
+            sender.objects.filter(
+                **{"user_id" if reverse else "course_id": instance.pk}
+            ).values_list("course_id", "user_id")
+        )
+    if action in ("post_add", "post_remove"):
+        return [(pk, instance.pk) if reverse else (instance.pk, pk) for pk in pk_set]
+    return []
+
+
+@receiver(m2m_changed, sender="training.Enrollment")
+def invalidate_enrollments_access(sender, instance, action, reverse, pk_set, **kwargs):
+    invalidate_course_access(
+        get_changed_memberships(sender, instance, action, reverse, pk_set)
+    )
+
+
+@receiver(m2m_changed, sender="training.Course_allowed_teachers")
+def invalidate_allowed_teachers_access(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    memberships = get_changed_memberships(sender, instance, action, reverse, pk_set)
+    invalidate_course_access(memberships)
+    invalidate_visible_courses({user_id for _, user_id in memberships})
+
+
+@receiver(pre_save, sender="training.Course")
+def remember_course_creator(sender, instance, raw=False, **kwargs):
+    if not raw and instance.pk is not None:
+        instance._old_creator_id = (
+            sender.objects.filter(pk=instance.pk)
+            .values_list("creator_id", flat=True)
+            .first()
+        )
+
+
+@receiver(post_save, sender="training.Course")
+def invalidate_creator_visible_courses(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    # both the previous creator, if it changed, and the current one are affected
+    creator_ids = {instance.creator_id, getattr(instance, "_old_creator_id", None)}
+    creator_ids.discard(None)
+    invalidate_course_access([(instance.pk, user_id) for user_id in creator_ids])
+    invalidate_visible_courses(creator_ids)
+
+
+@receiver(post_save, sender="training.TrainingSession")
+def invalidate_trainee_templates(sender, instance, created, raw=False, **kwargs):
+    # templates used by the trainee's latest sessions are listed for them
+    if created and not raw:
+        invalidate_user_templates(instance.course_id, instance.trainee_id)
+
+
+@receiver(post_save, sender="training.TrainingTemplate")
+@receiver(post_delete, sender="training.TrainingTemplate")
+@receiver(post_save, sender="training.Topic")
+@receiver(post_delete, sender="training.Topic")
+def invalidate_templates(sender, instance, **kwargs):
+    # rules are written in bulk after their template is saved, hence on commit, and
+    # they show the names of their topics
+    transaction.on_commit(partial(invalidate_course_templates, instance.course_id))
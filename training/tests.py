@@ -1,17 +1,32 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from io import StringIO
+from unittest import skipIf
+from unittest.mock import patch
+
 from django.core.exceptions import ValidationError
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
 from users.models import User
 
 from training.models import (
     AbstractItem,
+    Checkpoint,
     Choice,
     Course,
+    ExerciseSubmission,
+    ExerciseTestCase,
+    ProgrammingExercise,
     Question,
+    QuestionTrainingSessionThroughModel,
     Topic,
     TrainingSession,
     TrainingTemplate,
     TrainingTemplateRule,
 )
+from training.psychometrics import np
 
 
 def user_data_set_up(obj):
@@ -104,6 +119,52 @@ class TrainingTemplateTestCase(TestCase):
         course_topic_data_set_up(self)
         questions_data_set_up(self)
 
+    def test_templates_listed_to_students_are_cached(self):
+        from django.core.cache import cache
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        cache.clear()
+        self.math_course.enrolled_students.add(self.student)
+        public_template = TrainingTemplate.objects.create(
+            name="public", course=self.math_course
+        )
+        TrainingTemplateRule.objects.create(
+            amount=5,
+            training_template=public_template,
+            difficulty_profile_code=TrainingTemplateRule.BALANCED,
+            topic=self.topic_trigonometry,
+        )
+        custom_template = TrainingTemplate.objects.create(
+            name="custom", course=self.math_course, custom=True
+        )
+
+        client = APIClient()
+        client.force_authenticate(user=self.student)
+
+        def get_templates():
+            return client.get(f"/courses/{self.math_course.pk}/templates/").data
+
+        self.assertEquals([t["name"] for t in get_templates()], ["public"])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEquals(get_templates()[0]["rules"][0]["topic"], "trigonometry")
+        self.assertFalse(
+            [query for query in queries if "training_trainingtemplate" in query["sql"]]
+        )
+
+        # templates of the student's latest sessions are listed too
+        TrainingSession.objects.create(
+            trainee=self.student,
+            course=self.math_course,
+            training_template=custom_template,
+        )
+        self.assertEquals([t["name"] for t in get_templates()], ["public", "custom"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.topic_trigonometry.name = "trig"
+            self.topic_trigonometry.save()
+        self.assertEquals(get_templates()[0]["rules"][0]["topic"], "trig")
+
     def test_balanced_profile(self):
         template1 = TrainingTemplate.objects.create(
             name="template1",
@@ -595,11 +656,19 @@ class TrainingSessionEvaluationCreationTestCase(TestCase):
         self.assertTrue(session2.in_progress)
 
         answers = {
+            str(self.trigo_q1.pk): self.trigo_q1c_correct.pk,
             "10000": self.trigo_q1c_correct.pk,  # nonexistent question
         }
 
         with self.assertRaises(ValidationError):
             session2.turn_in(answers)
+        # nothing is written for sessions that are turned in with invalid answers
+        self.assertTrue(TrainingSession.objects.get(pk=session2.pk).in_progress)
+        self.assertFalse(
+            QuestionTrainingSessionThroughModel.objects.filter(
+                training_session=session2, selected_choice__isnull=False
+            ).exists()
+        )
 
         new_question = Question.objects.create(
             course=self.math_course,
@@ -627,3 +696,1365 @@ class TrainingSessionEvaluationCreationTestCase(TestCase):
         with self.assertRaises(ValidationError):
             # can't turn in more than once
             session2.turn_in(answers)
+
+    def test_topic_progress(self):
+        from django.core.cache import cache
+
+        from training.models import TopicProgress
+
+        cache.clear()
+        self.topic_trigonometry.help_text = "trigonometry help"
+        self.topic_trigonometry.save()
+        self.topic_logarithms.help_text = "logarithms help"
+        self.topic_logarithms.error_percentage_for_help_text = 60
+        self.topic_logarithms.save()
+        self.math_course.enrolled_students.add(self.student)
+
+        for answers in [
+            {
+                self.trigo_q1: self.trigo_q1c_correct,
+                self.trigo_q2: self.trigo_q2c_incorrect,
+                self.log_q1: None,
+                self.log_q2: self.log_q2c_incorrect,
+            },
+            {
+                self.trigo_q1: self.trigo_q1c_incorrect,
+                self.log_q1: self.log_q1c_correct,
+            },
+        ]:
+            session = TrainingSession.objects.create(
+                trainee=self.student,
+                training_template=self.template1,
+                course=self.math_course,
+            )
+            session.questions.clear()
+            for position, question in enumerate(answers):
+                session.questions.add(question, through_defaults={"position": position})
+            session.turn_in(
+                {
+                    str(question.pk): choice and choice.pk
+                    for question, choice in answers.items()
+                }
+            )
+
+        trigo_progress = TopicProgress.objects.get(
+            user=self.student, topic=self.topic_trigonometry
+        )
+        self.assertEquals((trigo_progress.answered, trigo_progress.correct), (3, 1))
+        log_progress = TopicProgress.objects.get(
+            user=self.student, topic=self.topic_logarithms
+        )
+        self.assertEquals((log_progress.answered, log_progress.correct), (2, 1))
+
+        # 66% of wrong answers on trigonometry is over the default threshold, 50% on
+        # logarithms is under the topic's
+        self.assertEquals(
+            session.relevant_help_texts, {"trigonometry": "trigonometry help"}
+        )
+
+        # a session that's already over isn't counted again
+        with self.assertRaises(ValidationError):
+            session.turn_in({})
+        self.assertEquals(TopicProgress.objects.get(pk=trigo_progress.pk).answered, 3)
+
+        client = APIClient()
+        client.force_authenticate(user=self.teacher)
+        response = client.get(
+            f"/courses/{self.math_course.pk}/students/{self.student.pk}/topics/"
+        )
+        self.assertEquals(
+            [(p["topic"], p["error_percentage"]) for p in response.data],
+            [(self.topic_trigonometry.pk, 66.67), (self.topic_logarithms.pk, 50.0)],
+        )
+        response = client.get(f"/courses/{self.math_course.pk}/students/heatmap/")
+        self.assertEquals(len(response.data), 2)
+
+        client.force_authenticate(user=self.student)
+        response = client.get(f"/courses/{self.math_course.pk}/students/heatmap/")
+        self.assertEquals(response.status_code, 403)
+
+
+@skipIf(np is None, "NumPy is not installed")
+class QuestionStatsTestCase(TestCase):
+    def setUp(self):
+        user_data_set_up(self)
+        course_topic_data_set_up(self)
+        questions_data_set_up(self)
+        template = TrainingTemplate.objects.create(name="t", course=self.math_course)
+
+        # each session answers trigo_q1 then trigo_q2, None means unanswered
+        for answers in [
+            (self.trigo_q1c_correct, self.trigo_q2c_correct),
+            (self.trigo_q1c_correct, self.trigo_q2c_incorrect),
+            (self.trigo_q1c_incorrect, self.trigo_q2c_incorrect),
+            (self.trigo_q1c_incorrect, None),
+        ]:
+            session = TrainingSession.objects.create(
+                trainee=self.student,
+                course=self.math_course,
+                training_template=template,
+                in_progress=False,
+            )
+            for position, (question, choice) in enumerate(
+                zip((self.trigo_q1, self.trigo_q2), answers)
+            ):
+                session.questions.add(
+                    question,
+                    through_defaults={"position": position, "selected_choice": choice},
+                )
+
+    def test_question_stats(self):
+        from django.core.management import call_command
+
+        from training.models import QuestionStats
+
+        call_command("compute_question_stats", stdout=StringIO())
+
+        q1_stats = QuestionStats.objects.get(question=self.trigo_q1)
+        self.assertEquals(q1_stats.attempts, 4)
+        self.assertEquals(q1_stats.p_value, 0.5)
+        self.assertAlmostEquals(q1_stats.discrimination, 1 / 3**0.5)
+        q2_stats = QuestionStats.objects.get(question=self.trigo_q2)
+        self.assertEquals(q2_stats.p_value, 0.25)
+        self.assertEquals(
+            q2_stats.choice_pick_rates,
+            {
+                str(self.trigo_q2c_correct.pk): 0.25,
+                str(self.trigo_q2c_incorrect.pk): 0.5,
+            },
+        )
+        # questions nobody answered have no stats
+        self.assertFalse(QuestionStats.objects.filter(question=self.log_q1).exists())
+
+        client = APIClient()
+        client.force_authenticate(user=self.teacher)
+        response = client.get(
+            f"/courses/{self.math_course.pk}/questions/stats/?ordering=p_value"
+        )
+        self.assertEquals(
+            [stats["question"] for stats in response.data],
+            [self.trigo_q2.pk, self.trigo_q1.pk],
+        )
+
+    def test_question_stats_without_other_questions(self):
+        from django.core.management import call_command
+
+        from training.models import QuestionStats
+
+        # no session of this course has another question to correlate with
+        physics_course = Course.objects.create(name="physics", creator=self.teacher)
+        topic = Topic.objects.create(name="kinematics", course=physics_course)
+        question = Question.objects.create(
+            text="v = ?",
+            topic=topic,
+            course=physics_course,
+            difficulty=AbstractItem.EASY,
+        )
+        choice = Choice.objects.create(question=question, text="s / t", correct=True)
+        session = TrainingSession.objects.create(
+            trainee=self.student,
+            course=physics_course,
+            training_template=TrainingTemplate.objects.create(
+                name="t", course=physics_course
+            ),
+            in_progress=False,
+        )
+        session.questions.add(
+            question, through_defaults={"position": 0, "selected_choice": choice}
+        )
+
+        call_command("compute_question_stats", stdout=StringIO())
+
+        stats = QuestionStats.objects.get(question=question)
+        self.assertEquals(stats.attempts, 1)
+        self.assertEquals(stats.p_value, 1)
+        self.assertIsNone(stats.discrimination)
+        self.assertTrue(QuestionStats.objects.filter(question=self.trigo_q1).exists())
+
+
+class SerializedItemCacheTestCase(TestCase):
+    def setUp(self):
+        from types import SimpleNamespace
+
+        from django.core.cache import cache
+
+        cache.clear()
+        user_data_set_up(self)
+        course_topic_data_set_up(self)
+        questions_data_set_up(self)
+        self.teacher_context = {"request": SimpleNamespace(user=self.teacher)}
+
+    def serialize(self, question):
+        from training.serializers import QuestionSerializer
+
+        return QuestionSerializer(
+            instance=Question.objects.get(pk=question.pk),
+            context=self.teacher_context,
+        ).data
+
+    def test_representation_is_reused(self):
+        self.serialize(self.trigo_q1)
+
+        # choices aren't fetched again when the representation is cached
+        with self.assertNumQueries(1):
+            data = self.serialize(self.trigo_q1)
+        self.assertEquals(len(data["choices"]), 2)
+
+    def test_choice_change_invalidates_representation(self):
+        self.serialize(self.trigo_q1)
+
+        self.trigo_q1c_incorrect.text = "changed"
+        self.trigo_q1c_incorrect.save()
+        self.assertIn(
+            "changed", [c["text"] for c in self.serialize(self.trigo_q1)["choices"]]
+        )
+
+        self.trigo_q1c_incorrect.delete()
+        self.assertEquals(len(self.serialize(self.trigo_q1)["choices"]), 1)
+
+
+class CourseAccessTestCase(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        user_data_set_up(self)
+        course_topic_data_set_up(self)
+        self.other_teacher = User.objects.create(
+            username="other_teacher", email="other_teacher@unipi.it"
+        )
+        self.client = APIClient()
+
+    def get_topics(self, user):
+        self.client.force_authenticate(user=user)
+        return self.client.get(f"/courses/{self.math_course.pk}/topics/")
+
+    def test_enrollment_is_checked_once_and_cached(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        self.assertEquals(self.get_topics(self.student).status_code, 403)
+
+        # enrolling takes effect right away
+        self.client.post(f"/courses/{self.math_course.pk}/enroll/")
+        self.assertEquals(self.get_topics(self.student).status_code, 200)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEquals(self.get_topics(self.student).status_code, 200)
+        self.assertFalse(
+            [query for query in queries if "training_enrollment" in query["sql"]]
+        )
+
+        self.math_course.enrolled_students.remove(self.student)
+        self.assertEquals(self.get_topics(self.student).status_code, 403)
+
+    def test_allowed_teachers(self):
+        self.assertEquals(self.get_topics(self.teacher).status_code, 200)
+        self.assertEquals(self.get_topics(self.other_teacher).status_code, 403)
+
+        self.math_course.allowed_teachers.add(self.other_teacher)
+        self.assertEquals(self.get_topics(self.other_teacher).status_code, 200)
+
+        self.math_course.allowed_teachers.clear()
+        self.assertEquals(self.get_topics(self.other_teacher).status_code, 403)
+
+    def test_visible_courses(self):
+        def get_course_names(user):
+            self.client.force_authenticate(user=user)
+            return [course["name"] for course in self.client.get("/courses/").data]
+
+        self.assertEquals(get_course_names(self.teacher), ["math"])
+        self.assertEquals(get_course_names(self.other_teacher), [])
+
+        self.client.post("/courses/", {"name": "physics"})
+        self.assertEquals(get_course_names(self.other_teacher), ["physics"])
+
+        self.math_course.allowed_teachers.add(self.other_teacher)
+        self.assertEquals(
+            sorted(get_course_names(self.other_teacher)), ["math", "physics"]
+        )
+
+        self.other_teacher.visible_courses.remove(self.math_course)
+        self.assertEquals(get_course_names(self.other_teacher), ["physics"])
+
+        self.math_course.creator = self.other_teacher
+        self.math_course.save()
+        self.assertEquals(get_course_names(self.teacher), [])
+        self.assertEquals(self.get_topics(self.teacher).status_code, 403)
+        self.assertEquals(
+            sorted(get_course_names(self.other_teacher)), ["math", "physics"]
+        )
+
+
+class TrainingTemplateSerializerTestCase(TestCase):
+    def setUp(self):
+        user_data_set_up(self)
+        course_topic_data_set_up(self)
+
+    def get_rules_data(self, **amounts):
+        return [
+            {
+                "topic": topic_name,
+                "amount": amount,
+                "difficulty_profile": TrainingTemplateRule.BALANCED,
+            }
+            for topic_name, amount in amounts.items()
+        ]
+
+    def save(self, data, instance=None):
+        from training.serializers import TrainingTemplateSerializer
+
+        serializer = TrainingTemplateSerializer(instance=instance, data=data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.save(course=self.math_course)
+
+    def test_create_and_update(self):
+        template = self.save(
+            {
+                "name": "template",
+                "rules": self.get_rules_data(trigonometry=5, logarithms=4),
+            }
+        )
+        rules = {r.topic.name: r for r in template.trainingtemplaterule_set.all()}
+        self.assertEquals(rules["trigonometry"].amount, 5)
+        self.assertEquals(rules["trigonometry"].amount_very_easy, 1)
+        self.assertEquals(rules["logarithms"].amount, 4)
+        self.assertEquals(rules["logarithms"].amount_very_easy, 0)
+
+        self.save(
+            {
+                "name": "template",
+                "rules": self.get_rules_data(trigonometry=5, exponentials=2),
+            },
+            instance=template,
+        )
+        updated_rules = {
+            r.topic.name: r for r in template.trainingtemplaterule_set.all()
+        }
+        self.assertSetEqual(
+            set(updated_rules.keys()), set(["trigonometry", "exponentials"])
+        )
+        # untouched rules are left as they were
+        self.assertEquals(updated_rules["trigonometry"].pk, rules["trigonometry"].pk)
+        self.assertEquals(updated_rules["exponentials"].amount, 2)
+
+    def test_topic_from_another_course(self):
+        from rest_framework.exceptions import ValidationError as DRFValidationError
+
+        with self.assertRaises(DRFValidationError):
+            self.save({"name": "template", "rules": self.get_rules_data(geometry=2)})
+
+    def test_invalid_rules(self):
+        from rest_framework.exceptions import ValidationError as DRFValidationError
+
+        rules = self.get_rules_data(trigonometry=2)
+        for invalid_rules in [
+            rules + rules,  # same topic twice
+            [{**rules[0], "difficulty_profile": "impossible"}],
+            [{**rules[0], "amount": -1}],
+        ]:
+            with self.assertRaises(DRFValidationError):
+                self.save({"name": "template", "rules": invalid_rules})
+        self.assertFalse(TrainingTemplate.objects.exists())
+
+
+def exercises_data_set_up(obj):
+    obj.exercise = ProgrammingExercise.objects.create(
+        text="write a function `f` that returns 1",
+        topic=obj.topic_trigonometry,
+        course=obj.math_course,
+        difficulty=AbstractItem.EASY,
+    )
+    obj.testcase1 = ExerciseTestCase.objects.create(
+        exercise=obj.exercise, code="assert.equal(f(), 1)"
+    )
+    obj.testcase2 = ExerciseTestCase.objects.create(
+        exercise=obj.exercise, code="assert.equal(f() + 1, 2)"
+    )
+
+
+class ExerciseSubmissionTestCase(TestCase):
+    def setUp(self):
+        from django.core.cache import caches
+
+        caches["grading"].clear()
+        user_data_set_up(self)
+        course_topic_data_set_up(self)
+        exercises_data_set_up(self)
+
+    def get_run_results(self, code, testcases_json):
+        return {
+            "tests": [
+                {"id": t["id"], "assertion": t["assertion"], "passed": True}
+                for t in testcases_json
+            ]
+        }
+
+    @override_settings(GRADE_SUBMISSIONS_ASYNC=False)
+    def test_synchronous_grading(self):
+        with patch(
+            "training.models.run_code_in_vm", side_effect=self.get_run_results
+        ) as run_code_in_vm:
+            submission = ExerciseSubmission.objects.create(
+                user=self.student, exercise=self.exercise, code="const f = () => 1"
+            )
+
+        run_code_in_vm.assert_called_once()
+        submission.refresh_from_db()
+        self.assertEquals(submission.status, ExerciseSubmission.DONE)
+        self.assertEquals(
+            submission.testcaseoutcomethroughmodel_set.filter(passed=True).count(), 2
+        )
+
+    @override_settings(GRADE_SUBMISSIONS_ASYNC=True)
+    def test_asynchronous_grading(self):
+        with patch("core.celery.grade_submission_task.delay") as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                submission = ExerciseSubmission.objects.create(
+                    user=self.student,
+                    exercise=self.exercise,
+                    code="const f = () => 1",
+                )
+                # nothing is enqueued before the submission is committed
+                delay.assert_not_called()
+
+        delay.assert_called_once_with(submission_id=submission.pk)
+        self.assertEquals(submission.status, ExerciseSubmission.PENDING)
+
+    @override_settings(GRADE_SUBMISSIONS_ASYNC=False)
+    def test_identical_submissions_are_graded_once(self):
+        with patch(
+            "training.models.run_code_in_vm", side_effect=self.get_run_results
+        ) as run_code_in_vm:
+            ExerciseSubmission.objects.create(
+                user=self.student, exercise=self.exercise, code="const f = () => 1"
+            )
+            ExerciseSubmission.objects.create(
+                user=self.student,
+                exercise=self.exercise,
+                code="const f = () => 1\r\n\r\n",
+            )
+            self.assertEquals(run_code_in_vm.call_count, 1)
+
+            # changing a testcase makes the cached results unreachable
+            self.testcase2.code = "assert.equal(f() + 2, 3)"
+            self.testcase2.save()
+            submission = ExerciseSubmission.objects.create(
+                user=self.student, exercise=self.exercise, code="const f = () => 1"
+            )
+            self.assertEquals(run_code_in_vm.call_count, 2)
+
+        self.assertEquals(
+            submission.testcaseoutcomethroughmodel_set.filter(passed=True).count(), 2
+        )
+
+    def test_pending_submissions_are_claimed_round_robin(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        other_student = User.objects.create(
+            username="student2", email="student2@studenti.unipi.it"
+        )
+        with override_settings(GRADE_SUBMISSIONS_ASYNC=True):
+            first, second, third = [
+                ExerciseSubmission.objects.create(
+                    user=self.student, exercise=self.exercise, code=f"// {i}"
+                )
+                for i in range(3)
+            ]
+            other = ExerciseSubmission.objects.create(
+                user=other_student, exercise=self.exercise, code="// 0"
+            )
+
+        claimed = [ExerciseSubmission.objects.claim_next() for _ in range(5)]
+        self.assertEquals(claimed, [first, other, second, third, None])
+        self.assertFalse(
+            ExerciseSubmission.objects.filter(
+                status=ExerciseSubmission.PENDING
+            ).exists()
+        )
+
+    def test_abandoned_submissions_are_claimed_again(self):
+        from datetime import timedelta
+
+        from django.utils import timezone
+
+        with override_settings(GRADE_SUBMISSIONS_ASYNC=True):
+            submission = ExerciseSubmission.objects.create(
+                user=self.student, exercise=self.exercise, code="const f = () => 1"
+            )
+        self.assertEquals(ExerciseSubmission.objects.claim_next("a"), submission)
+        self.assertIsNone(ExerciseSubmission.objects.claim_next("b"))
+
+        # the task is delivered again after its worker died
+        self.assertEquals(ExerciseSubmission.objects.claim_next("a"), submission)
+
+        # nobody is grading the submission anymore
+        ExerciseSubmission.objects.filter(pk=submission.pk).update(
+            grading_started=timezone.now() - timedelta(hours=1)
+        )
+        self.assertEquals(ExerciseSubmission.objects.claim_next("b"), submission)
+        self.assertIsNone(ExerciseSubmission.objects.claim_next("c"))
+
+    @override_settings(GRADE_SUBMISSIONS_ASYNC=True)
+    def test_submissions_that_cant_be_enqueued_are_done(self):
+        with patch(
+            "core.celery.grade_submission_task.delay", side_effect=ConnectionError
+        ):
+            with self.captureOnCommitCallbacks(execute=True):
+                submission = ExerciseSubmission.objects.create(
+                    user=self.student, exercise=self.exercise, code="const f = () => 1"
+                )
+
+        submission.refresh_from_db()
+        self.assertEquals(submission.status, ExerciseSubmission.DONE)
+        self.assertIn("couldn't be graded", submission.error)
+
+    def test_status_and_outcomes_are_written_together(self):
+        with override_settings(GRADE_SUBMISSIONS_ASYNC=True):
+            submission = ExerciseSubmission.objects.create(
+                user=self.student, exercise=self.exercise, code="const f = () => 1"
+            )
+
+        with patch("training.models.run_code_in_vm", side_effect=self.get_run_results):
+            with patch.object(
+                ExerciseSubmission, "save_outcomes", side_effect=RuntimeError
+            ):
+                with self.assertRaises(RuntimeError):
+                    submission.grade()
+
+        submission.refresh_from_db()
+        self.assertEquals(submission.status, ExerciseSubmission.RUNNING)
+
+    @override_settings(GRADE_SUBMISSIONS_ASYNC=True, GRADING_MAX_RETRIES=0)
+    def test_submissions_failing_to_be_graded_are_done(self):
+        from core.celery import grade_submission_task
+        from training.node.process import NodeProcessError
+
+        for error in (NodeProcessError, ValueError):
+            submission = ExerciseSubmission.objects.create(
+                user=self.student, exercise=self.exercise, code="const f = () => 1"
+            )
+            with patch("training.models.run_code_in_vm", side_effect=error):
+                result = grade_submission_task.apply(
+                    kwargs={"submission_id": submission.pk}
+                )
+
+            self.assertTrue(result.failed())
+            submission.refresh_from_db()
+            self.assertEquals(submission.status, ExerciseSubmission.DONE)
+            self.assertIn("couldn't be graded", submission.error)
+
+    @override_settings(GRADE_SUBMISSIONS_ASYNC=True)
+    def test_submission_admission_control(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        self.math_course.enrolled_students.add(self.student)
+        self.math_course.submission_burst = 3
+        self.math_course.max_concurrent_submissions = 2
+        self.math_course.save()
+
+        client = APIClient()
+        client.force_authenticate(user=self.student)
+        url = (
+            f"/courses/{self.math_course.pk}/programming_exercises/"
+            f"{self.exercise.pk}/submit/"
+        )
+
+        with patch("core.celery.grade_submission_task.delay"):
+            responses = [
+                client.post(url, {"code": "const f = () => 1"}, format="json")
+                for _ in range(3)
+            ]
+            # the third submission is over the concurrency cap
+            self.assertEquals(
+                [response.status_code for response in responses], [202, 202, 429]
+            )
+            self.assertIn("Retry-After", responses[2])
+
+            # once a submission is graded, a new one is let in as long as the
+            # token bucket isn't empty
+            ExerciseSubmission.objects.filter(pk=responses[0].data["id"]).update(
+                status=ExerciseSubmission.DONE
+            )
+            self.assertEquals(
+                client.post(
+                    url, {"code": "const f = () => 1"}, format="json"
+                ).status_code,
+                202,
+            )
+            ExerciseSubmission.objects.update(status=ExerciseSubmission.DONE)
+            self.assertEquals(
+                client.post(
+                    url, {"code": "const f = () => 1"}, format="json"
+                ).status_code,
+                429,
+            )
+
+        with override_settings(GRADING_QUEUE_MAX_SIZE=0):
+            cache.clear()
+            self.assertEquals(
+                client.post(
+                    url, {"code": "const f = () => 1"}, format="json"
+                ).status_code,
+                429,
+            )
+
+    @override_settings(GRADE_SUBMISSIONS_ASYNC=True)
+    def test_concurrent_submissions(self):
+        from datetime import timedelta
+
+        from django.core.cache import cache
+        from django.utils import timezone
+
+        from training.throttles import SubmissionThrottle
+
+        cache.clear()
+        self.math_course.max_concurrent_submissions = 1
+        self.math_course.save()
+        other_course = Course.objects.create(name="other", creator=self.teacher)
+        other_exercise = ProgrammingExercise.objects.create(
+            text="abc",
+            topic=Topic.objects.create(name="topic", course=other_course),
+            course=other_course,
+            difficulty=AbstractItem.EASY,
+        )
+
+        def allow_request():
+            request = type("Request", (), {"user": self.student})
+            view = type("View", (), {"kwargs": {"course_pk": self.math_course.pk}})
+            return SubmissionThrottle().allow_request(request, view)
+
+        # submissions to other courses don't count
+        submission = ExerciseSubmission.objects.create(
+            user=self.student, exercise=other_exercise, code="// 0"
+        )
+        self.assertTrue(allow_request())
+
+        submission.exercise = self.exercise
+        submission.status = ExerciseSubmission.RUNNING
+        submission.grading_started = timezone.now()
+        submission.save()
+        self.assertFalse(allow_request())
+
+        # nor do submissions left running by a worker that died
+        submission.grading_started -= timedelta(hours=1)
+        submission.save()
+        self.assertTrue(allow_request())
+
+        # the token bucket isn't touched while another request holds it
+        cache.add(f"submission_bucket:{self.student.pk}:{self.math_course.pk}:lock", 1)
+        self.assertFalse(allow_request())
+
+    @override_settings(GRADE_SUBMISSIONS_ASYNC=False)
+    def test_killed_runs_are_not_cached(self):
+        from training.node.utils import get_killed_outputs
+
+        with patch(
+            "training.models.run_code_in_vm", return_value=get_killed_outputs(10)
+        ) as run_code_in_vm:
+            for _ in range(2):
+                submission = ExerciseSubmission.objects.create(
+                    user=self.student, exercise=self.exercise, code="while(true){}"
+                )
+
+        self.assertEquals(run_code_in_vm.call_count, 2)
+        self.assertEquals(submission.status, ExerciseSubmission.DONE)
+        self.assertIn("stopped", submission.error)
+
+    @override_settings(GRADE_SUBMISSIONS_ASYNC=False)
+    def test_timed_out_runs_are_not_cached(self):
+        # the vm's own timeout tripped, without node having to be killed
+        run_results = {
+            "error": "Execution timed out after 1000 ms",
+            "timed_out": True,
+            "time_ms": 1000,
+        }
+        with patch(
+            "training.models.run_code_in_vm", return_value=run_results
+        ) as run_code_in_vm:
+            for _ in range(2):
+                submission = ExerciseSubmission.objects.create(
+                    user=self.student, exercise=self.exercise, code="while(true){}"
+                )
+
+        self.assertEquals(run_code_in_vm.call_count, 2)
+        self.assertTrue(submission.timed_out)
+        self.assertFalse(submission.killed)
+
+    def test_circuit_breaker(self):
+        from training.node.process import CircuitBreaker, NodeUnavailableError
+
+        breaker = CircuitBreaker("test", threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        breaker.check()
+        breaker.record_failure()
+        with self.assertRaises(NodeUnavailableError):
+            breaker.check()
+
+        # once the reset timeout has passed, a successful call closes it again
+        breaker.reset_timeout = 0
+        breaker.check()
+        breaker.record_success()
+        breaker.reset_timeout = 60
+        breaker.check()
+
+    @override_settings(GRADE_SUBMISSIONS_ASYNC=False)
+    def test_grading_telemetry(self):
+        def get_timed_run_results(code, testcases_json):
+            run_results = self.get_run_results(code, testcases_json)
+            for test in run_results["tests"]:
+                test["time_ms"] = 0.5
+            return {**run_results, "time_ms": 4.2, "peak_rss_kb": 40000}
+
+        with patch("training.models.run_code_in_vm", side_effect=get_timed_run_results):
+            executed, reused = [
+                ExerciseSubmission.objects.create(
+                    user=self.student, exercise=self.exercise, code="const f = () => 1"
+                )
+                for _ in range(2)
+            ]
+
+        executed.refresh_from_db()
+        self.assertEquals(executed.execution_time_ms, 4)
+        self.assertEquals(executed.peak_memory_kb, 40000)
+        self.assertEquals(
+            list(
+                executed.testcaseoutcomethroughmodel_set.values_list(
+                    "execution_time_ms", flat=True
+                )
+            ),
+            [0.5, 0.5],
+        )
+        # the second submission was served from the cache and cost no time
+        reused.refresh_from_db()
+        self.assertIsNone(reused.execution_time_ms)
+        self.assertIsNone(
+            reused.testcaseoutcomethroughmodel_set.first().execution_time_ms
+        )
+
+        from training.node.utils import get_killed_outputs
+
+        with patch(
+            "training.models.run_code_in_vm", return_value=get_killed_outputs(10)
+        ):
+            ExerciseSubmission.objects.create(
+                user=self.student, exercise=self.exercise, code="while(true){}"
+            )
+
+        client = APIClient()
+        client.force_authenticate(user=self.teacher)
+        response = client.get(
+            f"/courses/{self.math_course.pk}/programming_exercises/grading_stats/"
+        )
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(
+            response.data,
+            [
+                {
+                    "exercise": self.exercise.pk,
+                    "graded": 3,
+                    "executed": 2,
+                    "p50_ms": 4,
+                    "p95_ms": 10000,
+                    "max_ms": 10000,
+                    "timeout_rate": 1 / 3,
+                    "kill_rate": 1 / 3,
+                }
+            ],
+        )
+
+        for days in ("0", str(10**10), "abc"):
+            response = client.get(
+                f"/courses/{self.math_course.pk}/programming_exercises/"
+                f"grading_stats/?days={days}"
+            )
+            self.assertEquals(response.status_code, 400)
+
+    @override_settings(GRADE_SUBMISSIONS_ASYNC=False)
+    def test_grading_query_count(self):
+        with patch("training.models.run_code_in_vm", side_effect=self.get_run_results):
+            # fetch testcases, insert submission, insert outcomes
+            with self.assertNumQueries(3):
+                ExerciseSubmission.objects.create(
+                    user=self.student, exercise=self.exercise, code="const f = () => 1"
+                )
+
+    @override_settings(GRADE_SUBMISSIONS_ASYNC=False)
+    def test_regrade(self):
+        from django.core.management import call_command
+
+        def get_failed_run_results(code, testcases_json):
+            return {
+                "tests": [
+                    {"id": t["id"], "assertion": t["assertion"], "passed": False}
+                    for t in testcases_json
+                ]
+            }
+
+        with patch(
+            "training.models.run_code_in_vm", side_effect=get_failed_run_results
+        ):
+            submission = ExerciseSubmission.objects.create(
+                user=self.student, exercise=self.exercise, code="const f = () => 1"
+            )
+
+        # testcases are fixed and the submission is regraded
+        self.testcase1.code = "assert.equal(f(), 1) // fixed"
+        self.testcase1.save()
+        with patch(
+            "training.management.commands.regrade.NodeWorkerPool.run",
+            side_effect=self.get_run_results,
+        ):
+            call_command("regrade", exercise_ids=[self.exercise.pk], stdout=StringIO())
+
+        self.assertEquals(submission.testcaseoutcomethroughmodel_set.count(), 2)
+        self.assertEquals(
+            submission.testcaseoutcomethroughmodel_set.filter(passed=True).count(), 2
+        )
+        self.assertFalse(Checkpoint.objects.exists())
+
+    @override_settings(GRADE_SUBMISSIONS_ASYNC=False)
+    def test_regrade_in_batch_vm(self):
+        from django.core.management import call_command
+
+        with patch("training.models.run_code_in_vm", side_effect=self.get_run_results):
+            submissions = [
+                ExerciseSubmission.objects.create(
+                    user=self.student,
+                    exercise=self.exercise,
+                    code=f"const f = () => {i}",
+                )
+                for i in range(3)
+            ]
+
+        def run_many_in_vm(jobs, chunk_size=None):
+            for submission_id, code, testcases_json in jobs:
+                yield submission_id, {"error": "Execution timed out after 1000 ms"}
+
+        with patch(
+            "training.management.commands.regrade.run_many_in_vm",
+            side_effect=run_many_in_vm,
+        ):
+            self.testcase1.delete()
+            call_command(
+                "regrade",
+                exercise_ids=[self.exercise.pk],
+                batch_vm=True,
+                workers=2,
+                stdout=StringIO(),
+            )
+
+        for submission in submissions:
+            submission.refresh_from_db()
+            self.assertEquals(submission.error, "Execution timed out after 1000 ms")
+            self.assertFalse(submission.testcaseoutcomethroughmodel_set.exists())
+
+
+# stands in for vm.js, following its protocol: submissions are identified by their
+# code, which can make node die or hang, and the code of each job is logged
+FAKE_VM_JS = """
+const fs = require('fs')
+const run = job => {
+  fs.appendFileSync(process.env.FAKE_VM_LOG, job.code + '\\n')
+  if (job.code === 'crash') process.kill(process.pid, 'SIGKILL')
+  if (job.code === 'hang') while (true) {}
+  return { tests: [] }
+}
+console.log(JSON.stringify({ ready: true }))
+if (process.argv[2] === '--worker' || process.argv[2] === '--batch') {
+  const rl = require('readline').createInterface({ input: process.stdin })
+  rl.on('line', line => {
+    const job = JSON.parse(line)
+    if (job.ping) return console.log(JSON.stringify({ pong: true }))
+    const ids = job.submission_id !== undefined ? { submission_id: job.submission_id } : { id: job.id }
+    console.log(JSON.stringify({ ...ids, ...run(job) }))
+  })
+  rl.on('close', () => process.exit(0))
+} else {
+  console.log(JSON.stringify(run({ code: process.argv[2] })))
+}
+"""
+
+
+@skipIf(shutil.which("node") is None, "node is not installed")
+@override_settings(NODE_VM_TIMEOUT=1)
+class NodeVmTestCase(SimpleTestCase):
+    def setUp(self):
+        from training.node.process import CircuitBreaker
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.vm_path = os.path.join(directory.name, "vm.js")
+        with open(self.vm_path, "w") as f:
+            f.write(FAKE_VM_JS)
+        self.log_path = os.path.join(directory.name, "log")
+        open(self.log_path, "w").close()
+
+        environ = patch.dict(os.environ, {"FAKE_VM_LOG": self.log_path})
+        environ.start()
+        self.addCleanup(environ.stop)
+
+        # opens on the first failure of node
+        self.breaker = CircuitBreaker("test", threshold=1, reset_timeout=60)
+
+    def get_logged_jobs(self):
+        with open(self.log_path) as f:
+            return f.read().split()
+
+    def get_pool(self, vm_path=None):
+        from training.node.pool import NodeWorkerPool
+
+        pool = NodeWorkerPool(
+            node_vm_path=vm_path or self.vm_path,
+            size=1,
+            max_jobs=10,
+            health_check_interval=30,
+        )
+        pool.breaker = self.breaker
+        self.addCleanup(pool.shutdown)
+        return pool
+
+    def test_submitted_code_killing_pool_workers(self):
+        from training.node.process import NodeCrashError, NodeTimeoutError
+
+        pool = self.get_pool()
+        self.assertEquals(pool.run("ok", []), {"tests": []})
+        with self.assertRaises(NodeCrashError):
+            pool.run("crash", [])
+        with self.assertRaises(NodeTimeoutError):
+            pool.run("hang", [])
+        self.assertEquals(pool.run("ok", []), {"tests": []})
+
+        # jobs that killed their worker aren't run again, nor do they count as
+        # failures of node
+        self.assertEquals(self.get_logged_jobs(), ["ok", "crash", "hang", "ok"])
+        self.breaker.check()
+
+    def test_node_failing_to_start(self):
+        from training.node.pool import NodeWorkerError
+        from training.node.process import NodeUnavailableError
+
+        broken_vm_path = os.path.join(os.path.dirname(self.vm_path), "broken.js")
+        with open(broken_vm_path, "w") as f:
+            f.write("process.exit(1)")
+
+        pool = self.get_pool(broken_vm_path)
+        with self.assertRaises(NodeWorkerError):
+            pool.run("ok", [])
+        with self.assertRaises(NodeUnavailableError):
+            self.breaker.check()
+
+    def test_submitted_code_killing_batch_runs(self):
+        from training.node.utils import (
+            get_crashed_outputs,
+            get_killed_outputs,
+            run_many_in_vm,
+        )
+
+        codes = ["ok", "crash", "ok", "hang", "ok"]
+        with patch.dict(os.environ, {"NODE_VM_PATH": self.vm_path}), patch(
+            "training.node.utils.get_breaker", return_value=self.breaker
+        ):
+            outputs = dict(
+                run_many_in_vm(
+                    [(pk, code, []) for pk, code in enumerate(codes)], chunk_size=5
+                )
+            )
+
+        self.assertEquals(
+            outputs,
+            {
+                0: {"tests": []},
+                1: get_crashed_outputs(),
+                2: {"tests": []},
+                3: get_killed_outputs(1),
+                4: {"tests": []},
+            },
+        )
+        self.assertEquals(self.get_logged_jobs(), codes)
+        self.breaker.check()
+
+    @override_settings(NODE_VM_POOL_SIZE=0)
+    def test_submitted_code_killing_node(self):
+        from training.node.utils import get_crashed_outputs, run_code_in_vm
+
+        with patch.dict(os.environ, {"NODE_VM_PATH": self.vm_path}), patch(
+            "training.node.utils.get_breaker", return_value=self.breaker
+        ):
+            self.assertEquals(run_code_in_vm("ok", []), {"tests": []})
+            self.assertEquals(run_code_in_vm("crash", []), get_crashed_outputs())
+            self.assertTrue(run_code_in_vm("hang", [])["timed_out"])
+        self.breaker.check()
+
+
+NODE_DIR = os.path.join(os.path.dirname(__file__), "node")
+
+
+def has_node_module(name, cwd=NODE_DIR):
+    # tests running the actual node scripts need their modules to be installed
+    if shutil.which("node") is None:
+        return False
+    return (
+        subprocess.run(
+            ["node", "-e", f"require('{name}')"], cwd=cwd, capture_output=True
+        ).returncode
+        == 0
+    )
+
+
+@skipIf(not has_node_module("vm2"), "vm2 is not installed")
+class VmSandboxTestCase(SimpleTestCase):
+    vm_path = os.path.join(NODE_DIR, "vm.js")
+
+    def setUp(self):
+        from training.node.process import CircuitBreaker
+
+        self.breaker = CircuitBreaker("test", threshold=1, reset_timeout=60)
+
+    def get_pool(self):
+        from training.node.pool import NodeWorkerPool
+
+        # a single worker runs all the jobs
+        pool = NodeWorkerPool(
+            node_vm_path=self.vm_path,
+            size=1,
+            max_jobs=10,
+            health_check_interval=30,
+            timeout=2,
+        )
+        pool.breaker = self.breaker
+        self.addCleanup(pool.shutdown)
+        return pool
+
+    def get_assertions(self, *assertions):
+        return [
+            {"id": pk, "assertion": assertion, "is_public": True}
+            for pk, assertion in enumerate(assertions)
+        ]
+
+    def test_submissions_cant_tamper_with_the_assertions_of_others(self):
+        pool = self.get_pool()
+        assertions = self.get_assertions("assert.equal(1, 2)")
+
+        pool.run("assert.equal = () => {}; AssertionError.prototype.x = 1", assertions)
+        outputs = pool.run("", assertions)
+        self.assertFalse(outputs["tests"][0]["passed"])
+        self.assertIn("expected value 2, but got 1", outputs["tests"][0]["error"])
+
+    def test_code_left_running_holds_up_its_own_job(self):
+        from training.node.process import NodeTimeoutError
+
+        pool = self.get_pool()
+        with self.assertRaises(NodeTimeoutError):
+            pool.run("Promise.resolve().then(() => { while (true) {} })", [])
+        # the next job runs on a fresh worker
+        self.assertTrue(pool.run("", self.get_assertions("1"))["tests"][0]["passed"])
+
+    def test_peak_memory_is_reported_per_job(self):
+        pool = self.get_pool()
+        first_peak = pool.run("", [])["peak_rss_kb"]
+        self.assertGreater(first_peak, 0)
+
+        # the peak of the process was reached by an earlier job
+        self.assertIsNone(pool.run("", [])["peak_rss_kb"])
+
+        code = "const a = []; for (let i = 0; i < 1e6; i++) a.push({ i })"
+        self.assertGreater(pool.run(code, [])["peak_rss_kb"], first_peak)
+
+    @override_settings(NODE_VM_TIMEOUT=2)
+    def test_batch_jobs_cant_affect_one_another(self):
+        from training.node.utils import get_killed_outputs, run_many_in_vm
+
+        assertions = self.get_assertions("assert.equal(1, 2)")
+        jobs = [
+            (0, "assert.equal = () => {}", assertions),
+            (1, "", assertions),
+            (2, "Promise.resolve().then(() => { while (true) {} })", []),
+            (3, "", assertions),
+        ]
+        with patch.dict(os.environ, {"NODE_VM_PATH": self.vm_path}), patch(
+            "training.node.utils.get_breaker", return_value=self.breaker
+        ):
+            outputs = dict(run_many_in_vm(jobs, chunk_size=4))
+
+        self.assertFalse(outputs[1]["tests"][0]["passed"])
+        # the job that left code running is the one that's killed
+        self.assertEquals(outputs[2], get_killed_outputs(2))
+        self.assertFalse(outputs[3]["tests"][0]["passed"])
+        self.breaker.check()
+
+
+TEX_RENDER_DIR = os.path.join(os.path.dirname(__file__), "tex-render")
+
+
+@skipIf(
+    not has_node_module("mathjax-full", cwd=TEX_RENDER_DIR),
+    "mathjax-full is not installed",
+)
+class MathJaxServerTestCase(SimpleTestCase):
+    def setUp(self):
+        from training.node.mathjax import MathJaxServer
+        from training.node.process import CircuitBreaker
+
+        self.server = MathJaxServer(
+            server_path=os.path.join(TEX_RENDER_DIR, "component", "tex2svg-server"),
+            timeout=30,
+        )
+        self.server.breaker = CircuitBreaker("test", threshold=1, reset_timeout=60)
+        self.addCleanup(self.server.shutdown)
+
+    def is_error(self, svg):
+        return 'data-mml-node="merror"' in svg
+
+    def test_definitions_dont_outlive_their_formula(self):
+        defining, using = self.server.render([r"\newcommand{\foo}{x} \foo", r"\foo"])
+        self.assertFalse(self.is_error(defining))
+        self.assertTrue(self.is_error(using))
+
+        # nor do they carry over to later requests
+        self.server.render([r"\renewcommand{\frac}[2]{#1} \frac{a}{b}"])
+        (svg,) = self.server.render([r"\frac{a}{b}"])
+        self.assertIn('data-mml-node="mfrac"', svg)
+        (svg,) = self.server.render([r"\foo"])
+        self.assertTrue(self.is_error(svg))
+
+
+class TexRenderingTestCase(TestCase):
+    def test_formulas_are_rendered_in_one_round_trip(self):
+        from training.tex import tex_to_svg
+
+        def render(formulas):
+            return [
+                None if formula == "bad" else f"<svg>{formula}</svg>"
+                for formula in formulas
+            ]
+
+        with patch("training.tex.render_new_formulas", side_effect=render) as renderer:
+            rendered = tex_to_svg("if $x &lt; 1$ then $$y$$, but not $bad$")
+
+        renderer.assert_called_once_with(["x \\lt 1", "y", "bad"])
+        self.assertEquals(
+            rendered,
+            'if <svg class="inline">x \\lt 1</svg> then '
+            "<p class='text-center'><svg class=\"inline\">y</svg></p>, "
+            "but not $bad$",
+        )
+
+    def test_rendered_formulas_are_cached(self):
+        from training.models import RenderedFormula
+        from training.tex import tex_to_svg
+
+        def render(formulas):
+            return [f"<svg>{formula}</svg>" for formula in formulas]
+
+        with patch("training.tex.render_new_formulas", side_effect=render) as renderer:
+            first = tex_to_svg("$\\frac{1}{2}$ and $\\log x$ and $\\frac{1}{2}$")
+            # whitespace doesn't make a formula different
+            second = tex_to_svg("$$\\log  x$$ and $\\frac{1}{2}$")
+
+        renderer.assert_called_once_with(["\\frac{1}{2}", "\\log x"])
+        self.assertIn('<svg class="inline">\\log x</svg>', second)
+        self.assertEquals(first.count("\\frac{1}{2}"), 2)
+
+        with override_settings(TEX_FORMULA_CACHE_MAX_ENTRIES=1):
+            with patch("training.tex.render_new_formulas", side_effect=render):
+                tex_to_svg("$y$")
+        self.assertEquals(
+            list(RenderedFormula.objects.values_list("source", flat=True)), ["y"]
+        )
+
+    @staticmethod
+    def render_with_glyphs(formulas):
+        # svgs with their glyphs in <defs>, like MathJax's
+        return [
+            '<svg style="vertical-align: -0.5ex;" '
+            'xmlns:xlink="http://www.w3.org/1999/xlink"><defs>'
+            + "".join(
+                f'<path id="MJX-{i}-TEX-I-{ord(c):X}" d="{c}-path"></path>'
+                for c in set(formula)
+            )
+            + "</defs><g>"
+            + "".join(
+                f'<use xlink:href="#MJX-{i}-TEX-I-{ord(c):X}"></use>' for c in formula
+            )
+            + "</g></svg>"
+            for i, formula in enumerate(formulas)
+        ]
+
+    def test_glyphs_are_served_in_a_shared_sprite(self):
+        from django.core.cache import cache
+
+        from training.models import TexGlyph
+        from training.tex import tex_to_svg_many
+
+        cache.clear()
+
+        with patch(
+            "training.tex.render_new_formulas", side_effect=self.render_with_glyphs
+        ):
+            first, second = tex_to_svg_many(["$xy$", "$$yx$$"])
+
+        self.assertNotIn("<defs>", first + second)
+        self.assertIn('xlink:href="#tex-glyph-TEX-I-78"', first)
+        self.assertIn('xlink:href="#tex-glyph-TEX-I-79"', second)
+        self.assertEquals(
+            dict(TexGlyph.objects.values_list("name", "path")),
+            {"TEX-I-78": "x-path", "TEX-I-79": "y-path"},
+        )
+
+        user_data_set_up(self)
+        course_topic_data_set_up(self)
+        client = APIClient()
+        client.force_authenticate(user=self.student)
+        sprite_url = client.get(f"/courses/{self.math_course.pk}/").data["tex_glyphs"]
+
+        response = client.get(sprite_url)
+        self.assertEquals(response.status_code, 200)
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertIn(
+            '<path id="tex-glyph-TEX-I-78" d="x-path">', response.content.decode()
+        )
+
+        # new glyphs make a new version of the sprite, old urls lead to it
+        with patch(
+            "training.tex.render_new_formulas", side_effect=self.render_with_glyphs
+        ):
+            with self.captureOnCommitCallbacks(execute=True):
+                tex_to_svg_many(["$z$"])
+        response = client.get(sprite_url)
+        self.assertEquals(response.status_code, 302)
+        self.assertIn("TEX-I-7A", client.get(response.url).content.decode())
+
+        # glyphs stored by other processes are picked up once the count expires
+        TexGlyph.objects.create(name="TEX-I-77", path="w-path")
+        cache.delete("tex_glyph_count")
+        response = client.get(response.url)
+        self.assertEquals(response.status_code, 302)
+        self.assertIn("TEX-I-77", client.get(response.url).content.decode())
+
+    def test_formulas_can_be_stored_as_images(self):
+        import os
+        import re
+        import tempfile
+
+        from training.tex import tex_to_svg
+
+        with tempfile.TemporaryDirectory() as media_root, override_settings(
+            TEX_FORMULA_ASSETS=True, MEDIA_ROOT=media_root
+        ), patch(
+            "training.tex.render_new_formulas", side_effect=self.render_with_glyphs
+        ):
+            rendered = tex_to_svg("if $x &lt; y$ then $$x$$")
+            urls = re.findall(r'src="([^"]+)"', rendered)
+
+            self.assertEquals(len(urls), 2)
+            self.assertIn(
+                '<img class="inline" src="/media/formulas/', rendered.split("then")[0]
+            )
+            self.assertIn('alt="x \\lt y" style="vertical-align: -0.5ex">', rendered)
+            self.assertIn("<p class='text-center'><img", rendered)
+
+            response = APIClient().get(urls[1])
+            self.assertEquals(response.status_code, 200)
+            self.assertIn("immutable", response["Cache-Control"])
+            # images embed the glyphs they use
+            image = b"".join(response.streaming_content).decode()
+            self.assertIn('<defs><path id="tex-glyph-TEX-I-78" d="x-path">', image)
+            self.assertNotIn("TEX-I-79", image)
+
+            # the same contents are stored once
+            self.assertIn(urls[1], tex_to_svg("$x$"))
+            self.assertEquals(len(os.listdir(os.path.join(media_root, "formulas"))), 2)
+
+    def test_renders_are_coalesced_per_question(self):
+        from django.core.cache import cache
+
+        from core.celery import render_tex_task
+
+        cache.clear()
+        user_data_set_up(self)
+        course_topic_data_set_up(self)
+
+        with patch("core.celery.render_tex_task.apply_async") as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                question = Question.objects.create(
+                    text="$x$",
+                    topic=self.topic_trigonometry,
+                    course=self.math_course,
+                    difficulty=AbstractItem.EASY,
+                )
+                for text in ("$1$", "$2$"):
+                    Choice.objects.create(question=question, text=text)
+
+            apply_async.assert_called_once_with(
+                kwargs={"model": "Question", "pk": question.pk}, countdown=5
+            )
+
+            # saving without changing any TeX doesn't render anything
+            question = Question.objects.get(pk=question.pk)
+            with self.captureOnCommitCallbacks(execute=True):
+                question.difficulty = AbstractItem.HARD
+                question.save()
+            apply_async.assert_called_once()
+
+        def render(formulas):
+            return [f"<svg>{formula}</svg>" for formula in formulas]
+
+        updated = Question.objects.get(pk=question.pk).updated
+        with patch("training.tex.render_new_formulas", side_effect=render) as renderer:
+            render_tex_task(model="Question", pk=question.pk)
+
+        renderer.assert_called_once_with(["x", "1", "2"])
+        question = Question.objects.get(pk=question.pk)
+        self.assertEquals(question.rendered_text, '<svg class="inline">x</svg>')
+        self.assertEquals(
+            [choice.rendered_text for choice in question.choices.all()],
+            ['<svg class="inline">1</svg>', '<svg class="inline">2</svg>'],
+        )
+        self.assertGreater(question.updated, updated)
+
+    def test_render_tex_command(self):
+        from django.core.management import call_command
+
+        user_data_set_up(self)
+        course_topic_data_set_up(self)
+        questions_data_set_up(self)
+        Question.objects.update(text="$x$")
+        Choice.objects.filter(question=self.trigo_q1).update(text="$y$")
+
+        def render(formulas):
+            return [f"<svg>{formula}</svg>" for formula in formulas]
+
+        # a previous run stopped after the first question
+        Checkpoint.save_progress("render_tex:Question", self.trigo_q1.pk)
+        with patch("training.tex.render_new_formulas", side_effect=render):
+            call_command("render_tex", workers=0, batch_size=2, stdout=StringIO())
+
+        self.assertEquals(
+            list(Question.objects.values_list("rendered_text", flat=True)),
+            [""] + ['<svg class="inline">x</svg>'] * 3,
+        )
+        self.assertEquals(
+            list(self.trigo_q1.choices.values_list("rendered_text", flat=True)),
+            ['<svg class="inline">y</svg>'] * 2,
+        )
+        self.assertFalse(Checkpoint.objects.exists())
+
+    def test_missing_items_are_retried_without_blocking(self):
+        from django.core.cache import cache
+
+        from core.celery import render_tex_task
+        from core.metrics import get_counters
+
+        cache.clear()
+        with patch("core.celery.time.sleep") as sleep:
+            result = render_tex_task.apply(kwargs={"model": "Question", "pk": 10000})
+
+        self.assertTrue(result.successful())
+        sleep.assert_not_called()
+        self.assertEquals(
+            get_counters(["tex.render.retries", "tex.render.missing"]),
+            {"tex.render.retries": 5, "tex.render.missing": 1},
+        )
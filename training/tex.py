@@ -1,63 +1,330 @@
 import base64
+import hashlib
 import os
 import re
-import subprocess
+from datetime import timedelta
 
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from django.utils.html import format_html
 
-# takes in a text that might contain TeX formulas wrapped between $ or $$ tags,
-# returns the original text unchanged if no $ tags are found, otherwise returns the original text
-# where all the TeX formulas have been converted to svg and substituted with the svg code
-def tex_to_svg(formula):
-    if formula is None:
-        return ""
-
-    output_str = ""
-
-    # tokenize the string splitting when you encounter $ tags
-    tokens = [t for t in re.split(r"(\$\$?[^\$]*\$\$?)", formula)]
-
-    for token in tokens:
-        # if this token starts with $, it's a TeX formula: pass it to node and convert to svg
-        if len(token) and token[0] == "$":
-            if token[1] == "$":  # double $ tag = centered formula
-                # strip off the $$ tags
-                stripped_token = token[2:-2]
-                output_str += "<p class='text-center'>"
-            else:
-                # strip off the $ tags
-                stripped_token = token[1:-1]
-
-            # prepend a backslash: this prevents issues if the TeX formula starts with a - character
-            # which node would otherwise interpret as an argument (the node script will remove this backslash)
-            # also convert the html entities for &, <, etc. to their LaTeX equivalents
-            stripped_token = "\\" + stripped_token.replace("&amp;", "& ").replace(
-                "&gt;", "\\gt "
-            ).replace("&lt;", "\\lt ").replace("&lte;", "\\le ").replace(
-                "&gte;", "\\ge "
+from training.node.process import get_breaker, run_node
+
+# formulas are rendered in display mode, then styled as inline or centered
+DISPLAY_MODE = True
+
+# glyphs are taken out of the svgs MathJax produces and served in a shared sprite,
+# which clients add to the page once: formulas reference them by their id in there
+GLYPH_ID_PREFIX = "tex-glyph-"
+# the sprite is cached per number of glyphs, which is looked up again every few
+# seconds: glyphs stored by other processes make it into the sprite even if the
+# cache isn't shared
+GLYPH_COUNT_CACHE_KEY = "tex_glyph_count"
+GLYPH_COUNT_CACHE_TIMEOUT = 10
+GLYPH_SPRITE_CACHE_TIMEOUT = 60 * 60
+
+# MathJax's local font cache puts the glyphs used by a formula in its <defs>, with ids
+# like MJX-1-TEX-I-1D465, i.e. the font variant and the code point of the character
+DEFS_RE = re.compile(r"<defs>(.*?)</defs>", re.DOTALL)
+GLYPH_PATH_RE = re.compile(r'<path id="MJX-(?:\d+-)?(TEX-[^"]+)" d="([^"]*)"></path>')
+GLYPH_REF_RE = re.compile(r'"#MJX-(?:\d+-)?(TEX-[^"]+)"')
+GLYPH_SPRITE_REF_RE = re.compile(rf'"#{GLYPH_ID_PREFIX}(TEX-[^"]+)"')
+
+# formulas can also be stored as content-hashed images, under `MEDIA_ROOT`
+FORMULA_IMAGES_DIR = "formulas"
+VERTICAL_ALIGN_RE = re.compile(r'style="(vertical-align:[^";]*);?"')
+
+
+def get_formula_source(token):
+    # strips off the $ or $$ tags and converts the html entities for &, <, etc. to
+    # their LaTeX equivalents
+    stripped_token = token[2:-2] if token[1] == "$" else token[1:-1]
+    return (
+        stripped_token.replace("&amp;", "& ")
+        .replace("&gt;", "\\gt ")
+        .replace("&lt;", "\\lt ")
+        .replace("&lte;", "\\le ")
+        .replace("&gte;", "\\ge ")
+    )
+
+
+def normalize_formula(formula):
+    # runs of whitespace are equivalent in TeX
+    return re.sub(r"\s+", " ", formula).strip()
+
+
+def get_formula_digest(formula, display=DISPLAY_MODE):
+    return hashlib.sha256(
+        f"{int(display)}:{normalize_formula(formula)}".encode()
+    ).hexdigest()
+
+
+def render_formulas(formulas):
+    """
+    Returns the svgs for a list of TeX formulas, with None for the ones that
+    couldn't be rendered. Formulas that were rendered before are served from the
+    `RenderedFormula` table; the least recently used ones are trimmed once there
+    are more than `TEX_FORMULA_CACHE_MAX_ENTRIES`
+    """
+    from training.models import RenderedFormula
+
+    digests = [get_formula_digest(formula) for formula in formulas]
+    cached = dict(
+        RenderedFormula.objects.filter(digest__in=set(digests)).values_list(
+            "digest", "svg"
+        )
+    )
+
+    now = timezone.now()
+    if cached:
+        # recency only needs to be roughly right: avoid a write per read
+        RenderedFormula.objects.filter(
+            digest__in=cached.keys(), last_used__lt=now - timedelta(hours=1)
+        ).update(last_used=now)
+
+    missing = {}  # digest -> formula, each distinct formula is rendered once
+    for digest, formula in zip(digests, formulas):
+        if digest not in cached:
+            missing.setdefault(digest, normalize_formula(formula))
+
+    if missing:
+        rendered = dict(
+            zip(
+                missing.keys(),
+                extract_glyphs(render_new_formulas(list(missing.values()))),
             )
+        )
+        RenderedFormula.objects.bulk_create(
+            [
+                RenderedFormula(
+                    digest=digest,
+                    source=missing[digest],
+                    display=DISPLAY_MODE,
+                    svg=svg,
+                    last_used=now,
+                )
+                for digest, svg in rendered.items()
+                if svg is not None
+            ],
+            ignore_conflicts=True,  # rendered concurrently by someone else
+        )
+        RenderedFormula.trim(settings.TEX_FORMULA_CACHE_MAX_ENTRIES)
+        cached.update(rendered)
+
+    return [cached[digest] for digest in digests]
+
+
+def extract_glyphs(svgs):
+    """
+    Takes the glyphs out of the <defs> of the given svgs, storing the ones that aren't
+    in the `TexGlyph` table yet, and points the svgs to them in the glyph sprite
+    """
+    from training.models import TexGlyph
+
+    glyphs = {}
+    stripped_svgs = []
+    for svg in svgs:
+        defs = DEFS_RE.search(svg or "")
+        # leave alone svgs with definitions other than glyphs
+        if defs is None or GLYPH_PATH_RE.sub("", defs.group(1)):
+            stripped_svgs.append(svg)
+            continue
 
-            res = subprocess.check_output(
-                [
-                    "node",
-                    "-r",
-                    "esm",
-                    os.environ.get(
-                        "NODE_TEX2SVG_URL", "training/tex-render/component/tex2svg"
-                    ),
-                    stripped_token,
-                ],
+        glyphs.update(GLYPH_PATH_RE.findall(defs.group(1)))
+        stripped_svgs.append(
+            GLYPH_REF_RE.sub(
+                rf'"#{GLYPH_ID_PREFIX}\1"', svg[: defs.start()] + svg[defs.end() :]
             )
-            # strip off the "b'" and "\n'"
-            rendered_token = str(res)[2:-3]
-            svg_occurrence = rendered_token.find("<svg") + 4
-            rendered_token = (
-                rendered_token[:svg_occurrence]
-                + ' class="inline"'
-                + rendered_token[svg_occurrence:]
+        )
+
+    new_glyphs = glyphs.keys() - set(
+        TexGlyph.objects.filter(name__in=glyphs.keys()).values_list("name", flat=True)
+    )
+    if new_glyphs:
+        TexGlyph.objects.bulk_create(
+            [TexGlyph(name=name, path=glyphs[name]) for name in new_glyphs],
+            ignore_conflicts=True,  # stored concurrently by someone else
+        )
+        # glyphs are only ever added, so the sprite only needs to be rebuilt now
+        transaction.on_commit(lambda: cache.delete(GLYPH_COUNT_CACHE_KEY))
+
+    return stripped_svgs
+
+
+def get_glyph_sprite():
+    """
+    Returns a (version, svg) pair for the sprite of all the glyphs used by formulas.
+    The version is a hash of the contents, so the sprite can be cached indefinitely
+    under a url containing it
+    """
+    from training.models import TexGlyph
+
+    count = cache.get(GLYPH_COUNT_CACHE_KEY)
+    if count is None:
+        count = TexGlyph.objects.count()
+        cache.set(GLYPH_COUNT_CACHE_KEY, count, GLYPH_COUNT_CACHE_TIMEOUT)
+
+    sprite = cache.get(f"tex_glyph_sprite:{count}")
+    if sprite is None:
+        glyphs = list(TexGlyph.objects.order_by("name").values_list("name", "path"))
+        paths = "".join(
+            f'<path id="{GLYPH_ID_PREFIX}{name}" d="{path}"></path>'
+            for name, path in glyphs
+        )
+        svg = (
+            '<svg xmlns="http://www.w3.org/2000/svg" style="display: none">'
+            f"<defs>{paths}</defs></svg>"
+        )
+        sprite = (hashlib.sha256(svg.encode()).hexdigest()[:16], svg)
+        # glyphs might have been added since they were counted: the sprite is cached
+        # under the number of glyphs it actually has
+        cache.set(f"tex_glyph_sprite:{len(glyphs)}", sprite, GLYPH_SPRITE_CACHE_TIMEOUT)
+
+    return sprite
+
+
+def get_formula_image_name(image):
+    return f"{FORMULA_IMAGES_DIR}/{hashlib.sha256(image.encode()).hexdigest()}.svg"
+
+
+def store_formula_images(svgs, sources):
+    """
+    Stores the given svgs as files named after the hash of their contents, returning
+    <img> tags that point to them, or None for missing svgs. Images can't reference
+    the glyph sprite, so the glyphs they use are embedded back into the files
+    """
+    from training.models import TexGlyph
+
+    glyphs = dict(
+        TexGlyph.objects.filter(
+            name__in={
+                name
+                for svg in svgs
+                if svg is not None
+                for name in GLYPH_SPRITE_REF_RE.findall(svg)
+            }
+        ).values_list("name", "path")
+    )
+
+    images = []
+    for svg, source in zip(svgs, sources):
+        if svg is None:
+            images.append(None)
+            continue
+
+        # the svg element, without the container MathJax wraps it in
+        image = svg[svg.find("<svg") : svg.rfind("</svg>") + len("</svg>")]
+        paths = "".join(
+            f'<path id="{GLYPH_ID_PREFIX}{name}" d="{glyphs[name]}"></path>'
+            for name in dict.fromkeys(GLYPH_SPRITE_REF_RE.findall(image))
+            if name in glyphs
+        )
+        if paths:
+            tag_end = image.find(">") + 1
+            image = image[:tag_end] + f"<defs>{paths}</defs>" + image[tag_end:]
+
+        name = get_formula_image_name(image)
+        if not default_storage.exists(name):
+            default_storage.save(name, ContentFile(image.encode()))
+
+        # the baseline of the formula is kept aligned with the surrounding text
+        style = VERTICAL_ALIGN_RE.search(image)
+        images.append(
+            format_html(
+                '<img src="{}" alt="{}"{}>',
+                default_storage.url(name),
+                normalize_formula(source),
+                format_html(' style="{}"', style.group(1)) if style else "",
             )
-            output_str += rendered_token
-            if token[1] == "$":  # close <p> tag
-                output_str += "</p>"
-        else:
-            output_str += token
-    return output_str
+        )
+
+    return images
+
+
+def render_new_formulas(formulas):
+    if settings.NODE_TEX_SERVER:
+        from training.node.mathjax import get_mathjax_server
+
+        # all the formulas are rendered in one round trip to the MathJax server
+        return get_mathjax_server().render(formulas)
+
+    svgs = []
+    for formula in formulas:
+        # prepend a backslash: this prevents issues if the TeX formula starts with a - character
+        # which node would otherwise interpret as an argument (the node script will remove this backslash)
+        res = run_node(
+            [
+                "-r",
+                "esm",
+                os.environ.get(
+                    "NODE_TEX2SVG_URL", "training/tex-render/component/tex2svg"
+                ),
+                "\\" + formula,
+            ],
+            timeout=settings.NODE_TEX_TIMEOUT,
+            breaker=get_breaker("tex"),
+        )
+        svgs.append(res.decode().rstrip("\n"))
+    return svgs
+
+
+def tokenize(text):
+    # splits a text into plain text and TeX formulas, i.e. tokens starting with $
+    return [t for t in re.split(r"(\$\$?[^\$]*\$\$?)", text or "")]
+
+
+def is_formula(token):
+    return len(token) and token[0] == "$"
+
+
+def render_token(token, rendered_token):
+    if rendered_token is None:  # leave formulas that failed to render as they are
+        return token
+
+    tag = "<img" if rendered_token.startswith("<img") else "<svg"
+    svg_occurrence = rendered_token.find(tag) + 4
+    rendered_token = (
+        rendered_token[:svg_occurrence]
+        + ' class="inline"'
+        + rendered_token[svg_occurrence:]
+    )
+    if token[1] == "$":  # double $ tag = centered formula
+        rendered_token = "<p class='text-center'>" + rendered_token + "</p>"
+    return rendered_token
+
+
+def tex_to_svg_many(texts):
+    """
+    Same as `tex_to_svg` for a list of texts, rendering the formulas of all of them
+    in one go
+    """
+    tokenized_texts = [tokenize(text) for text in texts]
+    sources = [
+        get_formula_source(token)
+        for tokens in tokenized_texts
+        for token in tokens
+        if is_formula(token)
+    ]
+    svgs = render_formulas(sources)
+    if settings.TEX_FORMULA_ASSETS:
+        svgs = store_formula_images(svgs, sources)
+    svgs = iter(svgs)
+
+    return [
+        "".join(
+            render_token(token, next(svgs)) if is_formula(token) else token
+            for token in tokens
+        )
+        for tokens in tokenized_texts
+    ]
+
+
+# takes in a text that might contain TeX formulas wrapped between $ or $$ tags,
+# returns the original text unchanged if no $ tags are found, otherwise returns the original text
+# where all the TeX formulas have been converted to svg and substituted with the svg code
+def tex_to_svg(formula):
+    return tex_to_svg_many([formula])[0]
@@ -0,0 +1,91 @@
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+
+from training.models import Course, ExerciseSubmission
+
+
+def get_course_limit(course, field, default):
+    value = getattr(course, field)
+    return default if value is None else value
+
+
+@contextmanager
+def bucket_lock(key, attempts=20, interval=0.01):
+    # `add` only succeeds for the first of concurrent callers
+    lock_key = f"{key}:lock"
+    for _ in range(attempts):
+        if cache.add(lock_key, True, timeout=5):
+            try:
+                yield True
+            finally:
+                cache.delete(lock_key)
+            return
+        time.sleep(interval)
+    yield False
+
+
+class SubmissionThrottle(BaseThrottle):
+    """
+    Admission control for programming exercise submissions. A submission is refused
+    if the grading queue is full, if its user already has `max_concurrent_submissions`
+    submissions to the course waiting to be graded, or if the user's token bucket for
+    the course is empty: `submission_burst` submissions can be sent in a row, after which one more
+    is allowed every 60 / `submission_rate` seconds.
+
+    The checks are made in this order and the first failing one stops the others,
+    so refused submissions don't spend tokens. Limits can be set per course, and
+    default to the ones in the settings
+    """
+
+    def get_bucket_key(self, request, course):
+        return f"submission_bucket:{request.user.pk}:{course.pk}"
+
+    def allow_request(self, request, view):
+        self.retry_after = settings.GRADING_RETRY_AFTER
+        course = Course.objects.only(
+            "submission_rate", "submission_burst", "max_concurrent_submissions"
+        ).get(pk=view.kwargs["course_pk"])
+
+        if settings.GRADE_SUBMISSIONS_ASYNC:
+            pending = ExerciseSubmission.objects.filter(
+                status=ExerciseSubmission.PENDING
+            )
+            if pending.count() >= settings.GRADING_QUEUE_MAX_SIZE:
+                return False
+
+            not_graded = ExerciseSubmission.objects.not_graded().filter(
+                user=request.user, exercise__course_id=course.pk
+            )
+            if not_graded.count() >= get_course_limit(
+                course, "max_concurrent_submissions", settings.SUBMISSION_CONCURRENCY
+            ):
+                return False
+
+        rate = get_course_limit(course, "submission_rate", settings.SUBMISSION_RATE)
+        burst = get_course_limit(course, "submission_burst", settings.SUBMISSION_BURST)
+        rate /= 60  # tokens per second
+
+        # the bucket is read and written by one request at a time
+        key = self.get_bucket_key(request, course)
+        with bucket_lock(key) as acquired:
+            if not acquired:
+                return False
+
+            now = time.time()
+            tokens, last_refill = cache.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - last_refill) * rate)
+
+            if tokens < 1:
+                self.retry_after = (1 - tokens) / rate if rate else None
+                return False
+
+            # the bucket is full again once it's been left alone long enough
+            cache.set(key, (tokens - 1, now), int(burst / rate) + 1 if rate else None)
+            return True
+
+    def wait(self):
+        return self.retry_after
@@ -1,3 +1,6 @@
+from urllib.parse import urlparse
+
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 from rest_framework_nested import routers
@@ -48,4 +51,12 @@ urlpatterns = [
     path("", include(router.urls)),
     path("", include(course_router.urls)),
     path("", include(topic_router.urls)),
+    path("tex_glyphs/<str:version>.svg", views.tex_glyphs, name="tex-glyphs"),
+    # formula images are stored under `MEDIA_ROOT`: this serves them, with long-lived
+    # cache headers, unless `MEDIA_URL` points to somewhere else
+    path(
+        urlparse(settings.MEDIA_URL).path.lstrip("/") + "formulas/<str:digest>.svg",
+        views.tex_formula,
+        name="tex-formula",
+    ),
 ]
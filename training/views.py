@@ -1,7 +1,16 @@
+import re
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
 from django.db import IntegrityError, transaction
-from django.db.models import Q
-from django.shortcuts import get_object_or_404
+from django.db.models import Prefetch, Q
+from django.http import FileResponse, Http404, HttpResponse
+from django.shortcuts import get_object_or_404, redirect
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
 from django.utils.decorators import method_decorator
 from django.views.decorators.cache import cache_page
 from django_filters.rest_framework import DjangoFilterBackend
@@ -12,13 +21,30 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from training import difficulty_profiles, texts
+from training.access import get_course_access
+from training.cache import (
+    TRAINING_TEMPLATES_CACHE_TIMEOUT,
+    get_training_templates_cache_key,
+)
 from training.filters import (
     OwnedOnlyTrainingTemplates,
     StudentOrAllowedCoursesOnly,
     TeacherOrPersonalTrainingSessionsOnly,
 )
-from training.logic import get_concrete_difficulty_profile_amounts, get_items
-from training.models import ExerciseSubmission, ProgrammingExercise, TrainingTemplate
+from training.logic import (
+    get_concrete_difficulty_profile_amounts,
+    get_grading_stats,
+    get_items,
+    get_percentile,
+)
+from training.models import (
+    ExerciseSubmission,
+    ProgrammingExercise,
+    QuestionStats,
+    TestCaseOutcomeThroughModel,
+    TrainingTemplate,
+    TrainingTemplateRule,
+)
 from training.pagination import CourseItemPagination
 from training.permissions import (
     AllowedTeacherOrEnrolledOnly,
@@ -29,9 +55,12 @@ from training.permissions import (
 )
 from training.serializers import (
     ProgrammingExerciseSerializer,
+    QuestionStatsSerializer,
     SubmissionSerializer,
     TrainingTemplateSerializer,
 )
+from training.tex import FORMULA_IMAGES_DIR, get_glyph_sprite
+from training.throttles import SubmissionThrottle
 
 from .models import Course, Question, Topic, TrainingSession
 from .serializers import (
@@ -44,6 +73,39 @@ from .serializers import (
 )
 
 
+def tex_glyphs(request, version):
+    """
+    Serves the sprite of the glyphs referenced by rendered formulas. Its url contains
+    the version of the sprite, so responses can be cached indefinitely
+    """
+    current_version, svg = get_glyph_sprite()
+    if version != current_version:
+        # glyphs are only ever added, so the current sprite works for any formula
+        return redirect("tex-glyphs", version=current_version)
+
+    response = HttpResponse(svg, content_type="image/svg+xml")
+    patch_cache_control(
+        response, public=True, max_age=60 * 60 * 24 * 365, immutable=True
+    )
+    return response
+
+
+def tex_formula(request, digest):
+    """
+    Serves a formula stored as an image. Images are named after the hash of their
+    contents, so responses can be cached indefinitely
+    """
+    name = f"{FORMULA_IMAGES_DIR}/{digest}.svg"
+    if not re.fullmatch(r"[0-9a-f]{64}", digest) or not default_storage.exists(name):
+        raise Http404
+
+    response = FileResponse(default_storage.open(name), content_type="image/svg+xml")
+    patch_cache_control(
+        response, public=True, max_age=60 * 60 * 24 * 365, immutable=True
+    )
+    return response
+
+
 class TrainingSessionViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = TrainingSessionSerializer
     queryset = TrainingSession.objects.all()
@@ -182,8 +244,29 @@ class TrainingTemplateViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         queryset = super().get_queryset()
-        return queryset.filter(course=self.kwargs["course_pk"])
+        return queryset.filter(course=self.kwargs["course_pk"]).prefetch_related(
+            Prefetch(
+                "trainingtemplaterule_set",
+                queryset=TrainingTemplateRule.objects.select_related("topic"),
+            )
+        )
+
+    def list(self, request, *args, **kwargs):
+        if request.user.is_teacher:
+            return super().list(request, *args, **kwargs)
 
+        # students are shown this list before every session
+        cache_key = get_training_templates_cache_key(
+            self.kwargs["course_pk"], request.user.pk
+        )
+        data = cache.get(cache_key)
+        if data is None:
+            data = super().list(request, *args, **kwargs).data
+            cache.set(cache_key, data, TRAINING_TEMPLATES_CACHE_TIMEOUT)
+        return Response(data)
+
+    # rules are written after their template: the templates cached for the course are
+    # dropped once both are committed
     @transaction.atomic
     def create(self, request, *args, **kwargs):
         return super().create(request, *args, **kwargs)
@@ -298,6 +381,26 @@ class QuestionViewSet(viewsets.ModelViewSet):
     def update(self, request, *args, **kwargs):
         return super().update(request, *args, **kwargs)
 
+    @action(
+        detail=False,
+        methods=["get"],
+        permission_classes=[
+            IsAuthenticated,
+            TeachersOnly,
+            AllowedTeacherOrEnrolledOnly,
+        ],
+    )
+    def stats(self, request, **kwargs):
+        # stats are computed in batch by the `compute_question_stats` command
+        ordering = request.query_params.get("ordering", "question")
+        if ordering.lstrip("-") not in ("question", "p_value", "discrimination"):
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+        stats = QuestionStats.objects.filter(
+            question__in=self.get_queryset().values("pk")
+        ).order_by(ordering)
+        return Response(QuestionStatsSerializer(stats, many=True).data)
+
 
 class ProgrammingExerciseViewSet(viewsets.ModelViewSet):
     serializer_class = ProgrammingExerciseSerializer
@@ -333,6 +436,7 @@ class ProgrammingExerciseViewSet(viewsets.ModelViewSet):
         detail=True,
         methods=["post"],
         permission_classes=[IsAuthenticated, AllowedTeacherOrEnrolledOnly],
+        throttle_classes=[SubmissionThrottle],
     )
     def submit(self, request, **kwargs):
         try:
@@ -343,6 +447,29 @@ class ProgrammingExerciseViewSet(viewsets.ModelViewSet):
         except KeyError:
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
+        serializer = SubmissionSerializer(instance=submission)
+        if submission.status != ExerciseSubmission.DONE:
+            # grading happens in the background: the client polls `submission_status`
+            return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+        return Response(serializer.data)
+
+    @action(
+        detail=True,
+        methods=["get"],
+        url_path=r"submissions/(?P<submission_pk>[^/.]+)",
+        permission_classes=[IsAuthenticated, AllowedTeacherOrEnrolledOnly],
+    )
+    def submission_status(self, request, submission_pk, **kwargs):
+        submission = get_object_or_404(
+            ExerciseSubmission.objects.filter(
+                user=request.user, exercise_id=kwargs["pk"]
+            ),
+            pk=submission_pk,
+        )
+
+        if submission.status != ExerciseSubmission.DONE:
+            return Response({"id": submission.pk, "status": submission.status})
+
         serializer = SubmissionSerializer(instance=submission)
         return Response(serializer.data)
 
@@ -358,6 +485,78 @@ class ProgrammingExerciseViewSet(viewsets.ModelViewSet):
         serializer.is_valid()
         return Response(serializer.data)
 
+    def _get_grading_stats_since(self, request):
+        # stats cover the submissions of the last `days` days, up to ten years
+        days = int(request.query_params.get("days", 30))
+        if not 0 < days <= 3650:
+            raise ValueError(f"days must be between 1 and 3650, got {days}")
+        return timezone.now() - timedelta(days=days)
+
+    @action(
+        detail=False,
+        methods=["get"],
+        permission_classes=[
+            IsAuthenticated,
+            TeachersOnly,
+            AllowedTeacherOrEnrolledOnly,
+        ],
+    )
+    def grading_stats(self, request, **kwargs):
+        try:
+            since = self._get_grading_stats_since(request)
+        except ValueError:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+        runs = defaultdict(list)
+        for exercise_id, *run in ExerciseSubmission.objects.filter(
+            exercise__in=self.get_queryset().values("pk"),
+            status=ExerciseSubmission.DONE,
+            timestamp__gte=since,
+        ).values_list("exercise_id", "execution_time_ms", "timed_out", "killed"):
+            runs[exercise_id].append(run)
+
+        return Response(
+            [
+                {"exercise": exercise_id, **get_grading_stats(exercise_runs)}
+                for exercise_id, exercise_runs in sorted(runs.items())
+            ]
+        )
+
+    @action(
+        detail=True,
+        methods=["get"],
+        permission_classes=[
+            IsAuthenticated,
+            TeachersOnly,
+            AllowedTeacherOrEnrolledOnly,
+        ],
+    )
+    def testcase_stats(self, request, **kwargs):
+        try:
+            since = self._get_grading_stats_since(request)
+        except ValueError:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+        times = defaultdict(list)
+        for testcase_id, time in TestCaseOutcomeThroughModel.objects.filter(
+            submission__exercise=self.get_object(),
+            submission__timestamp__gte=since,
+            execution_time_ms__isnull=False,
+        ).values_list("testcase_id", "execution_time_ms"):
+            times[testcase_id].append(time)
+
+        return Response(
+            [
+                {
+                    "testcase": testcase_id,
+                    "executed": len(testcase_times),
+                    "p50_ms": get_percentile(sorted(testcase_times), 50),
+                    "p95_ms": get_percentile(sorted(testcase_times), 95),
+                }
+                for testcase_id, testcase_times in sorted(times.items())
+            ]
+        )
+
     @action(detail=False, methods=["get"])
     def bulk_get(self, request, **kwargs):
         try:
@@ -367,7 +566,7 @@ class ProgrammingExerciseViewSet(viewsets.ModelViewSet):
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
         exercises = []
-        course = get_object_or_404(Course, pk=self.kwargs["course_pk"])
+        course = get_course_access(request, self).course
 
         for pk in id_list:
             exercise = get_object_or_404(course.programmingexercises.all(), pk=pk)
@@ -392,7 +591,7 @@ class ProgrammingExerciseViewSet(viewsets.ModelViewSet):
         except (KeyError, ValueError):
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
-        course = get_object_or_404(Course, pk=self.kwargs["course_pk"])
+        course = get_course_access(request, self).course
         topic = get_object_or_404(course.topics.all(), pk=topic_id)
 
         exercises = get_items(
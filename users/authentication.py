@@ -0,0 +1,65 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+
+
+def get_token_cache_key(keyword, key):
+    # tokens are credentials: keep them out of cache keys
+    digest = hashlib.sha256(f"{keyword.lower()} {key}".encode()).hexdigest()
+    return f"auth_token:{digest}"
+
+
+class CachedTokenAuthentication(BaseAuthentication):
+    """
+    Authenticates with the classes in `CACHED_AUTHENTICATION_CLASSES`, caching the
+    user and token a token resolves to for `AUTH_TOKEN_CACHE_TIMEOUT` seconds, so
+    that most requests don't hit the database to authenticate. Tokens are dropped
+    from the cache when they're deleted, e.g. on logout, and when their user
+    changes, e.g. is deactivated: this relies on all processes sharing the cache
+    """
+
+    def __init__(self):
+        self.authenticators = [
+            import_string(path)() for path in settings.CACHED_AUTHENTICATION_CLASSES
+        ]
+
+    def get_cache_key(self, request):
+        auth = get_authorization_header(request).split()
+        if len(auth) != 2:
+            return None
+        try:
+            return get_token_cache_key(auth[0].decode(), auth[1].decode())
+        except UnicodeError:
+            return None
+
+    def get_cache_timeout(self, token):
+        timeout = settings.AUTH_TOKEN_CACHE_TIMEOUT
+        expires = getattr(token, "expires", None)  # oauth access tokens expire
+        if expires is not None:
+            timeout = min(timeout, (expires - timezone.now()).total_seconds())
+        return timeout
+
+    def authenticate(self, request):
+        cache_key = self.get_cache_key(request)
+        if cache_key is not None:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        # malformed credentials are left for the wrapped classes to reject
+        for authenticator in self.authenticators:
+            user_auth_tuple = authenticator.authenticate(request)
+            if user_auth_tuple is not None:
+                timeout = self.get_cache_timeout(user_auth_tuple[1])
+                if cache_key is not None and timeout > 0:
+                    cache.set(cache_key, user_auth_tuple, timeout)
+                return user_auth_tuple
+
+        return None
+
+    def authenticate_header(self, request):
+        return self.authenticators[0].authenticate_header(request)
@@ -1,6 +1,8 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 
+import users.signals
+
 
 class User(AbstractUser):
     is_teacher = models.BooleanField(default=False)
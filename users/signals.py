@@ -0,0 +1,39 @@
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from users.authentication import get_token_cache_key
+
+
+@receiver(post_delete, sender="authtoken.Token")
+def forget_auth_token(sender, instance, **kwargs):
+    cache.delete(get_token_cache_key("Token", instance.key))
+
+
+@receiver(post_save, sender="oauth2_provider.AccessToken")
+@receiver(post_delete, sender="oauth2_provider.AccessToken")
+def forget_access_token(sender, instance, **kwargs):
+    cache.delete(get_token_cache_key("Bearer", instance.token))
+
+
+@receiver(post_save, sender="users.User")
+def forget_user_tokens(sender, instance, created, **kwargs):
+    # cached tokens carry a snapshot of their user, e.g. of `is_active`
+    if created:
+        return
+
+    from oauth2_provider.models import AccessToken
+    from rest_framework.authtoken.models import Token
+
+    cache.delete_many(
+        [
+            get_token_cache_key("Token", key)
+            for key in Token.objects.filter(user=instance).values_list("key", flat=True)
+        ]
+        + [
+            get_token_cache_key("Bearer", token)
+            for token in AccessToken.objects.filter(user=instance).values_list(
+                "token", flat=True
+            )
+        ]
+    )
@@ -1,3 +1,50 @@
+from django.core.cache import cache
 from django.test import TestCase
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from users.models import User
+
+
+class CachedTokenAuthenticationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = User.objects.create(
+            username="teacher",
+            email="teacher@unipi.it",
+        )
+        self.token = Token.objects.create(user=self.teacher)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+    def get_teachers(self):
+        return self.client.get("/users/teachers/")
+
+    def test_tokens_are_resolved_from_the_cache(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        self.assertEquals(self.get_teachers().status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEquals(self.get_teachers().status_code, 200)
+        self.assertFalse(
+            [query for query in queries if "authtoken_token" in query["sql"]]
+        )
+
+    def test_deleted_tokens_are_rejected(self):
+        self.assertEquals(self.get_teachers().status_code, 200)
+
+        # e.g. on logout
+        self.token.delete()
+        self.assertEquals(self.get_teachers().status_code, 401)
+
+    def test_user_changes_are_seen_right_away(self):
+        self.assertEquals(self.get_teachers().status_code, 200)
+
+        self.teacher.is_teacher = False
+        self.teacher.save()
+        self.assertEquals(self.get_teachers().status_code, 403)
+
+        self.teacher.is_active = False
+        self.teacher.save()
+        self.assertEquals(self.get_teachers().status_code, 401)
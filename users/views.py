@@ -3,10 +3,14 @@ from rest_framework import generics, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from training.access import get_course_access
 from training.filters import StudentOrAllowedCoursesOnly
-from training.models import Course
-from training.permissions import TeachersOnly
-from training.serializers import TrainingSessionOutcomeSerializer
+from training.models import TopicProgress
+from training.permissions import AllowedTeacherOrEnrolledOnly, TeachersOnly
+from training.serializers import (
+    TopicProgressSerializer,
+    TrainingSessionOutcomeSerializer,
+)
 
 from .models import User
 from .serializers import UserSerializer
@@ -32,9 +36,7 @@ class EnrolledStudentsViewSet(viewsets.ModelViewSet):
     # filter_backends = [StudentOrAllowedCoursesOnly]
 
     def get_queryset(self):
-        course = Course.objects.get(
-            pk=self.kwargs["course_pk"]
-        )  # TODO check filtering, permissions, 404
+        course = get_course_access(self.request, self).course  # TODO check filtering
         return course.enrolled_students.all()
 
     @action(detail=True, methods=["get"])
@@ -53,3 +55,47 @@ class EnrolledStudentsViewSet(viewsets.ModelViewSet):
             },
         )
         return Response(serializer.data)
+
+    @action(
+        detail=True,
+        methods=["get"],
+        permission_classes=[
+            IsAuthenticated,
+            TeachersOnly,
+            AllowedTeacherOrEnrolledOnly,
+        ],
+    )
+    def topics(self, request, **kwargs):
+        """
+        Returns the student's answered/correct counters for each topic of the course
+        they have answered questions of
+        """
+        user = self.get_object()
+        progress = TopicProgress.objects.filter(
+            user=user, topic__course_id=self.kwargs["course_pk"]
+        ).order_by("topic_id")
+
+        serializer = TopicProgressSerializer(progress, many=True)
+        return Response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=["get"],
+        permission_classes=[
+            IsAuthenticated,
+            TeachersOnly,
+            AllowedTeacherOrEnrolledOnly,
+        ],
+    )
+    def heatmap(self, request, **kwargs):
+        """
+        Returns the counters of all the enrolled students for all the topics of the
+        course, in one query
+        """
+        progress = TopicProgress.objects.filter(
+            topic__course_id=self.kwargs["course_pk"],
+            user__in=self.get_queryset(),
+        ).order_by("user_id", "topic_id")
+
+        serializer = TopicProgressSerializer(progress, many=True)
+        return Response(serializer.data)